@@ -0,0 +1,4 @@
+###################################
+# QMASM benchmark suite           #
+# By Scott Pakin <pakin@lanl.gov> #
+###################################
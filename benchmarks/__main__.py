@@ -0,0 +1,195 @@
+###################################
+# Benchmark QMASM's pipeline      #
+# By Scott Pakin <pakin@lanl.gov> #
+###################################
+
+import argparse
+import atexit
+import glob
+import json
+import os
+import qmasm
+import shutil
+import sys
+import tempfile
+from .families import Emitter, families, parse_size, program_lines
+from .runner import run_case, environment_info, compare_to_baseline
+
+# Directories of interest
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+top_dir = os.path.dirname(bench_dir)
+examples_dir = os.path.join(top_dir, "examples")
+
+def parse_command_line():
+    "Parse the benchmark command line.  Return an argparse.Namespace."
+    cl_parser = argparse.ArgumentParser(prog="python -m benchmarks",
+                                        description="Measure QMASM's pipeline stages on the examples and on generated problems")
+    cl_parser.add_argument("-v", "--verbose", action="count", default=0,
+                           help="increase output verbosity (can be specified repeatedly)")
+    cl_parser.add_argument("-m", "--embed-method", action="append", choices=["dwave", "dense", "layout", "portfolio", "none"],
+                           help='embedding algorithm to benchmark (can be specified repeatedly; default: all; "none" measures only the pre-embedding stages)')
+    cl_parser.add_argument("-e", "--example", action="append", metavar="NAME",
+                           help="example program to benchmark (can be specified repeatedly; default: all examples/*.qmasm)")
+    cl_parser.add_argument("--no-examples", action="store_true",
+                           help="benchmark only generated problems")
+    cl_parser.add_argument("-f", "--family", action="append", metavar="NAME[:SIZE,...]",
+                           help="family of generated problems (%s) and optional sizes to benchmark (can be specified repeatedly; default: all families at default sizes)" % ", ".join(sorted(families.keys())))
+    cl_parser.add_argument("--no-families", action="store_true",
+                           help="benchmark only the examples")
+    cl_parser.add_argument("-O", type=int, nargs="?", const=1, default=1, metavar="LEVEL",
+                           help="QMASM optimization level (default: 1)")
+    cl_parser.add_argument("-t", "--trials", type=int, default=3, metavar="POS_INT",
+                           help="number of trials of each case (default: 3)")
+    cl_parser.add_argument("-s", "--seed", type=int, default=0, metavar="INT",
+                           help="seed for the random-number generators and generated mazes (default: 0)")
+    cl_parser.add_argument("--topology-file", default=os.path.join(top_dir, "extras", "chimera16.txt"), metavar="FILE",
+                           help="name of a file describing the topology (default: extras/chimera16.txt)")
+    cl_parser.add_argument("-o", "--output", metavar="FILE", default=None,
+                           help="file to which to write the results in JSON format (default: standard output)")
+    cl_parser.add_argument("-b", "--baseline", metavar="FILE", default=None,
+                           help="JSON file of earlier results against which to check for regressions")
+    cl_parser.add_argument("--threshold", type=float, default=0.25, metavar="FRACTION",
+                           help="fractional increase in any metric considered a regression (default: 0.25)")
+    return cl_parser.parse_args()
+
+def program_cases(cl_args):
+    """Return a list of {name, function returning an iterable of lines, .xy
+    file or None} tuples, one per program to benchmark."""
+    cases = []
+
+    # Add the examples, reading each file anew on each trial.
+    def file_lines(fname):
+        "Return a function that returns the lines of a file."
+        def read_lines():
+            with open(fname) as f:
+                return f.readlines()
+        return read_lines
+    if not cl_args.no_examples:
+        if cl_args.example == None:
+            fnames = sorted(glob.glob(os.path.join(examples_dir, "*.qmasm")))
+        else:
+            fnames = [os.path.join(examples_dir, e if e.endswith(".qmasm") else e + ".qmasm")
+                      for e in cl_args.example]
+        for fname in fnames:
+            if not os.path.exists(fname):
+                qmasm.abend("Example %s does not exist" % fname)
+            xy = os.path.splitext(fname)[0] + ".xy"
+            if not os.path.exists(xy):
+                xy = None
+            name = os.path.splitext(os.path.basename(fname))[0]
+            cases.append((name, file_lines(fname), xy))
+
+    # Add the generated families, writing their locations to a temporary
+    # directory.
+    if not cl_args.no_families:
+        xy_dir = tempfile.mkdtemp(prefix="qmasm-bench-")
+        atexit.register(shutil.rmtree, xy_dir, True)
+        specs = cl_args.family
+        if specs == None:
+            specs = sorted(families.keys())
+        for spec in specs:
+            fam, _, sizes = spec.partition(":")
+            try:
+                default_sizes = families[fam][1]
+            except KeyError:
+                qmasm.abend('Unknown problem family "%s"' % fam)
+            if sizes == "":
+                sizes = default_sizes
+            else:
+                sizes = sizes.split(",")
+            for size in sizes:
+                try:
+                    args = parse_size(fam, size)
+                except ValueError as e:
+                    qmasm.abend(str(e))
+                gen = lambda fam=fam, args=args: program_lines(Emitter(), fam, args, cl_args.seed)
+                xy = os.path.join(xy_dir, "case%d.xy" % len(cases))
+                with open(xy, "w") as locfile:
+                    for line in program_lines(Emitter(locfile), fam, args, cl_args.seed):
+                        pass
+                cases.append(("%s-%s" % (fam, size), gen, xy))
+    return cases
+
+def report_results(results, regressions):
+    "Output a table of results and regressions to the standard error device."
+    name_len = max([len(c["problem"]) for c in results["cases"]] + [len("Problem")])
+    sys.stderr.write("    %-*s  Method  Time (s)  Alloc (MB)  RSS (MB)  Qubits  Max chain  Status\n" % (name_len, "Problem"))
+    sys.stderr.write("    %s  ------  --------  ----------  --------  ------  ---------  ------\n" % ("-" * name_len))
+    def fmt(summary, key, spec):
+        if key not in summary:
+            return "-"
+        if key in ["peak_alloc_kb", "peak_rss_kb"]:
+            return spec % (summary[key]/1024.0)
+        return spec % summary[key]
+    for c in results["cases"]:
+        s = c["summary"]
+        sys.stderr.write("    %-*s  %-6s  %8s  %10s  %8s  %6s  %9s  %s\n" %
+                         (name_len, c["problem"], c["method"],
+                          fmt(s, "wall", "%.3f"), fmt(s, "peak_alloc_kb", "%.1f"),
+                          fmt(s, "peak_rss_kb", "%.1f"),
+                          fmt(s, "physical_qubits", "%d"), fmt(s, "max_chain_len", "%d"),
+                          c["status"]))
+    sys.stderr.write("\n")
+    if regressions == None:
+        return
+    if regressions == []:
+        sys.stderr.write("No regressions relative to the baseline.\n")
+        return
+    sys.stderr.write("Regressions relative to the baseline:\n\n")
+    for problem, method, metric, old, new in regressions:
+        sys.stderr.write("    %s (%s): %s went from %s to %s\n" % (problem, method, metric, old, new))
+    sys.stderr.write("\n")
+
+def main():
+    "Run the benchmarks and report the results."
+    cl_args = parse_command_line()
+    methods = cl_args.embed_method
+    if methods == None:
+        methods = ["dwave", "dense", "layout"]
+
+    # Let examples !include one another.
+    try:
+        os.environ["QMASMPATH"] = examples_dir + ":" + os.environ["QMASMPATH"]
+    except KeyError:
+        os.environ["QMASMPATH"] = examples_dir
+
+    # Always find a new embedding.
+    os.environ.pop("QMASMCACHE", None)
+    if any([m != "none" for m in methods]):
+        qmasm.connect_to_dwave()
+
+    # Run each case in turn.
+    results = environment_info()
+    results.update({"seed": cl_args.seed, "trials": cl_args.trials,
+                    "optimization": cl_args.O, "cases": []})
+    for name, make_lines, xy in program_cases(cl_args):
+        for method in methods:
+            results["cases"].append(run_case(name, make_lines, method, cl_args.O,
+                                             cl_args.topology_file, xy,
+                                             cl_args.trials, cl_args.seed,
+                                             cl_args.verbose))
+
+    # Compare the results to a baseline.
+    regressions = None
+    if cl_args.baseline != None:
+        try:
+            with open(cl_args.baseline) as f:
+                baseline = json.load(f)
+        except IOError:
+            qmasm.abend("Failed to read %s" % cl_args.baseline)
+        regressions = compare_to_baseline(results, baseline, cl_args.threshold)
+
+    # Output the results.
+    report_results(results, regressions)
+    if cl_args.output == None:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True, separators=(",", ": "))
+        sys.stdout.write("\n")
+    else:
+        with open(cl_args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True, separators=(",", ": "))
+            f.write("\n")
+    if regressions != None and regressions != []:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
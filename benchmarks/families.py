@@ -0,0 +1,453 @@
+###################################
+# Size-parameterized QMASM        #
+# programs for benchmarking       #
+#                                 #
+# By Scott Pakin <pakin@lanl.gov> #
+###################################
+
+import random
+
+# Number of times to resample a cycle or matching of a random regular graph
+# that repeats an edge, and to restart the graph if that fails, before giving
+# up
+max_regular_attempts = 100
+
+# Hamiltonian for a maze room: exactly zero or two of N, E, S, and W are
+# true (cf. examples/maze3x3.qmasm).
+room_macro = """\
+!begin_macro room
+N   0.50
+E   0.50
+S   0.50
+W   0.50
+$a1 1.00
+
+N E   0.25
+N S   0.25
+N W   0.25
+N $a1 0.50
+E S   0.25
+E W   0.25
+E $a1 0.50
+S W   0.25
+S $a1 0.50
+W $a1 0.50
+!end_macro room
+"""
+
+# Hamiltonian for a sorting-network comparator (cf. examples/comparator.qmasm).
+comparator_macro = """\
+!begin_macro comparator
+$a    0
+$b    0
+$min  1
+$max -1
+
+$a $b      1
+$a $min   -1
+$a $max   -0.5
+$b $min   -1
+$b $max   -0.5
+$min $max -0.5
+!end_macro comparator
+"""
+
+# Hamiltonian for a full adder: (A + B + Cin - S - 2*Cout)^2/4 in spin
+# variables, which is minimized exactly when S and Cout are correct.
+full_adder_macro = """\
+!begin_macro full_adder
+A B     0.5
+A Cin   0.5
+B Cin   0.5
+A S    -0.5
+B S    -0.5
+Cin S  -0.5
+A Cout -1.0
+B Cout -1.0
+Cin Cout -1.0
+S Cout  1.0
+!end_macro full_adder
+"""
+
+# Hamiltonian for a 2-input AND gate: 3Y + AB - 2AY - 2BY in QUBO form.
+and_macro = """\
+!begin_macro and
+A -0.25
+B -0.25
+Y  0.50
+
+A B  0.25
+A Y -0.50
+B Y -0.50
+!end_macro and
+"""
+
+class Emitter(object):
+    """Keep track of the state shared by all of the program generators: a
+    prefix for every symbol, the origin of the generator's locations, the
+    file (if any) to which to write locations, and the set of macros already
+    defined.  Locations are written as they are produced so neither a program
+    nor its locations ever needs to be held in memory."""
+
+    def __init__(self, locfile=None):
+        self.locfile = locfile   # File to which to write "symbol x y" lines
+        self.prefix = ""         # Prefix for every symbol generated
+        self.x0 = 0              # Horizontal offset of every location
+        self.y0 = 0              # Vertical offset of every location
+        self.max_x = -1          # Largest x coordinate placed so far
+        self.defined = set()     # Names of macros already output
+
+    def sym(self, name):
+        "Return a symbol name with the current prefix prepended."
+        return self.prefix + name
+
+    def place(self, sym, x, y):
+        "Assign a location, relative to the origin, to a (prefixed) symbol."
+        x += self.x0
+        y += self.y0
+        if x > self.max_x:
+            self.max_x = x
+        if self.locfile != None:
+            self.locfile.write("%s %d %d\n" % (sym, x, y))
+
+    def place_pin(self, sym, x, y):
+        "Assign a location to the helper qubit that QMASM uses to pin a symbol."
+        self.place("$" + sym, x, y)
+
+    def macro(self, name, text):
+        "Yield the lines of a macro definition unless it was already output."
+        if name in self.defined:
+            return
+        self.defined.add(name)
+        for line in text.splitlines(True):
+            yield line
+        yield "\n"
+
+def maze_program(em, rows, cols, seed=0):
+    """Yield the lines of a QMASM program that finds the path through a
+    random rows x cols perfect maze.  The maze is carved one row at a time by
+    the seeded sidewinder algorithm so only O(cols) state is needed and a
+    given seed always produces the same maze."""
+    rng = random.Random(seed)
+    yield "# Path through a random %dx%d maze (seed %d)\n" % (rows, cols, seed)
+    yield "\n"
+    for line in em.macro("room", room_macro):
+        yield line
+    room = lambda r, c: em.sym("R%dC%d" % (r + 1, c + 1))
+    port_loc = {"N": (1, 0), "E": (2, 1), "S": (1, 2), "W": (0, 1), "$a1": (1, 1)}
+    pin_loc = {"N": (2, 0), "E": (2, 2), "S": (0, 2), "W": (0, 0)}
+    for r in range(rows):
+        # Decide which rooms in this row connect east and which connect north.
+        east = [False]*cols
+        north = [False]*cols
+        run = 0
+        for c in range(cols):
+            if r == 0:
+                east[c] = c < cols - 1
+                continue
+            run += 1
+            if c < cols - 1 and rng.random() < 0.5:
+                east[c] = True
+            else:
+                north[c - rng.randrange(run)] = True
+                run = 0
+
+        # Output each room, linking it to its north and west neighbors.
+        for c in range(cols):
+            name = room(r, c)
+            pinned = []
+            yield "\n"
+            yield "!use_macro room %s\n" % name
+            if r == 0:
+                yield "%s.N := %s\n" % (name, "true" if c == 0 else "false")
+                pinned.append("N")
+            elif north[c]:
+                yield "%s.N = %s.S\n" % (name, room(r - 1, c))
+            else:
+                yield "%s.N := false\n" % name
+                yield "%s.S := false\n" % room(r - 1, c)
+                pinned.append("N")
+            if c == 0:
+                yield "%s.W := false\n" % name
+                pinned.append("W")
+            elif east[c - 1]:
+                yield "%s.W = %s.E\n" % (name, room(r, c - 1))
+            else:
+                yield "%s.W := false\n" % name
+                yield "%s.E := false\n" % room(r, c - 1)
+                em.place_pin(room(r, c - 1) + ".E", 3*(c - 1) + pin_loc["E"][0], 3*r + pin_loc["E"][1])
+                pinned.append("W")
+            if c == cols - 1:
+                yield "%s.E := false\n" % name
+                pinned.append("E")
+            if r == rows - 1:
+                yield "%s.S := %s\n" % (name, "true" if c == cols - 1 else "false")
+                pinned.append("S")
+            for port, (x, y) in port_loc.items():
+                em.place(name + "." + port, 3*c + x, 3*r + y)
+            for port in pinned:
+                x, y = pin_loc[port]
+                em.place_pin(name + "." + port, 3*c + x, 3*r + y)
+            if r > 0 and not north[c]:
+                x, y = pin_loc["S"]
+                em.place_pin(room(r - 1, c) + ".S", 3*c + x, 3*(r - 1) + y)
+
+def sorter_program(em, n):
+    """Yield the lines of a QMASM program that sorts n bits with an odd-even
+    transposition sorting network of n*(n - 1)/2 comparators."""
+    yield "# %d-bit odd-even transposition sorting network\n" % n
+    yield "\n"
+    for line in em.macro("comparator", comparator_macro):
+        yield line
+    wires = [em.sym("in[%d]" % (i + 1)) for i in range(n)]
+    for i in range(n):
+        em.place(wires[i], 0, 2*i)
+    ncomps = 0
+    for rnd in range(n):
+        for i in range(rnd % 2, n - 1, 2):
+            ncomps += 1
+            comp = em.sym("c%d" % ncomps)
+            yield "\n"
+            yield "!use_macro comparator %s\n" % comp
+            yield "%s.$a = %s\n" % (comp, wires[i])
+            yield "%s.$b = %s\n" % (comp, wires[i + 1])
+            em.place(comp + ".$a", 2*rnd + 1, 2*i)
+            em.place(comp + ".$b", 2*rnd + 1, 2*i + 2)
+            em.place(comp + ".$min", 2*rnd + 2, 2*i)
+            em.place(comp + ".$max", 2*rnd + 2, 2*i + 2)
+            wires[i] = comp + ".$min"
+            wires[i + 1] = comp + ".$max"
+    yield "\n"
+    for i in range(n):
+        out = em.sym("out[%d]" % (i + 1))
+        yield "%s = %s\n" % (out, wires[i])
+        em.place(out, 2*n + 1, 2*i)
+
+def adder_program(em, bits):
+    """Yield the lines of a QMASM program that relates two bits-bit numbers to
+    their (bits + 1)-bit sum with a ripple-carry chain of full adders."""
+    yield "# %d-bit ripple-carry adder\n" % bits
+    yield "\n"
+    for line in em.macro("full_adder", full_adder_macro):
+        yield line
+    for i in range(bits):
+        fa = em.sym("fa%d" % i)
+        yield "\n"
+        yield "!use_macro full_adder %s\n" % fa
+        yield "%s.A = %s\n" % (fa, em.sym("a[%d]" % i))
+        yield "%s.B = %s\n" % (fa, em.sym("b[%d]" % i))
+        yield "%s.S = %s\n" % (fa, em.sym("sum[%d]" % i))
+        if i == 0:
+            yield "%s.Cin := false\n" % fa
+            em.place_pin(fa + ".Cin", 0, 3)
+        else:
+            yield "%s.Cin = %s.Cout\n" % (fa, em.sym("fa%d" % (i - 1)))
+        x = 3*i
+        em.place(em.sym("a[%d]" % i), x, 0)
+        em.place(em.sym("b[%d]" % i), x + 1, 0)
+        em.place(fa + ".A", x, 1)
+        em.place(fa + ".B", x + 1, 1)
+        em.place(fa + ".Cin", x, 2)
+        em.place(fa + ".Cout", x + 2, 2)
+        em.place(fa + ".S", x + 1, 3)
+        em.place(em.sym("sum[%d]" % i), x + 1, 4)
+    yield "\n"
+    yield "%s = %s.Cout\n" % (em.sym("sum[%d]" % bits), em.sym("fa%d" % (bits - 1)))
+    em.place(em.sym("sum[%d]" % bits), 3*bits, 4)
+
+def multiplier_program(em, abits, bbits):
+    """Yield the lines of a QMASM program that relates an abits-bit number A
+    and a bbits-bit number B to their (abits + bbits)-bit product P with an
+    array multiplier: one AND gate per partial-product bit and one row of
+    full adders per bit of B after the first."""
+    yield "# %dx%d-bit array multiplier\n" % (abits, bbits)
+    yield "\n"
+    for line in em.macro("and", and_macro):
+        yield line
+    for line in em.macro("full_adder", full_adder_macro):
+        yield line
+    A = lambda j: em.sym("A[%d]" % j)
+    B = lambda i: em.sym("B[%d]" % i)
+    P = lambda k: em.sym("P[%d]" % k)
+    for j in range(abits):
+        em.place(A(j), 4*j + 1, 0)
+    for i in range(bbits):
+        em.place(B(i), 4*abits + 1, 4*i + 1)
+
+    # Each row ANDs A with one bit of B and adds the result to the upper bits
+    # of the previous row's sum.
+    upper = []   # Symbols for the upper bits of the sum so far
+    for i in range(bbits):
+        row = []
+        for j in range(abits):
+            x, y = 4*j, 4*i + 1
+            pp = em.sym("pp%d_%d" % (i, j))
+            yield "\n"
+            yield "!use_macro and %s\n" % pp
+            yield "%s.A = %s\n" % (pp, A(j))
+            yield "%s.B = %s\n" % (pp, B(i))
+            em.place(pp + ".A", x + 1, y)
+            em.place(pp + ".B", x + 2, y)
+            em.place(pp + ".Y", x + 2, y + 1)
+            if i == 0:
+                row.append(pp + ".Y")
+                continue
+            fa = em.sym("fa%d_%d" % (i, j))
+            yield "!use_macro full_adder %s\n" % fa
+            yield "%s.A = %s.Y\n" % (fa, pp)
+            if j < abits - 1 or i > 1:
+                yield "%s.B = %s\n" % (fa, upper[j])
+            else:
+                yield "%s.B := false\n" % fa
+                em.place_pin(fa + ".B", x, y + 3)
+            if j == 0:
+                yield "%s.Cin := false\n" % fa
+                em.place_pin(fa + ".Cin", x + 3, y + 3)
+            else:
+                yield "%s.Cin = %s.Cout\n" % (fa, em.sym("fa%d_%d" % (i, j - 1)))
+            em.place(fa + ".A", x + 2, y + 2)
+            em.place(fa + ".B", x + 1, y + 1)
+            em.place(fa + ".Cin", x + 3, y + 2)
+            em.place(fa + ".Cout", x, y + 2)
+            em.place(fa + ".S", x + 1, y + 3)
+            row.append(fa + ".S")
+        yield "%s = %s\n" % (P(i), row[0])
+        em.place(P(i), 0, 4*i + 3)
+        upper = row[1:]
+        if i > 0:
+            upper.append(em.sym("fa%d_%d.Cout" % (i, abits - 1)))
+    yield "\n"
+    for j, sym in enumerate(upper):
+        yield "%s = %s\n" % (P(bbits + j), sym)
+        em.place(P(bbits + j), 4*j + 1, 4*bbits + 1)
+    if bbits == 1:
+        yield "%s := false\n" % P(abits)
+        em.place(P(abits), 0, 4*bbits + 1)
+        em.place_pin(P(abits), 1, 4*bbits + 1)
+
+def _regular_parts(rng, n, degree):
+    """Draw degree/2 random Hamiltonian cycles of n vertices plus, if degree
+    is odd, a random perfect matching, resampling each until it shares no
+    edge with its predecessors.  Return a list of {permutation, edges} pairs,
+    one per cycle or matching, or None if we give up."""
+    parts = []
+    seen = set()
+    for k in range((degree + 1)//2):
+        matching = degree % 2 == 1 and k == degree//2
+        for attempt in range(max_regular_attempts):
+            perm = list(range(n))
+            rng.shuffle(perm)
+            if matching:
+                edges = [(perm[p], perm[p + 1]) for p in range(0, n, 2)]
+            else:
+                edges = [(perm[p], perm[(p + 1) % n]) for p in range(n)]
+            if all([(min(u, v), max(u, v)) not in seen for u, v in edges]):
+                break
+        else:
+            return None
+        seen.update([(min(u, v), max(u, v)) for u, v in edges])
+        parts.append((perm, edges))
+    return parts
+
+def regular_program(em, n, degree, seed=0):
+    """Yield the lines of a QMASM program representing a +/-1 spin glass on
+    a random degree-regular graph of n vertices.  The graph is the union of
+    degree/2 random Hamiltonian cycles plus, if degree is odd (which requires
+    an even n), a random perfect matching, none of which repeats an edge, so
+    every vertex has exactly the given degree.  A graph with degree above
+    (n - 1)/2 is instead the complement of such a graph of degree
+    n - 1 - degree."""
+    rng = random.Random(seed)
+    complement = 2*degree > n - 1
+    for attempt in range(max_regular_attempts):
+        parts = _regular_parts(rng, n, n - 1 - degree if complement else degree)
+        if parts != None:
+            break
+    else:
+        raise ValueError("Failed to generate a %d-regular graph of %d vertices" % (degree, n))
+    yield "# Spin glass on a random %d-regular graph of %d vertices (seed %d)\n" % (degree, n, seed)
+    yield "\n"
+
+    # Lay out the first cycle or matching along a serpentine path.
+    side = 1
+    while side*side < n:
+        side += 1
+    order = list(range(n))
+    if parts != []:
+        order = parts[0][0]
+    for p, v in enumerate(order):
+        x, y = p % side, p // side
+        if y % 2 == 1:
+            x = side - 1 - x
+        em.place(em.sym("s[%d]" % v), x, y)
+
+    # Output each edge with a random sign.
+    edges = [e for perm, part in parts for e in part]
+    if complement:
+        absent = set([(min(u, v), max(u, v)) for u, v in edges])
+        edges = [(u, v) for u in range(n) for v in range(u + 1, n) if (u, v) not in absent]
+    for u, v in edges:
+        yield "%s %s %d\n" % (em.sym("s[%d]" % u), em.sym("s[%d]" % v), rng.choice([-1, 1]))
+
+def union_program(em, parts, seed=0):
+    """Yield the lines of a QMASM program formed from the disjoint union of
+    other programs, each given as a {family, argument tuple} pair.  Each part
+    gets its own symbol prefix and is placed to the right of the previous
+    part."""
+    yield "# Disjoint union of %d programs\n" % len(parts)
+    for p, (family, args) in enumerate(parts):
+        em.prefix = "u%d." % (p + 1)
+        em.x0 = em.max_x + 2
+        yield "\n"
+        for line in program_lines(em, family, args, seed + p):
+            yield line
+    em.prefix = ""
+    em.x0 = 0
+
+def parse_size(family, size):
+    "Parse a size string for a given family into a tuple of arguments."
+    try:
+        if family == "maze" or family == "multiplier":
+            rows, cols = size.lower().split("x")
+            return (int(rows), int(cols))
+        if family == "regular":
+            n, degree = size.split("/")
+            n, degree = int(n), int(degree)
+            if degree < 2 or degree >= n:
+                raise ValueError('Failed to parse "%s" as a regular size: DEGREE must be at least 2 and less than N' % size)
+            if degree % 2 == 1 and n % 2 == 1:
+                raise ValueError('Failed to parse "%s" as a regular size: an odd DEGREE requires an even N' % size)
+            return (n, degree)
+        if family == "union":
+            # Parse [COUNT*]FAMILY:SIZE+[COUNT*]FAMILY:SIZE+...
+            parts = []
+            for term in size.split("+"):
+                count, _, spec = term.rpartition("*")
+                fam, _, fsize = spec.partition(":")
+                if fam not in families or fam == "union":
+                    raise ValueError
+                parts.extend(int(count or 1)*[(fam, parse_size(fam, fsize))])
+            return (parts,)
+        return (int(size),)
+    except ValueError as e:
+        if str(e).startswith("Failed to parse"):
+            raise
+        raise ValueError('Failed to parse "%s" as a %s size' % (size, family))
+
+def program_lines(em, family, args, seed=0):
+    """Return a generator of the lines of a program from a given family with
+    arguments from parse_size and a seed for the families that are random."""
+    generator = families[family][0]
+    if family in ["maze", "regular", "union"]:
+        args = args + (seed,)
+    return generator(em, *args)
+
+# Map from a family name to a program generator and a default list of sizes
+families = {
+    "maze":       (maze_program,       ["3x3", "6x6", "10x10"]),
+    "sorter":     (sorter_program,     ["4", "8", "12"]),
+    "adder":      (adder_program,      ["4", "8", "16"]),
+    "multiplier": (multiplier_program, ["2x2", "3x3", "4x4"]),
+    "regular":    (regular_program,    ["16/4", "64/4", "256/6"]),
+    "union":      (union_program,      ["4*adder:4", "2*maze:3x3+2*sorter:4"])
+}
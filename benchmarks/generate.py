@@ -0,0 +1,56 @@
+###################################
+# Generate synthetic QMASM        #
+# workloads of arbitrary size     #
+#                                 #
+# By Scott Pakin <pakin@lanl.gov> #
+###################################
+
+import argparse
+import os
+import qmasm
+import sys
+from .families import Emitter, families, parse_size, program_lines
+
+def parse_command_line():
+    "Parse the generator command line.  Return an argparse.Namespace."
+    cl_parser = argparse.ArgumentParser(prog="python -m benchmarks.generate",
+                                        description="Generate a QMASM program and matching --locations-file",
+                                        epilog='Sizes are ROWSxCOLS for maze, ABITSxBBITS for multiplier, N/DEGREE for regular (with N even if DEGREE is odd), [COUNT*]FAMILY:SIZE+... for union, and a single integer otherwise.')
+    cl_parser.add_argument("family", choices=sorted(families.keys()),
+                           help="family of program to generate")
+    cl_parser.add_argument("size", help="size of the program to generate")
+    cl_parser.add_argument("-s", "--seed", type=int, default=0, metavar="INT",
+                           help="seed for the random families (default: 0)")
+    cl_parser.add_argument("-o", "--output", metavar="FILE", default="<stdout>",
+                           help="file to which to write the QMASM program (default: standard output)")
+    cl_parser.add_argument("-l", "--locations-file", metavar="FILE", default=None,
+                           help='file to which to write node locations for --embed-method=layout (default: the output file with ".xy" in place of ".qmasm", if any)')
+    cl_parser.add_argument("--no-locations", action="store_true",
+                           help="do not write a locations file")
+    cl_args = cl_parser.parse_args()
+    if cl_args.locations_file == None and cl_args.output != "<stdout>":
+        base, ext = os.path.splitext(cl_args.output)
+        if ext == ".qmasm":
+            cl_args.locations_file = base + ".xy"
+    if cl_args.no_locations:
+        cl_args.locations_file = None
+    return cl_args
+
+def main():
+    "Stream a program and its locations to their respective files."
+    cl_args = parse_command_line()
+    try:
+        args = parse_size(cl_args.family, cl_args.size)
+    except ValueError as e:
+        qmasm.abend(str(e))
+    outfile = qmasm.open_output_file(cl_args.output)
+    locfile = None
+    if cl_args.locations_file != None:
+        locfile = qmasm.open_output_file(cl_args.locations_file)
+    outfile.writelines(program_lines(Emitter(locfile), cl_args.family, args, cl_args.seed))
+    for f in [outfile, locfile]:
+        if f != None and f != sys.stdout:
+            f.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+###################################
+# Run QMASM's pipeline stages     #
+# in-process and measure them     #
+#                                 #
+# By Scott Pakin <pakin@lanl.gov> #
+###################################
+
+import json
+import os
+import platform
+import qmasm
+import random
+import sys
+import time
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+import numpy
+
+class SkippedProblem(Exception):
+    "A program contains nothing to embed (e.g., it merely defines macros)."
+    pass
+
+def run_pipeline(source, lines, method, optimization, topology_file, locations_file):
+    """Run QMASM's stages on a single program, given as an iterable of lines
+    read from a named source, and return a map from metric name to value.
+    Embedding is skipped if method is "none"."""
+    # Reset QMASM's global state.
+    qmasm.program = []
+    qmasm.sym_map = qmasm.SymbolMapping()
+    prof = qmasm.StageProfiler()
+    prof.enable()
+    qmasm.profiler = prof
+
+    # Parse the program and convert it to a logical Ising problem.
+    prof.start("parse")
+    fparse = qmasm.FileParser()
+    fparse.parse_file(source, lines)
+    prof.start("update_qmi")
+    logical = qmasm.Problem(False)
+    for stmt in qmasm.program:
+        stmt.update_qmi("", "<ERROR>", logical)
+    qmasm.chain_strength = logical.assign_chain_strength(None)
+    qmasm.pin_strength = logical.assign_pin_strength(None, qmasm.chain_strength)
+    logical.pin_qubits(qmasm.pin_strength, qmasm.chain_strength)
+    prof.start("aliases")
+    if optimization >= 1:
+        logical.convert_chains_to_aliases()
+    prof.start("simplify")
+    if optimization >= 1:
+        logical = qmasm.simplify_problem(logical, 0)
+        logical = qmasm.presolve_problem(logical, optimization, 0)
+    prof.finish()
+    if len(logical.weights) == 0 and len(logical.strengths) == 0:
+        raise SkippedProblem
+    metrics = {"logical_variables": qmasm.sym_map.max_number() + 1,
+               "logical_strengths": len(logical.strengths)}
+
+    # Embed the logical problem in the physical topology.
+    if method != "none":
+        prof.start("embed")
+        physical = qmasm.embed_problem_on_dwave(logical, optimization, 0,
+                                                topology_file, True,
+                                                method, locations_file)
+        prof.start("scale")
+        physical = qmasm.finalize_physical(physical, 0)
+        prof.finish()
+        chain_lens = [len(c) for c in physical.embedding]
+        metrics["physical_qubits"] = sum(chain_lens)
+        metrics["physical_couplers"] = len(physical.strengths)
+        metrics["max_chain_len"] = max(chain_lens + [0])
+    metrics["stages"] = {s["name"]: {"wall": s["wall"], "cpu": s["cpu"]}
+                         for s in prof.stages}
+    metrics["wall"] = sum([s["wall"] for s in prof.stages if "." not in s["name"]])
+    return metrics
+
+def measure_trial(source, make_lines, method, optimization, topology_file, locations_file, seed):
+    """Run one trial of a program in-process with all random-number
+    generators seeded.  Return a map from metric name to value, including a
+    "status" of "ok", "skipped", or an error message."""
+    random.seed(seed)
+    numpy.random.seed(seed)
+    saved_stdout = sys.stdout
+    saved_profiler = qmasm.profiler
+    if tracemalloc != None:
+        tracemalloc.start()
+    try:
+        # Some embedders write to standard output, which is reserved for
+        # results.
+        sys.stdout = sys.stderr
+        metrics = run_pipeline(source, make_lines(), method, optimization,
+                               topology_file, locations_file)
+        metrics["status"] = "ok"
+    except SkippedProblem:
+        metrics = {"status": "skipped"}
+    except SystemExit:
+        metrics = {"status": "aborted (see standard error)"}
+    except Exception as e:
+        metrics = {"status": "%s: %s" % (e.__class__.__name__, e)}
+    finally:
+        sys.stdout = saved_stdout
+        qmasm.profiler = saved_profiler
+        if tracemalloc != None:
+            metrics["peak_alloc_kb"] = tracemalloc.get_traced_memory()[1]//1024
+            tracemalloc.stop()
+    return metrics
+
+def run_trial(source, make_lines, method, optimization, topology_file, locations_file, seed):
+    """Run one trial of a program in a child process so that the child's
+    peak resident-set size reflects only that trial.  Return a map from
+    metric name to value, including a "status" of "ok", "skipped", or an
+    error message.  Run the trial in-process if we can't fork."""
+    if not hasattr(os, "fork"):
+        metrics = measure_trial(source, make_lines, method, optimization,
+                                topology_file, locations_file, seed)
+        metrics["peak_rss_kb"] = qmasm.peak_rss()
+        return metrics
+    sys.stdout.flush()
+    sys.stderr.flush()
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        # Child -- measure the trial and send the metrics to our parent in
+        # JSON format.  Exit without running our parent's exit handlers.
+        os.close(r)
+        try:
+            metrics = measure_trial(source, make_lines, method, optimization,
+                                    topology_file, locations_file, seed)
+            data = json.dumps(metrics)
+        except BaseException as e:
+            data = json.dumps({"status": "%s: %s" % (e.__class__.__name__, e)})
+        with os.fdopen(w, "wb") as wfile:
+            wfile.write(data.encode("utf-8"))
+        os._exit(0)
+
+    # Parent -- read the child's metrics then add its peak resident-set size.
+    os.close(w)
+    with os.fdopen(r, "rb") as rfile:
+        data = rfile.read()
+    _, status, usage = os.wait4(pid, 0)
+    try:
+        metrics = json.loads(data.decode("utf-8"))
+    except ValueError:
+        metrics = {"status": "crashed (exit status %d)" % status}
+    rss = usage.ru_maxrss
+    if sys.platform == "darwin":
+        rss //= 1024   # macOS reports bytes, not kilobytes.
+    metrics["peak_rss_kb"] = rss
+    return metrics
+
+def summarize(trials):
+    """Summarize a list of successful trials with the median of each time and
+    memory metric and the minimum of each size metric."""
+    summary = {}
+    for key in ["wall", "peak_alloc_kb", "peak_rss_kb"]:
+        vals = [t[key] for t in trials if t.get(key) != None]
+        if vals != []:
+            summary[key] = float(numpy.median(vals))
+    for key in ["logical_variables", "logical_strengths", "physical_qubits",
+                "physical_couplers", "max_chain_len"]:
+        vals = [t[key] for t in trials if key in t]
+        if vals != []:
+            summary[key] = min(vals)
+    return summary
+
+def run_case(name, make_lines, method, optimization, topology_file,
+             locations_file, trials, seed, verbosity):
+    """Run a number of trials of a single {program, embedding method} case and
+    return a map describing the case, its trials, and their summary."""
+    if verbosity >= 1:
+        sys.stderr.write("Running %s with --embed-method=%s ... " % (name, method))
+        sys.stderr.flush()
+    results = [run_trial(name, make_lines, method, optimization,
+                         topology_file, locations_file, seed + i)
+               for i in range(trials)]
+    statuses = sorted(set([r["status"] for r in results]))
+    ok = [r for r in results if r["status"] == "ok"]
+    if verbosity >= 1:
+        sys.stderr.write("%s\n" % ", ".join(statuses))
+    return {"problem": name,
+            "method": method,
+            "status": "ok" if len(ok) == len(results) else statuses[-1],
+            "trials": results,
+            "summary": summarize(ok)}
+
+def environment_info():
+    "Return a map describing the benchmarking environment."
+    return {"python": platform.python_version(),
+            "numpy": numpy.__version__,
+            "platform": platform.platform(),
+            "date": time.strftime("%Y-%m-%d %H:%M:%S")}
+
+# Metrics subject to measurement noise and the smallest change in each that
+# can count as a regression.  All other metrics are problem sizes, which are
+# compared exactly.
+noise_floors = {"wall": 0.05,             # Seconds
+                "peak_alloc_kb": 1024,    # Kilobytes
+                "peak_rss_kb": 4096}      # Kilobytes
+
+def compare_to_baseline(results, baseline, threshold, floors=noise_floors):
+    """Compare the summaries of two benchmark runs.  Return a list of
+    {problem, method, metric, baseline value, new value} tuples for every
+    metric that grew by more than a fraction threshold of its baseline value
+    and for every case that no longer succeeds.  Time and memory medians must
+    additionally grow by more than the metric's noise floor, so
+    sub-millisecond jitter is not reported as a regression."""
+    base_cases = {(c["problem"], c["method"]): c for c in baseline["cases"]}
+    regressions = []
+    for case in results["cases"]:
+        key = (case["problem"], case["method"])
+        try:
+            base = base_cases[key]
+        except KeyError:
+            continue
+        if base["status"] == "ok" and case["status"] != "ok":
+            regressions.append(key + ("status", base["status"], case["status"]))
+            continue
+        for metric, old in sorted(base["summary"].items()):
+            try:
+                new = case["summary"][metric]
+            except KeyError:
+                continue
+            if new > old*(1.0 + threshold) and new - old > floors.get(metric, 0):
+                regressions.append(key + (metric, old, new))
+    return regressions
@@ -11,7 +11,7 @@ import sys
 # Parse the command line.
 cl_parser = argparse.ArgumentParser(description="Convert Qubist input to QMASM input")
 cl_parser.add_argument("input", nargs="?", metavar="FILE", default="-",
-                       help="Qubist-format input file (default: standard input)")
+                       help="Qubist-format or QMASM .npz input file (default: standard input)")
 cl_parser.add_argument("-o", "--output", metavar="FILE", default="-",
                            help="file to which to write QMASM code (default: stdandard output)")
 cl_parser.add_argument("-f", "--format", metavar="FORMAT", default="%d",
@@ -20,8 +20,16 @@ cl_parser.add_argument("-r", "--renumber-from", metavar="INT", type=int,
                            help="starting number from which to renumber qubits")
 cl_args = cl_parser.parse_args()
 
-# Open the input file.
-if cl_args.input == "-":
+# Open the input file.  QMASM .npz files are memory-mapped instead.
+npz_input = cl_args.input.endswith(".npz")
+if npz_input:
+    import qmasm
+    try:
+        arrays = qmasm.load_npz(cl_args.input)
+    except (IOError, ValueError, KeyError) as e:
+        sys.stderr.write("%s: Failed to read %s (%s)\n" % (sys.argv[0], cl_args.input, e))
+        sys.exit(1)
+elif cl_args.input == "-":
     infile = sys.stdin
 else:
     try:
@@ -43,14 +51,22 @@ else:
 # Read the input file into memory, keeping track of all qubit numbers seen.
 qubist = []
 qnums = set()
-for line in infile:
-    fields = line.split()
-    if len(fields) != 3:
-        continue
-    q1, q2, val = int(fields[0]), int(fields[1]), fields[2]
-    qnums.add(q1)
-    qnums.add(q2)
-    qubist.append((q1, q2, val))
+if npz_input:
+    for q, val in zip(arrays["h_index"].tolist(), arrays["h_value"].tolist()):
+        qubist.append((q, q, "%.10g" % val))
+    for (q1, q2), val in zip(arrays["J_index"].tolist(), arrays["J_value"].tolist()):
+        qubist.append((q1, q2, "%.10g" % val))
+    qnums.update(arrays["h_index"].tolist())
+    qnums.update(arrays["J_index"].ravel().tolist())
+else:
+    for line in infile:
+        fields = line.split()
+        if len(fields) != 3:
+            continue
+        q1, q2, val = int(fields[0]), int(fields[1]), fields[2]
+        qnums.add(q1)
+        qnums.add(q2)
+        qubist.append((q1, q2, val))
 qnums = sorted(qnums)
 
 # Map old qubit numbers to new qubit numbers.
@@ -71,7 +87,7 @@ for q1, q2, val in qubist:
         outfile.write(fmt % (newq[q1], newq[q2], val))
 
 # Wrap up.
-if cl_args.input != "-":
+if cl_args.input != "-" and not npz_input:
     infile.close()
 if cl_args.output != "-":
     outfile.close()
@@ -6,30 +6,16 @@
 ############################################
 
 import argparse
+import hashlib
+import json
 import multiprocessing
+import numpy
+import os
 import qmasm
-import threading
-
-# Parse the command line.
-cl_parser = argparse.ArgumentParser(description="Compute the ground state of a QMASM macro")
-cl_parser.add_argument("input", nargs="*", default=[],
-                           help="file from which to read a symbolic Hamiltonian")
-cl_parser.add_argument("-m", "--macro", metavar="MACRO", default="",
-                       help="name of a macro whose ground state should be reported")
-cl_parser.add_argument("-a", "--all", action="store_true",
-                       help="output all states, not just the ground state")
-cl_parser.add_argument("-p", "--precision", type=float, default=0.005,
-                       help="minimum difference between two floating-point values to be considered different")
-cl_args = cl_parser.parse_args()
-if cl_args.macro == "":
-    qmasm.abend("A macro must be specified with --macro")
-prec = cl_args.precision
-
-# Parse the original input file(s) into an internal representation.
-fparse = qmasm.FileParser()
-fparse.parse_files(cl_args.input)
-if cl_args.macro not in fparse.macros:
-    qmasm.abend('Macro "%s" not found' % cl_args.macro)
+import sys
+
+# Define the number of spins whose 2^k combinations are evaluated at once.
+block_bits = 14
 
 def macro_to_coeffs(macro):
     "Convert a macro to h and J coefficient maps."
@@ -58,98 +44,328 @@ def macro_to_coeffs(macro):
             qmasm.abend("Only weights and strengths are currently supported")
     return sorted(syms, key=lambda s: ("$" in s, s)), h, J
 
-def similar(a, b):
-    "Return True if two floating-point numbers are nearly equal."
-    return abs(a - b) < prec
-
-class FindGroundState(threading.Thread):
-    "FindGroundState uses a team of threads to find a truth table's ground states."
-    # Define state that is shared among threads.
-    class SharedState(object):
-        def __init__(self):
-            self.min_energy = 2**30    # Minimum energy observed
-            self.all_energies = set()  # All energies, rounded to the given precision
-            self.table = []            # List of {spins, energy} tuples
-            self.lock = threading.Lock()
-
-        def update(self, min_energy, all_energies, table):
-            "Update all of our state at once."
-            self.lock.acquire()
-            self.all_energies.update(all_energies)
-            if min_energy < self.min_energy:
-                if not cl_args.all and not similar(self.min_energy, min_energy):
-                    # New minimum -- clear the table.
-                    self.table = []
-                self.min_energy = min_energy
-            if cl_args.all or similar(self.min_energy, min_energy):
-                self.table.extend(table)
-            self.lock.release()
-
-    state = SharedState()
-
-    def __init__(self, ncols, begin, end, step):
-        threading.Thread.__init__(self)
-        self.ncols = ncols
-        self.begin = begin
-        self.end = end
-        self.step = step
-
-    def run(self):
-        "Find the ground state by exhaustively examining a range of rows."
-        # In our thread, we locally examine 1/Nth of the rows.
-        min_energy = 2**30
-        all_energies = set()
-        table = []
-        ncols = self.ncols
-        for row in range(self.begin, self.end, self.step):
-            # Precompute a vector of spins.
-            spins = [(row>>(ncols - i - 1)&1)*2 - 1 for i in range(ncols)]
-
-            # Compute the current row's energy
-            energy = 0.0
-            for i in range(ncols):
-                try:
-                    hi = h[syms[i]]
-                    energy += hi*spins[i]
-                except KeyError:
-                    pass
-            for i in range(ncols - 1):
-                for j in range(i + 1, ncols):
-                    try:
-                        Jij = J[(syms[i], syms[j])]
-                        energy += Jij*spins[i]*spins[j]
-                    except KeyError:
-                        pass
-
-            # Keep track of minimum energy, within precision limits.
-            all_energies.add(round(energy/prec)*prec)
-            if energy < min_energy:
-                min_energy = energy
-                if not cl_args.all:
-                    table = []    # We don't need excited states unless we're outputting them.
-            if cl_args.all or similar(energy, min_energy):
-                table.append((spins, energy))
-
-        # Merge our findings into the global state.
-        self.state.update(min_energy, all_energies, table)
-
-def output_ground_state(syms, h, J):
-    "Exhaustively evaluate the ground states of a truth table."
-    # Compute the ground states using multiple threads, one per
-    # hardware thread.
-    ncols = len(syms)
-    nrows = 2**ncols
-    nthreads = min(multiprocessing.cpu_count(), nrows)
-    tobjs = []
-    for i in range(nthreads):
-        tobjs.append(FindGroundState(ncols, i, nrows, nthreads))
-        tobjs[i].start()
-    for t in tobjs:
-        t.join()
-    min_energy = FindGroundState.state.min_energy
-    all_energies = FindGroundState.state.all_energies
-    table = FindGroundState.state.table
-    table.sort()
+def macro_is_flat(macro):
+    "Return True if a macro contains only weights and strengths."
+    return all([m.__class__ in [qmasm.Weight, qmasm.Strength] for m in macro])
+
+def coeffs_to_arrays(syms, h, J):
+    "Convert h and J coefficient maps to a dense vector and a dense symmetric matrix."
+    n = len(syms)
+    hvec = numpy.array([h.get(s, 0.0) for s in syms])
+    Jmat = numpy.zeros((n, n))
+    for i in range(n):
+        for j in range(n):
+            if i != j:
+                Jmat[i, j] = J.get((syms[i], syms[j]), 0.0)
+    return hvec, Jmat
+
+def row_spins(rows, n):
+    """Map each of an array of row numbers to a row of spins, with the first
+    spin corresponding to the row number's most significant bit."""
+    shifts = numpy.arange(n - 1, -1, -1, dtype=numpy.int64)
+    return ((numpy.asarray(rows, dtype=numpy.int64)[:, None] >> shifts) & 1)*2 - 1
+
+# Define state that is set once per worker process.
+_engine = {}
+
+def _init_engine(hvec, Jmat, kbits, prec, all_rows):
+    """Precompute everything that is independent of the high-order spins:
+    the spins of each of the 2^k combinations of low-order spins and the
+    energy of their mutual couplers."""
+    n = len(hvec)
+    nhigh = n - kbits
+    s_low = row_spins(numpy.arange(2**kbits), kbits).astype(float)
+    J_ll = Jmat[nhigh:, nhigh:]
+    _engine.update(
+        hvec=hvec, Jmat=Jmat, kbits=kbits, nhigh=nhigh, prec=prec, all_rows=all_rows,
+        s_low=s_low,
+        low_energy=0.5*numpy.einsum("ri,ij,rj->r", s_low, J_ll, s_low))
+
+def _evaluate_blocks(gray_range):
+    """Evaluate all rows whose high-order spins are given by a range of
+    Gray-code indices.  Return the minimum energy, the set of energies
+    rounded to the given precision (as integer multiples of the precision),
+    and the row numbers and energies of either all rows or only those within
+    the given precision of the minimum."""
+    hvec, Jmat = _engine["hvec"], _engine["Jmat"]
+    kbits, nhigh, prec = _engine["kbits"], _engine["nhigh"], _engine["prec"]
+    s_low, low_energy = _engine["s_low"], _engine["low_energy"]
+    all_rows = _engine["all_rows"]
+    g_begin, g_end = gray_range
+
+    # Compute directly the high-order spins' energy and the field they
+    # impose on the low-order spins for the first row in the range.
+    gray = g_begin ^ (g_begin >> 1)
+    s_high = row_spins([gray], nhigh)[0].astype(float)
+    J_hh = Jmat[:nhigh, :nhigh]
+    J_lh = Jmat[nhigh:, :nhigh]
+    high_energy = s_high.dot(hvec[:nhigh]) + 0.5*s_high.dot(J_hh).dot(s_high)
+    field = hvec[nhigh:] + J_lh.dot(s_high)
+
+    # Evaluate each block of rows, moving from one block to the next by
+    # flipping a single high-order spin.
+    min_energy = float("inf")
+    rounded = set()
+    kept_rows = []
+    kept_energies = []
+    for g in range(g_begin, g_end):
+        energies = high_energy + low_energy + s_low.dot(field)
+        rounded.update(numpy.unique(numpy.round(energies/prec)).astype(numpy.int64).tolist())
+        block_min = energies.min()
+        if all_rows or block_min < min_energy + prec:
+            if block_min < min_energy:
+                min_energy = block_min
+                if not all_rows:
+                    # Discard rows that are no longer near the minimum.
+                    kept_rows = [r[e < min_energy + prec] for r, e in zip(kept_rows, kept_energies)]
+                    kept_energies = [e[e < min_energy + prec] for e in kept_energies]
+            which = numpy.arange(len(energies))
+            if not all_rows:
+                which = which[energies < min_energy + prec]
+            kept_rows.append((gray << kbits) + which)
+            kept_energies.append(energies[which])
+        if g + 1 < g_end:
+            # Flip the high-order spin that distinguishes the next Gray code.
+            bit = ((g + 1) & -(g + 1)).bit_length() - 1
+            j = nhigh - 1 - bit
+            delta = -2.0*s_high[j]
+            high_energy += delta*(hvec[j] + J_hh[j].dot(s_high))
+            field += delta*J_lh[:, j]
+            s_high[j] = -s_high[j]
+            gray ^= 1 << bit
+    return (min_energy, rounded,
+            numpy.concatenate(kept_rows), numpy.concatenate(kept_energies))
+
+def find_ground_states(syms, h, J, prec, all_rows):
+    """Exhaustively evaluate all rows of a truth table.  Return the minimum
+    energy, the sorted list of distinct energies (rounded to the given
+    precision), and a list of {spins, energy} pairs sorted by row for either
+    all rows or only the ground states."""
+    # Partition the rows into blocks, and partition the blocks across
+    # processes, one per hardware thread.
+    n = len(syms)
+    kbits = min(n, block_bits)
+    nblocks = 2**(n - kbits)
+    nworkers = min(multiprocessing.cpu_count(), nblocks)
+    nchunks = min(nblocks, nworkers*4)
+    bounds = [nblocks*c//nchunks for c in range(nchunks + 1)]
+    chunks = [(bounds[c], bounds[c + 1]) for c in range(nchunks)]
+    hvec, Jmat = coeffs_to_arrays(syms, h, J)
+    init_args = (hvec, Jmat, kbits, prec, all_rows)
+    if nworkers == 1:
+        _init_engine(*init_args)
+        results = [_evaluate_blocks(c) for c in chunks]
+    else:
+        pool = multiprocessing.Pool(nworkers, _init_engine, init_args)
+        results = pool.map(_evaluate_blocks, chunks)
+        pool.close()
+        pool.join()
+
+    # Merge the per-chunk results.
+    min_energy = min([r[0] for r in results])
+    all_energies = sorted(set().union(*[r[1] for r in results]))
+    rows = numpy.concatenate([r[2] for r in results])
+    energies = numpy.concatenate([r[3] for r in results])
+    if not all_rows:
+        near_min = energies < min_energy + prec
+        rows = rows[near_min]
+        energies = energies[near_min]
+    order = numpy.argsort(rows, kind="mergesort")
+    table = list(zip(row_spins(rows[order], n).tolist(), energies[order].tolist()))
+    return min_energy, [e*prec for e in all_energies], table
+
+def find_ground_states_bnb(syms, h, J, prec):
+    """Find the ground states of a truth table by branch and bound.  Return
+    the same values as find_ground_states, except that the list of distinct
+    energies includes only the two lowest."""
+    # Assign spins in order of decreasing degree.
+    n = len(syms)
+    hvec, Jmat = coeffs_to_arrays(syms, h, J)
+    degree = [numpy.count_nonzero(Jmat[i]) for i in range(n)]
+    order = sorted(range(n), key=lambda i: (-degree[i], i))
+    nbrs = [[(j, Jmat[i, j]) for j in range(n) if Jmat[i, j] != 0.0] for i in range(n)]
+
+    # Precompute, for each depth, the total magnitude of the couplers among
+    # the spins not yet assigned.
+    position = {i: p for p, i in enumerate(order)}
+    pair_rest = [0.0]*(n + 1)
+    for p in range(n - 1, -1, -1):
+        i = order[p]
+        pair_rest[p] = pair_rest[p + 1] + sum([abs(wt) for j, wt in nbrs[i] if position[j] > p])
+
+    # Maintain the field on each unassigned spin from its point weight and
+    # its assigned neighbors.  A lower bound on the energy of any completion
+    # of a partial assignment is the energy of the assigned spins minus the
+    # magnitude of each unassigned spin's field and of each coupler between
+    # unassigned spins.
+    field = hvec.tolist()
+    spins = [0]*n
+    levels = []       # The two lowest distinct energies, as multiples of prec
+    best = [float("inf")]
+    ground = []       # List of {spins, energy} pairs near the best energy
+
+    def record(energy):
+        "Record a complete assignment."
+        level = int(round(energy/prec))
+        if level not in levels:
+            levels.append(level)
+            levels.sort()
+            del levels[2:]
+        if energy < best[0]:
+            best[0] = energy
+            ground[:] = [g for g in ground if g[1] < energy + prec]
+        if energy < best[0] + prec:
+            ground.append((list(spins), energy))
+
+    def search(p, energy, field_mag):
+        "Assign spins from depth p onward."
+        if p == n:
+            record(energy)
+            return
+
+        # Prune branches that cannot reach the second-lowest energy seen so
+        # far, which we need for the gap.
+        if len(levels) == 2 and energy - field_mag - pair_rest[p] > (levels[1] + 0.5)*prec:
+            return
+
+        # Try first the value the spin's field favors.
+        i = order[p]
+        fi = field[i]
+        for s in ([-1, +1] if fi >= 0.0 else [+1, -1]):
+            spins[i] = s
+            new_mag = field_mag - abs(fi)
+            for j, wt in nbrs[i]:
+                if position[j] > p:
+                    new_mag -= abs(field[j])
+                    field[j] += wt*s
+                    new_mag += abs(field[j])
+            search(p + 1, energy + s*fi, new_mag)
+            for j, wt in nbrs[i]:
+                if position[j] > p:
+                    field[j] -= wt*s
+        spins[i] = 0
+
+    search(0, 0.0, sum([abs(f) for f in field]))
+    ground = [g for g in ground if g[1] < best[0] + prec]
+    ground.sort()
+    return best[0], [lvl*prec for lvl in levels], ground
+
+def solve_macro(syms, h, J, prec, all_rows, method):
+    """Return a truth table's minimum energy, its two lowest distinct energies
+    (rounded to the given precision), and its list of {spins, energy} pairs
+    for either all rows or only the ground states."""
+    if method == "bnb":
+        min_energy, all_energies, table = find_ground_states_bnb(syms, h, J, prec)
+    else:
+        min_energy, all_energies, table = find_ground_states(syms, h, J, prec, all_rows)
+    return min_energy, all_energies[:2], table
+
+def _solve_macro_job(args):
+    "Invoke solve_macro from a worker process."
+    return solve_macro(*args)
+
+class GroundStateCache(object):
+    """Read and write a cached truth-table analysis.  The cache key is a
+    canonical representation of a macro's coefficients plus the parameters
+    that affect the result."""
+
+    def __init__(self, syms, h, J, prec, all_rows):
+        # Ensure we have a valid cache directory.
+        self.hash = None
+        try:
+            self.cachedir = os.environ["QMASMCACHE"]
+        except KeyError:
+            self.cachedir = None
+            return
+        if not os.path.isdir(self.cachedir):
+            qmasm.abend("QMASMCACHE is set to %s, which is not an extant directory" % self.cachedir)
+
+        # Compute a SHA-1 sum of our inputs.  The symbol order determines the
+        # column order so it is included as is.
+        canon_J = sorted([(s1, s2, wt) for (s1, s2), wt in J.items() if s1 < s2])
+        key = json.dumps([syms, sorted(h.items()), canon_J, repr(prec), all_rows])
+        self.hash = hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def filename(self):
+        "Return the name of our cache file."
+        return os.path.join(self.cachedir, "gs-%s.json" % self.hash)
+
+    def read(self):
+        "Read a solve_macro result from the cache or None on a cache miss."
+        if self.hash == None:
+            return None
+        try:
+            with open(self.filename()) as f:
+                min_energy, all_energies, table = json.load(f)
+        except (IOError, ValueError):
+            return None
+        return min_energy, all_energies, [(spins, energy) for spins, energy in table]
+
+    def write(self, result):
+        "Write a solve_macro result to the cache."
+        if self.hash == None:
+            return
+        try:
+            with open(self.filename(), "w") as f:
+                json.dump(result, f)
+        except IOError:
+            pass
+
+def cached_solve_macro(syms, h, J, prec, all_rows, method):
+    "Invoke solve_macro unless its result is already cached."
+    cache = GroundStateCache(syms, h, J, prec, all_rows)
+    result = cache.read()
+    if result == None:
+        result = solve_macro(syms, h, J, prec, all_rows, method)
+        cache.write(result)
+    return result
+
+def check_all_macros(macros, prec, all_rows, method):
+    """Analyze every macro, reusing cached results for unchanged macros.
+    Return a map from macro name to either None (for macros containing more
+    than weights and strengths) or a {symbols, solve_macro result} pair."""
+    results = {}
+    jobs = []       # List of {name, symbols, cache, solve_macro arguments} tuples
+    num_cached = 0
+    for name, macro in macros.items():
+        if not macro_is_flat(macro):
+            results[name] = None
+            continue
+        syms, h, J = macro_to_coeffs(macro)
+        cache = GroundStateCache(syms, h, J, prec, all_rows)
+        result = cache.read()
+        if result == None:
+            jobs.append((name, syms, cache, (syms, h, J, prec, all_rows, method)))
+        else:
+            results[name] = (syms, result)
+            num_cached += 1
+
+    # Analyze small macros in parallel, one per process, and large macros
+    # one at a time, each using all processes.
+    small = [j for j in jobs if method == "bnb" or len(j[1]) <= block_bits]
+    large = [j for j in jobs if not (method == "bnb" or len(j[1]) <= block_bits)]
+    nworkers = min(multiprocessing.cpu_count(), len(small))
+    if nworkers > 1:
+        pool = multiprocessing.Pool(nworkers)
+        small_results = pool.map(_solve_macro_job, [j[3] for j in small])
+        pool.close()
+        pool.join()
+    else:
+        small_results = [solve_macro(*j[3]) for j in small]
+    large_results = [solve_macro(*j[3]) for j in large]
+    for (name, syms, cache, _), result in zip(small + large, small_results + large_results):
+        cache.write(result)
+        results[name] = (syms, result)
+    sys.stderr.write("Analyzed %d macro(s); %d unchanged macro(s) were found in the cache\n" %
+                     (len(macros), num_cached))
+    return results
+
+def output_ground_state(syms, result, prec):
+    "Output a truth table's ground states (or all states) and gap."
+    def similar(a, b):
+        "Return True if two floating-point numbers are nearly equal."
+        return abs(a - b) < prec
+    min_energy, all_energies, table = result
 
     # Output the ground-state rows (or all rows if verbosity is enabled).
     width = max([len(s) for s in syms])
@@ -167,14 +383,54 @@ def output_ground_state(syms, h, J):
     print("")
 
     # Also output the gap between the ground state and first excited state.
-    all_energies = sorted(set([round(e/prec)*prec for e in all_energies]))
     if len(all_energies) == 1:
         print("=== GAP: N/A ===")
     else:
         print("=== GAP: %.5g ===" % (all_energies[1] - all_energies[0]))
 
-# Process each macro in turn.
-print("=== MACRO: %s ===" % cl_args.macro)
-print("")
-syms, h, J = macro_to_coeffs(fparse.macros[cl_args.macro])
-output_ground_state(syms, h, J)
+if __name__ == "__main__":
+    # Parse the command line.
+    cl_parser = argparse.ArgumentParser(description="Compute the ground state of a QMASM macro")
+    cl_parser.add_argument("input", nargs="*", default=[],
+                               help="file from which to read a symbolic Hamiltonian")
+    cl_parser.add_argument("-m", "--macro", metavar="MACRO", default="",
+                           help="name of a macro whose ground state should be reported")
+    cl_parser.add_argument("-a", "--all", action="store_true",
+                           help="output all states, not just the ground state")
+    cl_parser.add_argument("-p", "--precision", type=float, default=0.005,
+                           help="minimum difference between two floating-point values to be considered different")
+    cl_parser.add_argument("--method", choices=["exhaustive", "bnb"], default="exhaustive",
+                           help='evaluate every state or search by branch and bound (default: "exhaustive")')
+    cl_parser.add_argument("--check-all", action="store_true",
+                           help="report on every macro in the input, reusing cached results for unchanged macros")
+    cl_args = cl_parser.parse_args()
+    if cl_args.macro == "" and not cl_args.check_all:
+        qmasm.abend("A macro must be specified with --macro")
+    if cl_args.macro != "" and cl_args.check_all:
+        qmasm.abend("--macro and --check-all are mutually exclusive")
+    if cl_args.method == "bnb" and cl_args.all:
+        qmasm.abend("--all is not supported by --method=bnb")
+
+    # Parse the original input file(s) into an internal representation.
+    fparse = qmasm.FileParser()
+    fparse.parse_files(cl_args.input)
+    if cl_args.check_all:
+        results = check_all_macros(fparse.macros, cl_args.precision, cl_args.all, cl_args.method)
+    else:
+        if cl_args.macro not in fparse.macros:
+            qmasm.abend('Macro "%s" not found' % cl_args.macro)
+        syms, h, J = macro_to_coeffs(fparse.macros[cl_args.macro])
+        results = {cl_args.macro: (syms, cached_solve_macro(syms, h, J, cl_args.precision,
+                                                            cl_args.all, cl_args.method))}
+
+    # Process each macro in turn.
+    for name in sorted(results.keys()):
+        if name != sorted(results.keys())[0]:
+            print("")
+        print("=== MACRO: %s ===" % name)
+        print("")
+        if results[name] == None:
+            print("Skipped: the macro contains statements other than weights and strengths")
+            continue
+        syms, result = results[name]
+        output_ground_state(syms, result, cl_args.precision)
@@ -5,6 +5,7 @@
 # By Scott Pakin <pakin@lanl.gov>                #
 ##################################################
 
+import itertools
 import qmasm
 import os
 import os.path
@@ -15,13 +16,19 @@ import sys
 min_energy_delta = 0.005
 
 # Define the set of classical solvers we support.
-classical_solvers = ["qbsolv", "minizinc"]
+classical_solvers = ["qbsolv", "minizinc", "exact"]
 
 # Parse the command line.
 cl_args = qmasm.parse_command_line()
 qmasm.report_command_line(cl_args)
 
+# Optionally measure the time and memory consumed by each stage of processing.
+if cl_args.profile or cl_args.stats_json != None or cl_args.profile_stage != None:
+    qmasm.profiler.enable(cl_args.profile, cl_args.stats_json,
+                          cl_args.profile_stage, cl_args.profile_tool)
+
 # Parse the original input file(s) into an internal representation.
+qmasm.profiler.start("parse")
 fparse = qmasm.FileParser()
 fparse.parse_files(cl_args.input)
 
@@ -31,7 +38,15 @@ if cl_args.pin != None:
     for pin in cl_args.pin:
         qmasm.program.extend(qmasm.process_pin("[command line]", 1, pin))
 
+# Read the per-variant pin statements to use in batch mode.
+batch_variants = None
+if cl_args.batch != None:
+    if cl_args.format in classical_solvers:
+        qmasm.abend("--batch is not supported by classical solvers")
+    batch_variants = qmasm.read_batch_file(cl_args.batch)
+
 # Walk the statements in the program, processing each in turn.
+qmasm.profiler.start("update_qmi")
 logical_either = qmasm.Problem(cl_args.qubo)
 for stmt in qmasm.program:
     stmt.update_qmi("", "<ERROR>", logical_either)
@@ -43,6 +58,7 @@ logical_stats = {
     "eqs":       len(logical_either.chains),
     "pins":      len(logical_either.pinned)
 }
+physical_stats = {}   # Filled in once the problem is embedded
 
 # Convert from QUBO to Ising in case the solver doesn't support QUBO problems.
 if cl_args.qubo:
@@ -68,6 +84,7 @@ if cl_args.verbose >= 1:
 logical_ising.pin_qubits(qmasm.pin_strength, qmasm.chain_strength)
 
 # Convert chains to aliases where possible.
+qmasm.profiler.start("aliases")
 if cl_args.O >= 1:
     # Say what we're about to do
     if cl_args.verbose >= 2:
@@ -81,27 +98,46 @@ if cl_args.O >= 1:
     if cl_args.verbose >= 2:
         sys.stderr.write("  %6d logical qubits after optimization\n\n" % (qmasm.sym_map.max_number() + 1))
 
-# Further simplify the problem if we can.
-if cl_args.O >= 1:
+# Further simplify the problem if we can.  In batch mode, we can't elide
+# variables that a variant may later pin, and in sweep mode, we can't elide
+# variables whose values depend on the strengths being swept.
+qmasm.profiler.start("simplify")
+sweeping = cl_args.chain_strength_sweep != None or cl_args.pin_strength_sweep != None
+if cl_args.O >= 1 and batch_variants == None and not sweeping:
     logical_ising = qmasm.simplify_problem(logical_ising, cl_args.verbose)
+    logical_ising = qmasm.presolve_problem(logical_ising, cl_args.O, cl_args.verbose)
 
 # This is a good time to update our logical statistics.
 logical_stats["vars"] = qmasm.sym_map.max_number() + 1
 logical_stats["strengths"] = len(logical_ising.strengths)
 logical_stats["eqs"] = len(logical_ising.chains)
 logical_stats["pins"] = len(logical_ising.pinned)
+qmasm.profiler.count("logical_variables", logical_stats["vars"])
+qmasm.profiler.count("logical_strengths", logical_stats["strengths"])
 
-# Complain if we have no weights and no strengths.
+# Complain if we have no weights and no strengths, unless simplification
+# determined the value of every variable.
+fully_determined = False
 if len(logical_ising.weights) == 0 and len(logical_ising.strengths) == 0:
-    qmasm.abend("Nothing to do (no weights or strengths specified)")
+    if len(logical_ising.known_values) == 0 and len(logical_ising.free_spins) == 0:
+        qmasm.abend("Nothing to do (no weights or strengths specified)")
+    if not cl_args.run:
+        qmasm.abend("Nothing to output (simplification determined the value of every variable)")
+    fully_determined = True
 
 # Complain if we have disconnected qubits.
 discon_syms = logical_ising.find_disconnected_variables()
 if len(discon_syms) > 0:
     qmasm.abend("Disconnected variables encountered: %s" % " ".join(sorted(discon_syms)))
 
+# Partition the problem into independent connected components, which can be
+# embedded separately.
+components = logical_ising.connected_components()
+logical_stats["components"] = len(components)
+
 # Establish a connection to the D-Wave, and use this to talk to a solver.  We
 # rely on the qOp infrastructure to set the environment variables properly.
+qmasm.profiler.start("connect")
 qmasm.connect_to_dwave()
 
 # Output either short or all solver properties.
@@ -150,6 +186,7 @@ if cl_args.verbose >= 1:
 write_output_file = not (cl_args.output == "<stdout>" and cl_args.run)
 
 # If the user requested QMASM output, always output it here.
+qmasm.profiler.start("output")
 if write_output_file and cl_args.format == "qmasm":
     qmasm.write_output(logical_ising, cl_args.output, cl_args.format, cl_args.qubo)
     if not cl_args.run:
@@ -162,24 +199,258 @@ if write_output_file and cl_args.format == "bqpjson" and not cl_args.always_embe
     if not cl_args.run:
         sys.exit(0)
 
+# Map each logical qubit to one or more symbols.
+max_num = qmasm.sym_map.max_number()
+num2syms = [[] for _ in range(max_num + 1)]
+all_num2syms = [[] for _ in range(max_num + 1)]
+max_sym_name_len = 7
+for s, n in qmasm.sym_map.symbol_number_items():
+    all_num2syms[n].append(s)
+    if cl_args.verbose >= 2 or "$" not in s:
+        num2syms[n].append(s)
+        max_sym_name_len = max(max_sym_name_len, len(repr(num2syms[n])) - 1)
+
+# Define a class to represent a valid solution.
+class ValidSolution:
+    "Represent a minimal state of a spin system."
+
+    def __init__(self, problem, soln, energy, free_values=()):
+        # Map named variables to spins.
+        self.problem = problem
+        self.solution = soln
+        self.energy = energy
+        self.names = []       # List of names for each named row
+        self.spins = []       # Spin for each named row
+        self.all_names = []   # List of names for each named row, including "$" names
+        self.all_spins = []   # Spin for each named row, including "$" names
+        self.id = 0           # Map from spins to an int
+        self._checked_asserts = None  # Memoized result of check_assertions
+        for q in range(len(soln)):
+            # Add all names to all_num2syms.
+            if all_num2syms[q] == []:
+                continue
+            self.all_names.append(" ".join(all_num2syms[q]))
+            self.all_spins.append(soln[q])
+
+            # Add only non-"$" names to num2syms.
+            if num2syms[q] == []:
+                continue
+            self.names.append(" ".join(num2syms[q]))
+            self.spins.append(soln[q])
+            self.id = self.id*2 + (soln[q] + 1)/2
+
+        # Additionally map the spins computed during simplification.
+        for nm, s in problem.known_values.items():
+            self.all_names.append(nm)
+            self.all_spins.append(s)
+            if cl_args.verbose < 2 and "$" in nm:
+                continue
+            self.names.append(nm)
+            self.spins.append(s)
+            self.id = self.id*2 + (s + 1)/2
+
+        # Additionally map the spins that simplification tied to the
+        # negation of another spin.
+        for nm, other in sorted(problem.anti_aliases.items()):
+            s = -soln[qmasm.sym_map.to_number(other)]
+            self.all_names.append(nm)
+            self.all_spins.append(s)
+            if cl_args.verbose < 2 and "$" in nm:
+                continue
+            self.names.append(nm)
+            self.spins.append(s)
+            self.id = self.id*2 + (s + 1)/2
+
+        # Additionally map the spins that simplification found could take
+        # either value, given a value for each.
+        for pairs, v in zip(problem.free_spins, free_values):
+            for nm, sign in pairs:
+                s = v*sign
+                self.all_names.append(nm)
+                self.all_spins.append(s)
+                if cl_args.verbose < 2 and "$" in nm:
+                    continue
+                self.names.append(nm)
+                self.spins.append(s)
+                self.id = self.id*2 + (s + 1)/2
+
+    def check_assertions(self):
+        "Return the result of applying each assertion."
+        # Return the previous result, if any.
+        if self._checked_asserts != None:
+            return self._checked_asserts
+
+        # Construct a mapping from names to bits.
+        name2bit = {}
+        for i in range(len(self.all_spins)):
+            names = self.all_names[i].split()
+            spin = self.all_spins[i]
+            if spin in [-1, 1]:
+                spin = (spin + 1)//2
+            else:
+                spin = None
+            for nm in names:
+                name2bit[nm] = spin
+
+        # Test each assertion in turn.
+        results = []
+        for a in self.problem.assertions:
+            results.append((str(a), a.evaluate(name2bit)))
+        self._checked_asserts = results
+        return self._checked_asserts
+
+def report_answer(physical_ising, dwave_response, stream=None):
+    """Report the solutions to a problem that ran on the D-Wave.  Structured
+    output goes to a given SolutionStream or, if none is given, to a new
+    one."""
+    answer, final_answer, num_occurrences, num_not_broken = dwave_response
+
+    # Output solver timing information.
+    if cl_args.verbose >= 1:
+        try:
+            timing_info = list(answer["timing"].items())
+            sys.stderr.write("Timing information:\n\n")
+            sys.stderr.write("    %-30s %-10s\n" % ("Measurement", "Value (us)"))
+            sys.stderr.write("    %s %s\n" % ("-" * 30, "-" * 10))
+            for timing_value in sorted(timing_info):
+                sys.stderr.write("    %-30s %10d\n" % timing_value)
+            sys.stderr.write("\n")
+        except KeyError:
+            # Not all solvers provide timing information.
+            pass
+
+    # Determine the set of solutions to output.
+    energies = [e + physical_ising.simple_offset for e in answer["energies"]]
+    if cl_args.solutions_file != None:
+        qmasm.write_solutions_npz(cl_args.solutions_file, physical_ising,
+                                  final_answer, energies, num_occurrences)
+    n_low_energies = len([e for e in energies if abs(e - energies[0]) < min_energy_delta])
+    if cl_args.all_solns:
+        n_solns_to_output = len(final_answer)
+    else:
+        n_solns_to_output = min(n_low_energies, len(final_answer))
+    n_assertion_violations = 0
+    id2solution = {}   # Map from an int to a solution
+    structured = cl_args.values in ["json", "ndjson", "msgpack"]
+    if structured:
+        # Stream each unique solution as soon as we encounter it instead of
+        # retaining them all for sorting.
+        if stream == None:
+            stream = qmasm.SolutionStream(cl_args.values)
+        seen_ids = set()
+    with qmasm.profiler.measure("assertions"):
+        for snum in range(n_solns_to_output):
+            # Expand each solution into one per assignment of values to the
+            # spins that can take either value.  Count a solution as violating
+            # an assertion only if every such assignment does.
+            all_bad = True
+            for free_values in itertools.product([-1, +1], repeat=len(physical_ising.free_spins)):
+                soln = ValidSolution(physical_ising, final_answer[snum], energies[snum], free_values)
+                bad_assert = any([not a[1] for a in soln.check_assertions()])
+                if not bad_assert:
+                    all_bad = False
+                elif not cl_args.all_solns:
+                    continue
+                if structured:
+                    if soln.id not in seen_ids:
+                        seen_ids.add(soln.id)
+                        try:
+                            tally = int(num_occurrences[tuple(soln.solution)])
+                        except KeyError:
+                            tally = None
+                        stream.write_solution(soln, tally)
+                elif soln.id not in id2solution:
+                    id2solution[soln.id] = soln
+            if all_bad:
+                n_assertion_violations += 1
+    if structured:
+        n_unique = len(seen_ids)
+    else:
+        n_unique = len(id2solution)
+    qmasm.profiler.add("solutions_returned", len(energies))
+    qmasm.profiler.add("solutions_unique", n_unique)
+
+    # Output information about the raw solutions.
+    if cl_args.verbose >= 1:
+        sys.stderr.write("Number of solutions found:\n\n")
+        sys.stderr.write("    %6d total\n" % len(energies))
+        sys.stderr.write("    %6d with no broken chains or broken pins\n" % num_not_broken)
+        sys.stderr.write("    %6d at minimal energy\n" % n_low_energies)
+        sys.stderr.write("    %6d with no failed assertions\n" % (n_low_energies - n_assertion_violations))
+        sys.stderr.write("    %6d excluding duplicate variable assignments\n" % n_unique)
+        sys.stderr.write("\n")
+
+    # Output energy tallies.  We first recompute these because some entries seem to
+    # be multiply listed.
+    if cl_args.verbose >= 2:
+        qmasm.output_energy_tallies(physical_ising, answer, energies)
+
+    # Output the solution to the standard output device.  Structured output
+    # concludes with a record of metrics that are otherwise written to the
+    # standard error device in human-readable form.
+    if structured:
+        try:
+            timing_info = dict(answer["timing"])
+        except KeyError:
+            timing_info = {}
+        stream.write_metrics({
+            "solutions": {
+                "total":             len(energies),
+                "intact":            num_not_broken,
+                "broken":            len(energies) - num_not_broken,
+                "minimal_energy":    n_low_energies,
+                "failed_assertions": n_assertion_violations,
+                "unique":            n_unique
+            },
+            "timing": timing_info,
+            "logical": logical_stats,
+            "physical": physical_stats
+        })
+        return
+    show_asserts = (cl_args.all_solns or cl_args.verbose >= 2) and len(physical_ising.assertions) > 0
+    qmasm.output_solution(id2solution, num_occurrences, cl_args.values,
+                          cl_args.verbose, show_asserts)
+
+# If simplification determined the value of every variable, report those
+# values as the sole solution without solving anything.
+if fully_determined:
+    qmasm.profiler.start("report")
+    report_answer(logical_ising, ({"energies": [0.0], "solutions": [[]], "num_occurrences": [1]},
+                                  [[]], {(): 1}, 1))
+    sys.exit(0)
+
 # Process all classical solvers unless we were told to do so post-embedding.
+# Report the results of those that solve the problem in-process.
 if not cl_args.always_embed and cl_args.format in classical_solvers:
-    qmasm.process_classical(logical_ising, cl_args.format, cl_args.output,
-                            cl_args.run, cl_args.extra_args, cl_args.qubo,
-                            cl_args.verbose)
+    qmasm.profiler.start("classical")
+    response = qmasm.process_classical(logical_ising, cl_args.format, cl_args.output,
+                                       cl_args.run, cl_args.extra_args, cl_args.qubo,
+                                       cl_args.verbose)
+    if response != None:
+        qmasm.profiler.start("report")
+        report_answer(logical_ising, response)
     sys.exit(0)
 
 # Embed the problem onto the D-Wave.
+qmasm.profiler.start("embed")
 physical_ising = qmasm.embed_problem_on_dwave(logical_ising, cl_args.O,
                                               cl_args.verbose,
                                               cl_args.topology_file,
                                               cl_args.always_embed,
                                               cl_args.embed_method,
-                                              cl_args.locations_file)
-
-# Set all chains to the user-specified strength then combine user-specified
-# chains with embedder-created chains.
-physical_ising = qmasm.update_strengths_from_chains(physical_ising)
+                                              cl_args.locations_file,
+                                              qmasm.EmbeddingBudget(cl_args.embed_timeout,
+                                                                    cl_args.embed_target),
+                                              cl_args.portfolio_select,
+                                              components, cl_args.components)
+
+# In a single pass, set all chains to the user-specified strength, combine
+# user-specified chains with embedder-created chains, and scale the weights and
+# strengths so Qubist doesn't complain.  Sweep and batch variants are derived
+# from the embedded problem and finalized individually.
+qmasm.profiler.start("scale")
+embedded_ising = physical_ising
+physical_ising = qmasm.finalize_physical(embedded_ising, cl_args.verbose)
 if cl_args.verbose >= 2:
     sys.stderr.write("Introduced the following new chains:\n\n")
     if len(physical_ising.chains) == 0:
@@ -192,17 +463,6 @@ if cl_args.verbose >= 2:
             sys.stderr.write("    %4d = %4d\n" % (num1, num2))
     sys.stderr.write("\n")
 
-# Map each logical qubit to one or more symbols.
-max_num = qmasm.sym_map.max_number()
-num2syms = [[] for _ in range(max_num + 1)]
-all_num2syms = [[] for _ in range(max_num + 1)]
-max_sym_name_len = 7
-for s, n in qmasm.sym_map.symbol_number_items():
-    all_num2syms[n].append(s)
-    if cl_args.verbose >= 2 or "$" not in s:
-        num2syms[n].append(s)
-        max_sym_name_len = max(max_sym_name_len, len(repr(num2syms[n])) - 1)
-
 # Output the embedding.
 if cl_args.verbose >= 1:
     sys.stderr.write("Established a mapping from logical to physical qubits:\n\n")
@@ -228,9 +488,18 @@ else:
     sys.stderr.write("\n".join(log2phys_comments) + "\n")
 
 # Output some statistics about the embedding.
+chain_lens = [len(c) for c in physical_ising.embedding]
+max_chain_len = max(chain_lens + [0])
+physical_stats["qubits"] = sum(chain_lens)
+physical_stats["couplers"] = len(physical_ising.strengths)
+physical_stats["chains"] = len(physical_ising.chains)
+physical_stats["max_chain_len"] = max_chain_len
+physical_stats["max_chain_count"] = len([l for l in chain_lens if l == max_chain_len])
+qmasm.profiler.count("physical_qubits", physical_stats["qubits"])
+qmasm.profiler.count("physical_couplers", physical_stats["couplers"])
+qmasm.profiler.count("physical_chains", physical_stats["chains"])
 if cl_args.verbose >= 1:
     # Output a table.
-    phys_wts = [elt for lst in physical_ising.embedding for elt in lst]
     sys.stderr.write("Computed the following statistics of the logical-to-physical mapping:\n\n")
     sys.stderr.write("    Type      Metric          Value\n")
     sys.stderr.write("    --------  --------------  -----\n")
@@ -238,25 +507,20 @@ if cl_args.verbose >= 1:
     sys.stderr.write("    Logical   Strengths       %5d\n" % logical_stats["strengths"])
     sys.stderr.write("    Logical     Equivalences  %5d\n" % logical_stats["eqs"])
     sys.stderr.write("    Logical     Pins          %5d\n" % logical_stats["pins"])
-    sys.stderr.write("    Physical  Qubits          %5d\n" % len(phys_wts))
-    sys.stderr.write("    Physical  Couplers        %5d\n" % len(physical_ising.strengths))
-    sys.stderr.write("    Physical    Chains        %5d\n" % len(physical_ising.chains))
+    sys.stderr.write("    Logical   Components      %5d\n" % logical_stats["components"])
+    sys.stderr.write("    Physical  Qubits          %5d\n" % physical_stats["qubits"])
+    sys.stderr.write("    Physical  Couplers        %5d\n" % physical_stats["couplers"])
+    sys.stderr.write("    Physical    Chains        %5d\n" % physical_stats["chains"])
     sys.stderr.write("\n")
 
     # Output some additional chain statistics.
-    chain_lens = [len(c) for c in physical_ising.embedding]
-    max_chain_len = 0
-    if chain_lens != []:
-        max_chain_len = max(chain_lens)
-    num_max_chains = len([l for l in chain_lens if l == max_chain_len])
-    sys.stderr.write("    Maximum chain length = %d (occurrences = %d)\n\n" % (max_chain_len, num_max_chains))
-
-# Manually scale the weights and strengths so Qubist doesn't complain.
-physical_ising = qmasm.scale_weights_strengths(physical_ising, cl_args.verbose)
+    sys.stderr.write("    Maximum chain length = %d (occurrences = %d)\n\n" %
+                     (physical_stats["max_chain_len"], physical_stats["max_chain_count"]))
 
 # Process all classical solvers.  If we're here and the solver is classical,
 # then always_embed must be True.
 if cl_args.format in classical_solvers:
+    qmasm.profiler.start("classical")
     qmasm.process_classical(physical_ising, cl_args.format, cl_args.output,
                             cl_args.run, cl_args.extra_args, cl_args.qubo,
                             cl_args.verbose)
@@ -264,6 +528,7 @@ if cl_args.format in classical_solvers:
 
 # Output a file in any of a variety of formats.  Note that a few cases
 # were handled above by process_classical.
+qmasm.profiler.start("output")
 if write_output_file:
     if cl_args.format == "qmasm":
         # Don't write a QMASM file if we already did so before embedding.
@@ -275,131 +540,89 @@ if write_output_file:
 if not cl_args.run:
     sys.exit(0)
 
-# Submit the problem to the D-Wave.
-if cl_args.verbose >= 1:
-    sys.stderr.write("Submitting the problem to the %s solver.\n\n" % qmasm.solver_name)
-dwave_response = qmasm.submit_dwave_problem(cl_args.verbose,
-                                            physical_ising,
-                                            cl_args.samples,
-                                            cl_args.anneal_time,
-                                            cl_args.spin_revs,
-                                            cl_args.postproc,
-                                            cl_args.discard)
-answer, final_answer, num_occurrences, num_not_broken = dwave_response
-
-# Output solver timing information.
-if cl_args.verbose >= 1:
-    try:
-        timing_info = list(answer["timing"].items())
-        sys.stderr.write("Timing information:\n\n")
-        sys.stderr.write("    %-30s %-10s\n" % ("Measurement", "Value (us)"))
-        sys.stderr.write("    %s %s\n" % ("-" * 30, "-" * 10))
-        for timing_value in sorted(timing_info):
-            sys.stderr.write("    %-30s %10d\n" % timing_value)
-        sys.stderr.write("\n")
-    except KeyError:
-        # Not all solvers provide timing information.
-        pass
-
-# Define a class to represent a valid solution.
-class ValidSolution:
-    "Represent a minimal state of a spin system."
-
-    def __init__(self, problem, soln, energy):
-        # Map named variables to spins.
-        self.problem = problem
-        self.solution = soln
-        self.energy = energy
-        self.names = []       # List of names for each named row
-        self.spins = []       # Spin for each named row
-        self.all_names = []   # List of names for each named row, including "$" names
-        self.all_spins = []   # Spin for each named row, including "$" names
-        self.id = 0           # Map from spins to an int
-        self._checked_asserts = None  # Memoized result of check_assertions
-        for q in range(len(soln)):
-            # Add all names to all_num2syms.
-            if all_num2syms[q] == []:
-                continue
-            self.all_names.append(" ".join(all_num2syms[q]))
-            self.all_spins.append(soln[q])
-
-            # Add only non-"$" names to num2syms.
-            if num2syms[q] == []:
-                continue
-            self.names.append(" ".join(num2syms[q]))
-            self.spins.append(soln[q])
-            self.id = self.id*2 + (soln[q] + 1)/2
-
-        # Additionally map the spins computed during simplification.
-        for nm, s in problem.known_values.items():
-            self.all_names.append(nm)
-            self.all_spins.append(s)
-            if cl_args.verbose < 2 and "$" in nm:
-                continue
-            self.names.append(nm)
-            self.spins.append(s)
-            self.id = self.id*2 + (s + 1)/2
-
-    def check_assertions(self):
-        "Return the result of applying each assertion."
-        # Return the previous result, if any.
-        if self._checked_asserts != None:
-            return self._checked_asserts
-
-        # Construct a mapping from names to bits.
-        name2bit = {}
-        for i in range(len(self.all_spins)):
-            names = self.all_names[i].split()
-            spin = self.all_spins[i]
-            if spin in [-1, 1]:
-                spin = (spin + 1)//2
-            else:
-                spin = None
-            for nm in names:
-                name2bit[nm] = spin
-
-        # Test each assertion in turn.
-        results = []
-        for a in self.problem.assertions:
-            results.append((str(a), a.evaluate(name2bit)))
-        self._checked_asserts = results
-        return self._checked_asserts
-
-# Determine the set of solutions to output.
-energies = [e + physical_ising.simple_offset for e in answer["energies"]]
-n_low_energies = len([e for e in energies if abs(e - energies[0]) < min_energy_delta])
-if cl_args.all_solns:
-    n_solns_to_output = len(final_answer)
+# Submit the problem to the D-Wave.  In batch and sweep modes, prepare each
+# variant while the previously submitted variants run.
+qmasm.profiler.start("submit")
+qmasm.profiler.count("samples_requested", cl_args.samples)
+if sweeping:
+    # Determine every {chain strength, pin strength} pair to try.
+    chain_strs = cl_args.chain_strength_sweep
+    if chain_strs == None:
+        chain_strs = [qmasm.chain_strength]
+    pin_strs = cl_args.pin_strength_sweep
+    if pin_strs == None:
+        pin_strs = [cl_args.pin_strength]
+    sweep = []
+    for c in chain_strs:
+        for p in pin_strs:
+            if p == None:
+                # Pin strength defaults to the chain strength.
+                p = c
+            sweep.append((c, p))
+
+    # Submit one variant of the physical problem per pair.  Each variant is
+    # prepared while the previous one runs.
+    if cl_args.verbose >= 1:
+        sys.stderr.write("Submitting %d variants of the problem to the %s solver.\n\n" % (len(sweep), qmasm.solver_name))
+    pipeline = qmasm.SubmissionPipeline(cl_args.verbose,
+                                        cl_args.samples,
+                                        cl_args.anneal_time,
+                                        cl_args.spin_revs,
+                                        cl_args.postproc,
+                                        cl_args.discard)
+    for c, p in sweep:
+        variant_ising = qmasm.restrengthen_physical(logical_ising, embedded_ising, c, p)
+        variant_ising = qmasm.finalize_physical(variant_ising, cl_args.verbose, c)
+        pipeline.submit(variant_ising)
+
+    # Report the broken-chain and ground-state rates of each variant.
+    results = []
+    vnum = 0
+    for pending, dwave_response in pipeline.results():
+        answer = dwave_response[0]
+        stats = qmasm.sweep_statistics(logical_ising, pending.physical, answer)
+        results.append(sweep[vnum] + stats)
+        vnum += 1
+    qmasm.output_sweep_results(results, min_energy_delta)
+elif batch_variants == None:
+    if cl_args.verbose >= 1:
+        sys.stderr.write("Submitting the problem to the %s solver.\n\n" % qmasm.solver_name)
+    dwave_response = qmasm.submit_dwave_problem(cl_args.verbose,
+                                                physical_ising,
+                                                cl_args.samples,
+                                                cl_args.anneal_time,
+                                                cl_args.spin_revs,
+                                                cl_args.postproc,
+                                                cl_args.discard)
+    qmasm.profiler.start("report")
+    report_answer(physical_ising, dwave_response)
 else:
-    n_solns_to_output = min(n_low_energies, len(final_answer))
-n_assertion_violations = 0
-id2solution = {}   # Map from an int to a solution
-for snum in range(n_solns_to_output):
-    soln = ValidSolution(physical_ising, final_answer[snum], energies[snum])
-    bad_assert = any([not a[1] for a in soln.check_assertions()])
-    if bad_assert:
-        n_assertion_violations += 1
-        if not cl_args.all_solns:
-            continue
-    if soln.id not in id2solution:
-        id2solution[soln.id] = soln
-
-# Output information about the raw solutions.
-if cl_args.verbose >= 1:
-    sys.stderr.write("Number of solutions found:\n\n")
-    sys.stderr.write("    %6d total\n" % len(energies))
-    sys.stderr.write("    %6d with no broken chains or broken pins\n" % num_not_broken)
-    sys.stderr.write("    %6d at minimal energy\n" % n_low_energies)
-    sys.stderr.write("    %6d with no failed assertions\n" % (n_low_energies - n_assertion_violations))
-    sys.stderr.write("    %6d excluding duplicate variable assignments\n" % len(id2solution))
-    sys.stderr.write("\n")
-
-# Output energy tallies.  We first recompute these because some entries seem to
-# be multiply listed.
-if cl_args.verbose >= 2:
-    qmasm.output_energy_tallies(physical_ising, answer, energies)
-
-# Output the solution to the standard output device.
-show_asserts = (cl_args.all_solns or cl_args.verbose >= 2) and len(physical_ising.assertions) > 0
-qmasm.output_solution(id2solution, num_occurrences, cl_args.values,
-                      cl_args.verbose, show_asserts)
+    if cl_args.verbose >= 1:
+        sys.stderr.write("Submitting %d variants of the problem to the %s solver.\n\n" % (len(batch_variants), qmasm.solver_name))
+    pipeline = qmasm.SubmissionPipeline(cl_args.verbose,
+                                        cl_args.samples,
+                                        cl_args.anneal_time,
+                                        cl_args.spin_revs,
+                                        cl_args.postproc,
+                                        cl_args.discard)
+    for pin_str, pins in batch_variants:
+        variant_ising = qmasm.pin_variant(embedded_ising, pins)
+        variant_ising = qmasm.finalize_physical(variant_ising, cl_args.verbose)
+        pipeline.submit(variant_ising)
+    # Report each variant's solutions either as a section of text or as
+    # part of a single structured stream.
+    stream = None
+    if cl_args.values in ["json", "ndjson", "msgpack"]:
+        stream = qmasm.SolutionStream(cl_args.values, batch=True)
+    vnum = 0
+    for pending, dwave_response in pipeline.results():
+        pin_str, pins = batch_variants[vnum]
+        if stream == None:
+            print("=== VARIANT %d: %s ===" % (vnum + 1, pin_str))
+            print("")
+        else:
+            stream.begin_variant(vnum + 1, dict([(p.sym, bool(p.goal)) for p in pins]))
+        report_answer(pending.physical, dwave_response, stream)
+        vnum += 1
+    if stream != None:
+        stream.finish()
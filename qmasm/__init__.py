@@ -1,9 +1,13 @@
 from .assertions import *
+from .chainsplit import *
 from .classical import *
 from .cmdline import *
+from .components import *
 from .dwave import *
+from .instrument import *
 from .output import *
 from .parse import *
+from .placement import *
 from .problem import *
 from .utils import *
 from .globals import *
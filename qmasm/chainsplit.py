@@ -0,0 +1,171 @@
+###################################
+# Split shared qubits among       #
+# chains to minimize the maximum  #
+# chain length                    #
+#                                 #
+# By Scott Pakin <pakin@lanl.gov> #
+###################################
+
+from collections import deque
+
+# Memoized splits, keyed on the conflict structure
+_split_cache = {}
+
+# Number of splits to memoize before starting afresh
+split_cache_limit = 1000
+
+def _max_flow(num_nodes, arcs, source, sink):
+    """Compute a maximum flow with Dinic's algorithm given a number of
+    vertices and a list of {tail, head, capacity} arcs.  Return the flow
+    value and a list of the flow along each arc."""
+    # Store each arc and its reverse adjacently so arc a's reverse is a^1.
+    head = []
+    cap = []
+    adj = [[] for i in range(num_nodes)]
+    for u, v, c in arcs:
+        adj[u].append(len(head))
+        head.append(v)
+        cap.append(c)
+        adj[v].append(len(head))
+        head.append(u)
+        cap.append(0)
+
+    total = 0
+    while True:
+        # Assign each vertex its distance from the source in the residual
+        # graph.
+        level = [-1]*num_nodes
+        level[source] = 0
+        bfs = deque([source])
+        while bfs:
+            u = bfs.popleft()
+            for a in adj[u]:
+                if cap[a] > 0 and level[head[a]] < 0:
+                    level[head[a]] = level[u] + 1
+                    bfs.append(head[a])
+        if level[sink] < 0:
+            break
+
+        # Repeatedly push flow along shortest augmenting paths, advancing
+        # each vertex's arc pointer past saturated or useless arcs.
+        ptr = [0]*num_nodes
+        while True:
+            path = []
+            u = source
+            while u != sink:
+                while ptr[u] < len(adj[u]):
+                    a = adj[u][ptr[u]]
+                    if cap[a] > 0 and level[head[a]] == level[u] + 1:
+                        break
+                    ptr[u] += 1
+                if ptr[u] == len(adj[u]):
+                    # Dead end: Retreat to the previous vertex.
+                    if u == source:
+                        break
+                    level[u] = -1
+                    u = head[path.pop() ^ 1]
+                    ptr[u] += 1
+                    continue
+                a = adj[u][ptr[u]]
+                path.append(a)
+                u = head[a]
+            if u != sink:
+                break
+            amount = min([cap[a] for a in path])
+            for a in path:
+                cap[a] -= amount
+                cap[a ^ 1] += amount
+            total += amount
+
+    # The flow along each arc is the capacity of its reverse.
+    return total, [cap[2*i + 1] for i in range(len(arcs))]
+
+def _split_with_bound(base, chains, nodes, bound):
+    """Split each chain's qubits among its ends without any end exceeding
+    the given bound.  Return a list of per-end amounts for each chain or None
+    if no such split exists."""
+    # Number the vertices: source, sink, chains, then ends.
+    source, sink = 0, 1
+    end_num = dict([(v, 2 + len(chains) + i) for i, v in enumerate(nodes)])
+    arcs = []
+    needed = 0
+    for i, (ends, length, interior) in enumerate(chains):
+        # Interior nodes absorb up to bound qubits each; ends take the rest.
+        if interior > 0:
+            amount = max(0, length - bound*interior)
+        else:
+            amount = length
+        arcs.append((source, 2 + i, amount))
+        needed += amount
+    for i, (ends, length, interior) in enumerate(chains):
+        for v in sorted(set(ends), key=list(ends).index):
+            arcs.append((2 + i, end_num[v], needed))
+    for v in nodes:
+        room = bound - base[v]
+        if room < 0:
+            return None
+        arcs.append((end_num[v], sink, room))
+    total, flows = _max_flow(2 + len(chains) + len(nodes), arcs, source, sink)
+    if total < needed:
+        return None
+
+    # Convert arc flows to per-end amounts.
+    split = []
+    f = len(chains)
+    for ends, length, interior in chains:
+        amounts = []
+        seen = set()
+        for v in ends:
+            if v in seen:
+                amounts.append(0)
+            else:
+                amounts.append(flows[f])
+                seen.add(v)
+                f += 1
+        split.append(amounts)
+    return split
+
+def min_max_split(base, chains):
+    """Split the shared qubits of a set of chains among the chains' end nodes
+    so as to minimize the largest number of qubits assigned to any node.
+    base maps each end node to the number of qubits it already holds.
+    chains is a list of {ends, length, interior} tuples, in which interior
+    is the number of nodes strung along the chain that share in its
+    leftover qubits.  Each interior node is limited to the same bound as
+    the end nodes.  Return the minimal bound and a list of the number of
+    qubits assigned to each chain's ends, or {None, None} if the chains
+    cannot be split."""
+    # Consult the cache first.
+    key = (tuple(sorted(base.items())), tuple([(tuple(e), l, n) for e, l, n in chains]))
+    try:
+        bound, split = _split_cache[key]
+        return bound, [list(s) for s in split]
+    except KeyError:
+        pass
+
+    # Binary search for the smallest bound that admits a split.  Each
+    # interior node needs at least one qubit.
+    nodes = sorted(set([v for ends, length, interior in chains for v in ends]))
+    if len(nodes) == 0 or any([length < interior for ends, length, interior in chains]):
+        return None, None
+    lo = max([base[v] for v in nodes])
+    if any([interior > 0 for ends, length, interior in chains]):
+        lo = max(lo, 1)
+    hi = lo + sum([length for ends, length, interior in chains])
+    best = _split_with_bound(base, chains, nodes, hi)
+    if best == None:
+        return None, None
+    while lo < hi:
+        mid = (lo + hi)//2
+        split = _split_with_bound(base, chains, nodes, mid)
+        if split == None:
+            lo = mid + 1
+        else:
+            hi = mid
+            best = split
+
+    # Memoize and return the split.
+    if len(_split_cache) >= split_cache_limit:
+        _split_cache.clear()
+    _split_cache[key] = (hi, best)
+    return hi, [list(s) for s in best]
@@ -3,6 +3,8 @@
 # By Scott Pakin <pakin@lanl.gov>            #
 ##############################################
 
+import heapq
+import numpy
 import os
 import qmasm
 import re
@@ -14,6 +16,11 @@ import tempfile
 # Define a scale factor for converting floats to ints for MiniZinc's sake.
 qmasm.minizinc_scale_factor = 10000.0
 
+# Define the largest amount of memory (in bytes) the exact solver is allowed to
+# devote to its tables and the largest number of ground states it will report.
+qmasm.exact_memory_budget = 2**30
+qmasm.exact_max_solutions = 100000
+
 def run_qbsolv(ising, oname, extra_args, verbosity):
     "Run qmasm-qbsolv on the problem and report the result."
     # Use the specified file name if provided.  Otherwise, write to a temporary
@@ -117,8 +124,153 @@ def run_minizinc(ising, oname, extra_args, verbosity):
     # Delete the .mzn file.
     os.remove(mzn_fname)
 
+def min_fill_order(adj):
+    """Given a map from each vertex to its set of neighbors, return a
+    variable-elimination order as a list of {vertex, neighbors when
+    eliminated} pairs.  Vertices are chosen greedily to minimize the number of
+    edges their elimination adds."""
+    adj = {v: set(nbrs) for v, nbrs in adj.items()}
+
+    def fill_in(v):
+        "Return the number of edges needed to make v's neighbors a clique."
+        nbrs = sorted(adj[v])
+        return len([1
+                    for i in range(len(nbrs))
+                    for j in range(i + 1, len(nbrs))
+                    if nbrs[j] not in adj[nbrs[i]]])
+
+    # Repeatedly eliminate the vertex with minimal fill-in, breaking ties by
+    # degree.  Only vertices within distance 2 of an eliminated vertex need to
+    # have their fill-in recomputed.
+    key = {v: (fill_in(v), len(adj[v]), v) for v in adj}
+    heap = list(key.values())
+    heapq.heapify(heap)
+    order = []
+    while len(heap) > 0:
+        k = heapq.heappop(heap)
+        v = k[2]
+        if v not in adj or key[v] != k:
+            continue
+        nbrs = adj.pop(v)
+        for u in nbrs:
+            adj[u].discard(v)
+            adj[u].update(nbrs - set([u]))
+        order.append((v, nbrs))
+        touched = set(nbrs)
+        for u in nbrs:
+            touched.update(adj[u])
+        for u in touched:
+            key[u] = (fill_in(u), len(adj[u]), u)
+            heapq.heappush(heap, key[u])
+    return order
+
+def _expand_factor(fvars, table, all_vars):
+    """Reshape a factor table over a sorted list of variables so it broadcasts
+    against a table over a sorted superset of those variables."""
+    fset = set(fvars)
+    return table.reshape([2 if v in fset else 1 for v in all_vars])
+
+def run_exact(ising, verbosity):
+    """Find all ground states of a logical Ising problem by variable
+    elimination over NumPy tables.  Return the same {answer, final answer,
+    tallies, number of intact solutions} tuple as submit_dwave_problem."""
+    # Construct an interaction graph over all logical qubits.
+    num_qubits = qmasm.sym_map.max_number() + 1
+    for q in ising.weights.keys():
+        num_qubits = max(num_qubits, q + 1)
+    adj = {q: set() for q in range(num_qubits)}
+    for (q1, q2), wt in ising.strengths.items():
+        if wt != 0.0 and q1 != q2:
+            adj[q1].add(q2)
+            adj[q2].add(q1)
+
+    # Choose an elimination order and refuse to proceed if its tables would
+    # exceed our memory budget.  Table entries are indexed by (spin + 1)/2.
+    order = min_fill_order(adj)
+    width = max([len(nbrs) for _, nbrs in order] + [0])
+    table_bytes = sum([2**(len(nbrs) + 1) for _, nbrs in order])*8
+    if verbosity >= 1:
+        sys.stderr.write("Solving the problem exactly by variable elimination.\n\n")
+        sys.stderr.write("    Elimination width (min-fill): %d\n" % width)
+        sys.stderr.write("    Table memory required:        %d bytes\n\n" % table_bytes)
+    if table_bytes > qmasm.exact_memory_budget:
+        qmasm.abend("Exact solution would require %d bytes of tables (elimination width %d) but only %d bytes are allowed" %
+                    (table_bytes, width, qmasm.exact_memory_budget))
+
+    # Express each point weight and coupler strength as a factor.
+    factors = []        # List of {sorted variables, table} pairs, None once consumed
+    final_factors = []  # List of constants left over after elimination
+    var2factors = {q: set() for q in range(num_qubits)}
+    def add_factor(fvars, table):
+        if len(fvars) == 0:
+            final_factors.append(float(table))
+            return
+        factors.append((fvars, table))
+        for v in fvars:
+            var2factors[v].add(len(factors) - 1)
+    for q, wt in ising.weights.items():
+        if wt != 0.0:
+            add_factor([q], numpy.array([-wt, wt]))
+    for (q1, q2), wt in ising.strengths.items():
+        if wt != 0.0 and q1 != q2:
+            q1, q2 = min(q1, q2), max(q1, q2)
+            add_factor([q1, q2], numpy.array([[wt, -wt], [-wt, wt]]))
+
+    # Eliminate each variable in turn, retaining each bucket's table for
+    # the backward pass.
+    buckets = []    # List of {variable, sorted variables, table} triples
+    for v, _ in order:
+        fnums = sorted(var2factors[v])
+        bvars = sorted(set([u for f in fnums for u in factors[f][0]] + [v]))
+        table = numpy.zeros([2]*len(bvars))
+        for f in fnums:
+            fvars, ftable = factors[f]
+            factors[f] = None
+            for u in fvars:
+                var2factors[u].discard(f)
+            table = table + _expand_factor(fvars, ftable, bvars)
+        buckets.append((v, bvars, table))
+        rest = [u for u in bvars if u != v]
+        add_factor(rest, table.min(axis=bvars.index(v)))
+    min_energy = sum(final_factors)
+
+    # Enumerate every assignment that attains each bucket's minimum, working
+    # backward through the elimination order.
+    tolerance = 1e-9*max([abs(w) for w in ising.weights.values()] +
+                         [abs(s) for s in ising.strengths.values()] + [1.0])
+    solutions = []
+    assignment = [0]*num_qubits
+    def enumerate_ground_states(bnum):
+        if len(solutions) >= qmasm.exact_max_solutions:
+            return
+        if bnum < 0:
+            solutions.append([2*b - 1 for b in assignment])
+            return
+        v, bvars, table = buckets[bnum]
+        idx = [slice(None) if u == v else assignment[u] for u in bvars]
+        vals = table[tuple(idx)]
+        for b in [0, 1]:
+            if vals[b] <= vals.min() + tolerance:
+                assignment[v] = b
+                enumerate_ground_states(bnum - 1)
+    recursion_limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(recursion_limit, len(buckets) + 100))
+    enumerate_ground_states(len(buckets) - 1)
+    sys.setrecursionlimit(recursion_limit)
+    if len(solutions) >= qmasm.exact_max_solutions:
+        sys.stderr.write("%s: Warning: Reporting only the first %d ground states\n" %
+                         (qmasm.progname, qmasm.exact_max_solutions))
+
+    # Package the ground states like a solver's response.
+    answer = {"solutions": solutions,
+              "energies": [min_energy]*len(solutions),
+              "num_occurrences": [1]*len(solutions)}
+    num_occurrences = {tuple(s): 1 for s in solutions}
+    return answer, solutions, num_occurrences, len(solutions)
+
 def process_classical(ising, format, oname, run, extra_args, as_qubo, verbosity):
-    "Write a file for classical solution and optionally run it."
+    """Write a file for classical solution and optionally run it.  For solvers
+    whose results QMASM reports itself, return a solver response."""
     if format == "qbsolv":
         if run:
             qmasm.run_qbsolv(ising, oname, shlex.split(extra_args), verbosity)
@@ -129,3 +281,5 @@ def process_classical(ising, format, oname, run, extra_args, as_qubo, verbosity)
             qmasm.run_minizinc(ising, oname, shlex.split(extra_args), verbosity)
         else:
             qmasm.write_output(ising, oname, format, as_qubo)
+    elif format == "exact":
+        return qmasm.run_exact(ising, verbosity)
@@ -9,6 +9,37 @@ import shlex
 import string
 import sys
 
+def parse_sweep(spec):
+    """Parse a sweep specification of the form START:STOP:COUNT into a list of
+    COUNT evenly spaced values from START to STOP, inclusive."""
+    try:
+        start, stop, count = spec.split(":")
+        start, stop, count = float(start), float(stop), int(count)
+    except ValueError:
+        raise argparse.ArgumentTypeError('Failed to parse "%s" as START:STOP:COUNT' % spec)
+    if count < 1:
+        raise argparse.ArgumentTypeError("A sweep must contain at least one value")
+    if count == 1:
+        return [start]
+    return [start + i*(stop - start)/(count - 1) for i in range(count)]
+
+def parse_embed_target(spec):
+    """Parse an embedding target of the form KEY=VALUE[,KEY=VALUE] (with KEY
+    either "max-chain" or "qubits") into a map from key to integer."""
+    target = {}
+    for term in spec.split(","):
+        try:
+            key, val = term.split("=")
+            val = int(val)
+        except ValueError:
+            raise argparse.ArgumentTypeError('Failed to parse "%s" as KEY=VALUE' % term)
+        if key not in ["max-chain", "qubits"]:
+            raise argparse.ArgumentTypeError('Embedding targets must be "max-chain" or "qubits", not "%s"' % key)
+        if val < 1:
+            raise argparse.ArgumentTypeError("Embedding targets must be positive")
+        target[key] = val
+    return target
+
 def parse_command_line():
     "Parse the QMASM command line.  Return an argparse.Namespace."
 
@@ -22,23 +53,27 @@ def parse_command_line():
                            help="run the program on the current solver")
     cl_parser.add_argument("-o", "--output", metavar="FILE", default="<stdout>",
                            help="file to which to write weights and strengths (default: none)")
-    cl_parser.add_argument("-f", "--format", choices=["qubist", "dw", "qbsolv", "qmasm", "minizinc", "bqpjson"], default="qubist",
-                           help="output-file format")
+    cl_parser.add_argument("-f", "--format", choices=["qubist", "dw", "qbsolv", "qmasm", "minizinc", "bqpjson", "npz", "exact"], default="qubist",
+                           help='output-file format ("npz" is binary NumPy arrays; "exact" solves the logical problem exactly with --run)')
     cl_parser.add_argument("-O", type=int, nargs="?", const=1, default=0,
                            metavar="LEVEL",
-                           help="optimize the layout; at -O1, remove unnecessary qubits; at -O2 additionally pack into fewer unit cells")
+                           help="optimize the layout; at -O1, remove unnecessary qubits; at -O2 additionally merge qubits into dominant couplers' neighbors and pack into fewer unit cells")
     cl_parser.add_argument("-p", "--pin", action="append",
                            help="pin a set of qubits to a set of true or false values")
     cl_parser.add_argument("-d", "--discard", choices=["yes", "no", "maybe"], default="yes",
                            help="always, never, or if otherwise no solutions, discard solutions with broken chains or broken pins (default: yes)")
-    cl_parser.add_argument("--values", choices=["bools", "ints"], default="bools",
-                           help="output solution values as Booleans or integers (default: bools)")
+    cl_parser.add_argument("--values", choices=["bools", "ints", "json", "ndjson", "msgpack"], default="bools",
+                           help="output solution values as Booleans or integers, or stream them with energies, tallies, and final metrics as JSON, newline-delimited JSON, or MessagePack (default: bools)")
     cl_parser.add_argument("-a", "--all-solns", action="store_true",
                            help='output all solutions, not just those at the minimal energy level (implied by "-v -v"')
     cl_parser.add_argument("-C", "--chain-strength", metavar="NEG_NUM", type=float,
                            help="negative-valued chain strength (default: automatic)")
     cl_parser.add_argument("-P", "--pin-strength", metavar="NEG_NUM", type=float,
                            help="negative-valued pin strength (default: automatic)")
+    cl_parser.add_argument("--chain-strength-sweep", metavar="START:STOP:COUNT", type=parse_sweep,
+                           help="run once for each of COUNT chain strengths from START to STOP, reusing a single embedding")
+    cl_parser.add_argument("--pin-strength-sweep", metavar="START:STOP:COUNT", type=parse_sweep,
+                           help="run once for each of COUNT pin strengths from START to STOP, reusing a single embedding")
     cl_parser.add_argument("-q", "--qubo", action="store_true",
                            help="treat inputs as QUBOs rather than Ising systems")
     cl_parser.add_argument("-s", "--samples", metavar="POS_INT", type=int, default=1000,
@@ -50,17 +85,39 @@ def parse_command_line():
     cl_parser.add_argument("--extra-args", default="",
                            help="extra arguments to pass to a solver command (default: none)")
     cl_parser.add_argument("--topology-file", default=None, metavar="FILE",
-                           help="name of a file describing the topology (list of vertex pairs)")
+                           help="name of a file describing the topology (list of vertex pairs, or an N x 2 array in a .npy or .npz file)")
     cl_parser.add_argument("-E", "--always-embed", action="store_true",
                            help="embed the problem in the physical topology even when not required (default: false)")
     cl_parser.add_argument("--postproc", choices=["none", "sample", "opt"],
                            default="none",
                            help='type of postprocessing to perform (default: "none")')
-    cl_parser.add_argument("--embed-method", choices=["dwave", "dense", "layout"],
+    cl_parser.add_argument("--embed-method", choices=["dwave", "dense", "layout", "portfolio"],
                            default="dwave",
-                           help='embedding algorithm to perform (default: "dwave")')
+                           help='embedding algorithm to perform; "portfolio" runs all available algorithms concurrently (default: "dwave")')
+    cl_parser.add_argument("--portfolio-select", choices=["first", "qubits", "max-chain"],
+                           default="qubits",
+                           help='how --embed-method=portfolio chooses a winner: the first embedding found or the one with the fewest total qubits or shortest maximum chain, with ties broken by the other metric (default: "qubits")')
+    cl_parser.add_argument("--components", choices=["pack", "separate", "whole"],
+                           default="whole",
+                           help='how to embed a problem comprising independent connected components: embed each component separately and pack them into a single QMI, embed each component separately and solve it as its own QMI, or embed the problem as a whole (default: "whole")')
     cl_parser.add_argument("--locations-file", default=None, metavar="FILE",
-                           help='name of a file describing the problem nodes locations (list of coordinate pairs)')
+                           help='name of a file describing the problem nodes locations (list of coordinate pairs) for --embed-method=layout, which is raced by --embed-method=portfolio only when this is given (default: computed automatically)')
+    cl_parser.add_argument("--embed-timeout", type=float, default=None, metavar="SECONDS",
+                           help="stop searching for an embedding after the given number of seconds and use the best embedding found so far (default: no limit)")
+    cl_parser.add_argument("--embed-target", type=parse_embed_target, default=None, metavar="KEY=VALUE[,KEY=VALUE]",
+                           help='stop searching for an embedding as soon as one meets the given "max-chain" (maximum chain length) and/or "qubits" (total qubits) limits')
+    cl_parser.add_argument("--batch", default=None, metavar="FILE",
+                           help="name of a file of pin statements, one per line, each of which is run as a separate variant of the same embedded problem")
+    cl_parser.add_argument("--profile", action="store_true",
+                           help="report the time and memory consumed by each stage of processing")
+    cl_parser.add_argument("--stats-json", default=None, metavar="FILE",
+                           help="name of a file to which to write per-stage time and memory measurements and counters in JSON format")
+    cl_parser.add_argument("--profile-stage", default=None, metavar="STAGE",
+                           help='name of a single stage (e.g., "embed" or "embed.search") to profile in detail')
+    cl_parser.add_argument("--profile-tool", choices=["cprofile", "pyinstrument"], default="cprofile",
+                           help='profiler to use for --profile-stage (default: "cprofile")')
+    cl_parser.add_argument("--solutions-file", default=None, metavar="FILE",
+                           help="name of a .npz file to which to write all solutions as bit-packed spins, energies, and tallies (requires --run)")
 
 
 
@@ -72,8 +129,25 @@ def parse_command_line():
         sys.stderr.write("%s: Warning: A non-negative chain strength (%.20g) was specified\n" % (qmasm.progname, cl_args.chain_strength))
     if cl_args.pin_strength != None and cl_args.pin_strength >= 0.0:
         sys.stderr.write("%s: Warning: A non-negative pin strength (%.20g) was specified\n" % (qmasm.progname, cl_args.pin_strength))
+    if cl_args.embed_timeout != None and cl_args.embed_timeout <= 0.0:
+        qmasm.abend("--embed-timeout must be positive")
     if cl_args.spin_revs > cl_args.samples:
         qmasm.abend("The number of spin reversals is not allowed to exceed the number of samples")
+    if cl_args.batch != None and not cl_args.run:
+        qmasm.abend("--batch requires --run")
+    if cl_args.format == "exact" and not cl_args.run:
+        qmasm.abend("-f exact requires --run")
+    if cl_args.format == "exact" and cl_args.always_embed:
+        qmasm.abend("-f exact solves the logical problem and cannot be combined with --always-embed")
+    sweeping = cl_args.chain_strength_sweep != None or cl_args.pin_strength_sweep != None
+    if sweeping and not cl_args.run:
+        qmasm.abend("Strength sweeps require --run")
+    if sweeping and cl_args.batch != None:
+        qmasm.abend("Strength sweeps and --batch are mutually exclusive")
+    if cl_args.solutions_file != None and not cl_args.run:
+        qmasm.abend("--solutions-file requires --run")
+    if cl_args.solutions_file != None and (sweeping or cl_args.batch != None):
+        qmasm.abend("--solutions-file cannot be combined with --batch or strength sweeps")
     return cl_args
 
 def quote_for_shell(token):
@@ -0,0 +1,242 @@
+###################################
+# Embed the connected components  #
+# of a logical problem separately #
+#                                 #
+# By Scott Pakin <pakin@lanl.gov> #
+###################################
+
+import copy
+import json
+import multiprocessing
+import os
+import qmasm
+import select
+import sys
+
+def _run_in_children(func, tasks, nworkers):
+    """Apply a function to each of a list of tasks, running up to nworkers
+    child processes at a time.  Each child returns its result to the parent
+    in JSON format.  Return a list of results, with None for any task whose
+    child failed."""
+    results = [None]*len(tasks)
+    if nworkers <= 1 or len(tasks) <= 1:
+        for t, task in enumerate(tasks):
+            results[t] = func(task)
+        return results
+    children = {}   # Map from a pipe's file descriptor to a {task number, PID, chunks} list
+    next_task = 0
+    sys.stdout.flush()
+    sys.stderr.flush()
+    while next_task < len(tasks) or children != {}:
+        # Launch children until we reach the worker limit.
+        while next_task < len(tasks) and len(children) < nworkers:
+            r, w = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                # Child -- perform the task, keeping stdout clean.
+                os.close(r)
+                devnull = os.open(os.devnull, os.O_WRONLY)
+                os.dup2(devnull, sys.stdout.fileno())
+                try:
+                    result = func(tasks[next_task])
+                except BaseException:
+                    result = None
+                sys.stdout.flush()
+                os.write(w, json.dumps(result).encode("utf-8"))
+                os.close(w)
+                os._exit(0)
+            os.close(w)
+            children[r] = [next_task, pid, []]
+            next_task += 1
+
+        # Collect whatever output is available.
+        ready, _, _ = select.select(list(children.keys()), [], [])
+        for fd in ready:
+            data = os.read(fd, 65536)
+            if len(data) > 0:
+                children[fd][2].append(data)
+                continue
+            t, pid, chunks = children.pop(fd)
+            os.close(fd)
+            os.waitpid(pid, 0)
+            try:
+                results[t] = json.loads(b"".join(chunks).decode("utf-8"))
+            except ValueError:
+                results[t] = None
+    return results
+
+def _cell_extents(embedding, L, M):
+    """Return the smallest and largest column and row of the Chimera unit
+    cells used by an embedding."""
+    cells = [q//(2*L) for chain in embedding for q in chain]
+    cols = [c % M for c in cells]
+    rows = [c // M for c in cells]
+    return min(cols), max(cols), min(rows), max(rows)
+
+def _pack_embeddings(topo, components, embeddings, num_vars):
+    """Translate each component's embedding by a whole number of Chimera
+    unit cells so that no two components share a qubit and every coupler an
+    embedding may use exists in the hardware.  Place the components largest
+    first, each at the first position that fits.  Return an embedding of the
+    complete problem or None if the components don't all fit."""
+    L, M, N = topo.chimera_parameters()
+    L2 = 2*L
+    hw_edges = set([(min(a, b), max(a, b)) for a, b in topo.edges])
+    degrees = topo.adj_offsets[1:] - topo.adj_offsets[:-1]
+    working = set([int(q) for q in degrees.nonzero()[0]])
+    used = set()
+    final = [[] for _ in range(num_vars)]
+    sizes = [sum([len(chain) for chain in e]) for e in embeddings]
+    for c in sorted(range(len(components)), key=lambda c: -sizes[c]):
+        embedding = embeddings[c]
+        qubits = sorted(set([q for chain in embedding for q in chain]))
+        qset = set(qubits)
+        inner = [(a, b) for a in qubits for b in topo.neighbors(a).tolist() if a < b and b in qset]
+        min_col, max_col, min_row, max_row = _cell_extents(embedding, L, M)
+        shift = None
+        for dy in range(-min_row, N - max_row):
+            for dx in range(-min_col, M - max_col):
+                delta = (dy*M + dx)*L2
+                if any([q + delta in used or q + delta not in working for q in qubits]):
+                    continue
+                if any([(a + delta, b + delta) not in hw_edges for a, b in inner]):
+                    continue
+                shift = delta
+                break
+            if shift != None:
+                break
+        if shift == None:
+            return None
+        used.update([q + shift for q in qubits])
+        for i, v in enumerate(components[c]):
+            final[v] = [q + shift for q in embedding[i]]
+    return final
+
+def _stack_embeddings(topo, hw_adj, use_rectangles, components, embeddings, num_vars):
+    """Give each component's embedding its own copy of the hardware by
+    offsetting its qubit numbers past those of the preceding components.
+    Each copy is the smallest upper-left rectangle of unit cells that holds
+    the component's embedding or, if the topology is not known to be a
+    Chimera graph, the entire hardware adjacency.  Return an embedding of the
+    complete problem, the combined adjacency, and a list of the {offset, size}
+    of each component's range of qubits."""
+    final = [[] for _ in range(num_vars)]
+    adj = []
+    parts = []
+    offset = 0
+    for c, members in enumerate(components):
+        embedding = embeddings[c]
+        part_adj = hw_adj
+        if use_rectangles and topo.chimera != None:
+            L, M, N = topo.chimera_parameters()
+            min_col, max_col, min_row, max_row = _cell_extents(embedding, L, M)
+            part_adj = topo.rectangle_adjacency(max_col + 1, max_row + 1)
+        size = max([max(a, b) for a, b in part_adj] + [q for chain in embedding for q in chain]) + 1
+        adj.extend([(a + offset, b + offset) for a, b in part_adj])
+        for i, v in enumerate(members):
+            final[v] = [q + offset for q in embedding[i]]
+        parts.append((offset, size))
+        offset += size
+    return final, adj, parts
+
+def embed_components(edges, components, num_vars, strategy, verbosity, topo, hw_adj, use_rectangles, always_embed, run_embed, embed_method, locations, budget, portfolio_select="qubits"):
+    """Embed each connected component of a logical problem independently, in
+    parallel, and in as few unit cells as possible.  Identical components
+    are embedded only once, and each is cached under its own edges, renumbered
+    from zero, so repeated subcircuits share cache entries.  If strategy is
+    "pack", translate the embeddings into disjoint regions of the hardware
+    for a single QMI; if "separate", give each component its own copy of the
+    hardware to be solved as a separate QMI.  Return an {embedding,
+    adjacency, parts} tuple, with parts being None when packed, or None on
+    failure."""
+    # A packed embedding can be translated only within a Chimera graph.
+    if strategy == "pack" and (not use_rectangles or topo.chimera == None):
+        if verbosity >= 2:
+            sys.stderr.write("  Components can be packed only into a Chimera topology.\n\n")
+        return None
+
+    # Renumber each component's variables and edges from zero.
+    position = {}   # Map from a variable to a {component, local variable} pair
+    for c, members in enumerate(components):
+        for i, v in enumerate(members):
+            position[v] = (c, i)
+    local_edges = [[] for _ in components]
+    for a, b in edges:
+        c, i = position[a]
+        local_edges[c].append((i, position[b][1]))
+
+    # Determine the distinct components to embed.
+    tasks = []      # List of {edges, number of variables, locations} tuples
+    task_of = []    # Task number of each component
+    task_num = {}   # Map from a task to its task number
+    for c, members in enumerate(components):
+        local_locs = None
+        if locations != None:
+            local_locs = [locations[v] if v < len(locations) else None for v in members]
+        key = json.dumps([local_edges[c], local_locs])
+        if key not in task_num:
+            task_num[key] = len(tasks)
+            tasks.append((local_edges[c], len(members), local_locs))
+        task_of.append(task_num[key])
+    qmasm.profiler.count("logical_components", len(components))
+    qmasm.profiler.count("distinct_components", len(tasks))
+
+    # Embed each distinct component in a child process.  Targets apply to
+    # the complete problem, not to its components.
+    part_budget = copy.copy(budget)
+    part_budget.max_chain = None
+    part_budget.max_qubits = None
+    def embed_one(task):
+        "Embed a single component."
+        local, nvars, local_locs = task
+        if local_locs == None and embed_method == "layout":
+            local_locs = qmasm.place_problem(local, nvars, 0)
+        try:
+            embedding, _ = qmasm.search_embedding(local, nvars, 0, topo, hw_adj,
+                                                  use_rectangles, True,
+                                                  always_embed, run_embed,
+                                                  embed_method, local_locs,
+                                                  part_budget, portfolio_select)
+        except Exception:
+            # Treat an embedder's exception as a failure to embed.
+            return None
+        if embedding == None:
+            return None
+        return [[int(q) for q in chain] for chain in embedding]
+    nworkers = min(multiprocessing.cpu_count(), len(tasks))
+    with qmasm.profiler.measure("components"):
+        results = _run_in_children(embed_one, tasks, nworkers)
+    embeddings = [results[t] for t in task_of]
+
+    # Report what we found.
+    if verbosity >= 2:
+        sys.stderr.write("    Component  Variables  Couplers  Qubits  Max chain  Duplicate of\n")
+        sys.stderr.write("    ---------  ---------  --------  ------  ---------  ------------\n")
+        first_of = {}
+        for c, t in enumerate(task_of):
+            dup = first_of.setdefault(t, c)
+            dup = "-" if dup == c else "%d" % (dup + 1)
+            if embeddings[c] == None:
+                sys.stderr.write("    %9d  %9d  %8d  %6s  %9s  %12s\n" %
+                                 (c + 1, len(components[c]), len(local_edges[c]), "-", "-", dup))
+            else:
+                sys.stderr.write("    %9d  %9d  %8d  %6d  %9d  %12s\n" %
+                                 ((c + 1, len(components[c]), len(local_edges[c])) +
+                                  qmasm.embedding_score(embeddings[c]) + (dup,)))
+        sys.stderr.write("\n")
+    if None in embeddings:
+        if verbosity >= 2:
+            sys.stderr.write("  Failed to embed every component.\n\n")
+        return None
+
+    # Combine the components' embeddings.
+    if strategy == "separate":
+        return _stack_embeddings(topo, hw_adj, use_rectangles, components, embeddings, num_vars)
+    final = _pack_embeddings(topo, components, embeddings, num_vars)
+    if final == None:
+        if verbosity >= 2:
+            sys.stderr.write("  Failed to pack the components' embeddings into the hardware.\n\n")
+        return None
+    if verbosity >= 2:
+        sys.stderr.write("  Packed %d components into a single QMI.\n\n" % len(components))
+    return final, hw_adj, None
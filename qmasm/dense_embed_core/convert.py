@@ -9,7 +9,11 @@
 #------------------------------------------------------------------------------
 
 #from scipy.optimize import linprog     # need scipy.__version__ >= 0.15.1
-import pulp     # python LP and MIP classes and binding
+try:
+    import pulp     # python LP and MIP classes and binding
+except ImportError:
+    pulp = None
+from qmasm.chainsplit import min_max_split
 from random import shuffle
 from copy import copy as cp
 import os    # only for deleting LP solution file
@@ -19,6 +23,7 @@ from functools import reduce
 
 USE_DEFAULT = False     # flag for using default PuLP solver.
 USE_LPR = False         # flag for using LP-relaxation. Current not implemented
+USE_PULP = False        # flag for using PuLP instead of the exact max-flow
 
 ### GLOBALS ###
 
@@ -400,10 +405,49 @@ def solToModels(sol, prob_dict):
     return models
 
 
+def solveFlow(prob_dict, verbose):
+    '''Solve the optimization problem exactly by a binary search on the
+    maximum model size, checking each size with a max-flow. Returns None,
+    None if the chains cannot be split'''
+
+    keys = prob_dict['keys']
+    N = prob_dict['node_lens']
+    M = prob_dict['chain_lens']
+
+    # each end point holds its own qbit
+    base = {node: 1 for node in prob_dict['end_lists']}
+    chains = [(keys[i], M[i], N[i]) for i in xrange(len(keys))]
+
+    max_model, split = min_max_split(base, chains)
+    if split is None:
+        return None, None
+
+    # store solution values
+    sol = {}
+    sol['n'] = [s[0] for s in split]
+    sol['m'] = [s[1] for s in split]
+    sol['mu'] = max_model
+
+    if verbose:
+        print (sol['m'])
+        print (sol['n'])
+
+    models = solToModels(sol, prob_dict)
+
+    if verbose:
+        for cell in models:
+            print ('c: %s \t :: %s' % (str(cell), str(models[cell]['qbits'])))
+
+    return models, sol['mu']
+
+
 def solveLP(prob_dict, verbose):
     '''Solve the optimation problem using either Mixed Integer Programming
     or LP-Relaxation'''
 
+    if pulp is None:
+        raise Exception('PuLP is required to solve the model LP')
+
     K = len(prob_dict['keys'])
     N = prob_dict['node_lens']
     M = prob_dict['chain_lens']
@@ -541,8 +585,12 @@ def convertToModels(paths, qbits, verbose=False):
         extended_chains = extendChains(long_chains)
         # generate problem dictionary
         prob_dict = formatProblem(extended_chains, qbits)
-        # solve for optimal model parameters
-        models, max_model = solveLP(prob_dict, verbose=verbose)
+        # solve for optimal model parameters, falling back to an LP
+        models = None
+        if not USE_PULP:
+            models, max_model = solveFlow(prob_dict, verbose=verbose)
+        if models is None:
+            models, max_model = solveLP(prob_dict, verbose=verbose)
         if models is None:
             print('Error occurred in model optimization...')
             return None, -1
@@ -15,6 +15,7 @@ import random
 from copy import copy as cp
 import numpy as np
 import sys
+import time
 import os   # for avoiding file overwriting
 import re
 import itertools
@@ -32,6 +33,19 @@ rand = None
 M = 8   # number of tile rows
 N = 8	  # number of tile columns
 L = 4	  # number of qubits per half tile
+DEADLINE = None     # time.time() after which to abandon an embedding attempt
+
+
+class EmbedTimeout(Exception):
+    '''Raised when an embedding attempt runs past DEADLINE'''
+    pass
+
+
+def checkDeadline():
+    '''Abandon the current embedding attempt if we're out of time.'''
+
+    if DEADLINE is not None and time.time() >= DEADLINE:
+        raise EmbedTimeout('Out of time')
 
 
 ### working variables
@@ -1064,6 +1078,8 @@ def placeCell(cell):
     # better qubit to consider
     while qbit is None:
 
+        checkDeadline()
+
         ### Open Seam
 
         if seam_flag:
@@ -2077,6 +2093,8 @@ def denseEmbed(source, write=False):
 
         for cell in doNow:
 
+            checkDeadline()
+
             # find qbit and paths from placed cells
             qbit, paths = placeCell(cell)
 
@@ -10,7 +10,8 @@ import dwave_networkx as dnx
 import math
 
 try:
-    from embed import denseEmbed, setChimera
+    import embed
+    from embed import denseEmbed, setChimera, EmbedTimeout
     from convert import convertToModels
     from utilities import linear_to_tuple, tuple_to_linear
 except Exception as e:
@@ -76,6 +77,9 @@ def find_dense_embedding(Q, A, **params):
 
             verbose: 0/1/2
 
+            budget: qmasm.EmbeddingBudget bounding the time spent and
+                defining a good-enough embedding (default: unlimited)
+
     Returns:
         embeddings: A list of lists of embeddings. embeddings[i] is the
             list of qubits representing logical variable i. If
@@ -86,6 +90,11 @@ def find_dense_embedding(Q, A, **params):
     else:
         verbose = 0
 
+    if 'budget' in params:
+        budget = params['budget']
+    else:
+        budget = None
+
     chimera_adj, m, n, t = parse_chimera(A)
 
     problem_adj = parse_problem(Q)
@@ -93,25 +102,56 @@ def find_dense_embedding(Q, A, **params):
     # format embedding parameters
     setChimera(chimera_adj, m, n, t)
 
-    # run a number of embedding and choose the best
+    # let each trial abandon itself once the budget expires
+    embed.DEADLINE = budget.deadline if budget is not None else None
+
+    # run a number of embedding and choose the best, stopping early if the
+    # budget expires or an embedding meets its target
     embeds = []
+    converted = []
     for trial in range(DENSE_TRIALS):
+        if budget is not None and budget.expired():
+            if verbose: print('Out of time after {0} trials'.format(trial))
+            break
         if verbose: print('Trial {0}...'.format(trial))
         try:
             cell_map, paths = denseEmbed(problem_adj, write=False)
             if verbose: print('success')
+        except KeyboardInterrupt:
+            break
+        except EmbedTimeout:
+            if verbose: print('Out of time during trial {0}'.format(trial))
+            break
         except Exception as e:
             print('failed')
             print (traceback.print_exc())
             continue
         embeds.append((cell_map, paths))
+        if budget is not None and budget.has_target():
+            # measure each embedding against the target
+            embedding = modelsToEmbedding(cell_map, paths, m, n, verbose)
+            if budget.met(embedding):
+                return embedding
+            converted.append(embedding)
 
     if len(embeds) == 0:
+        if budget is not None and budget.expired():
+            return []
         raise Exception('No embedding found')
 
+    # return the smallest of the embeddings already converted
+    if converted:
+        return min(converted, key=lambda e: (sum([len(c) for c in e]), max([len(c) for c in e])))
+
     # sort embedding by number of qubits used (total path length)
     cell_map, paths = sorted(embeds, key=lambda x: sum([len(p) for p in x[1]]))[0]
 
+    return modelsToEmbedding(cell_map, paths, m, n, verbose)
+
+def modelsToEmbedding(cell_map, paths, m, n, verbose=0):
+    '''Convert the cell map and paths of a dense embedding into a list of
+    lists of linear qubit indices, one per logical variable.'''
+
     # get cell models
     if verbose: print('Converting to models...')
     models, max_model = convertToModels(paths, cell_map)
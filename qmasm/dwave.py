@@ -3,8 +3,7 @@
 # By Scott Pakin <pakin@lanl.gov>       #
 #########################################
 
-from collections import defaultdict
-import traceback
+from collections import defaultdict, deque
 try:
     from dwave_sapi2.core import async_solve_ising, await_completion
     from dwave_sapi2.embedding import embed_problem, unembed_answer
@@ -15,26 +14,57 @@ try:
 except ImportError:
     from .fake_dwave import *
 
+# Import each embedding method separately so that the absence of one
+# method's dependencies does not disable the others.  Report import failures
+# only if the corresponding method is requested.
+embedders = {}          # Map from an embedding-method name to a function
+embedder_errors = {}    # Map from an embedding-method name to an error message
 try:
     from dwave_sapi2.embedding import find_embedding as dwave
+    embedders["dwave"] = dwave
+except Exception as e:
+    embedder_errors["dwave"] = "%s: %s" % (e.__class__.__name__, e)
+try:
     from dense_embed_core.wrapper import find_dense_embedding as dense
+    embedders["dense"] = dense
+except Exception as e:
+    embedder_errors["dense"] = "%s: %s" % (e.__class__.__name__, e)
+try:
     from layout_embed_core.wrapper import find_layout_embedding as layout
-except :
-    print('Could not load embedding method...')
-    print (traceback.print_exc())
+    embedders["layout"] = layout
+except Exception as e:
+    embedder_errors["layout"] = "%s: %s" % (e.__class__.__name__, e)
 
+import bisect
+import contextlib
 import copy
 import hashlib
+import itertools
 import json
 import marshal
 import math
+import numpy
 import operator
 import os
 import qmasm
 import re
+import select
+import signal
 import sys
 import tempfile
+import threading
 import time
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# Embedding methods that --embed-method=portfolio races against each other
+portfolio_methods = ["dwave", "dense", "layout"]
+
+# Number of seconds beyond an embedding time limit after which to kill an
+# unresponsive SAPI embedder
+embed_grace_period = 1.0
 
 def connect_to_dwave():
     """
@@ -86,7 +116,10 @@ class EmbeddingCache(object):
         self.hash = sha.hexdigest()
 
     def read(self):
-        "Read an embedding from an embedding cache or None on a cache miss."
+        """Read an embedding from an embedding cache or None on a cache miss.
+        Set self.method to the name of the embedding method that found it, if
+        known."""
+        self.method = None
         if self.hash == None:
             return None
         try:
@@ -95,19 +128,86 @@ class EmbeddingCache(object):
             return None
         embedding = marshal.load(h)
         h.close()
+        if isinstance(embedding, dict):
+            self.method = embedding["method"]
+            embedding = embedding["embedding"]
         return embedding
 
-    def write(self, embedding):
-        "Write an embedding to an embedding cache."
+    def write(self, embedding, method=None):
+        """Write an embedding, and optionally the name of the embedding method
+        that found it, to an embedding cache."""
         if self.hash == None:
             return
         try:
             h = open(os.path.join(self.cachedir, self.hash), "w")
         except IOError:
             return None
-        marshal.dump(embedding, h)
+        if method == None:
+            marshal.dump(embedding, h)
+        else:
+            marshal.dump({"embedding": embedding, "method": method}, h)
         h.close()
 
+def embedding_score(embedding):
+    """Return a {total qubits, maximum chain length} tuple for an embedding.
+    Lower scores are better."""
+    chain_lens = [len(c) for c in embedding]
+    return (sum(chain_lens), max(chain_lens + [0]))
+
+class EmbeddingBudget(object):
+    """Bound the time spent searching for an embedding and optionally define
+    an embedding good enough to end the search early.  Embedders poll an
+    EmbeddingBudget and, once it expires, return the best embedding they have
+    found so far."""
+
+    def __init__(self, timeout=None, target=None):
+        self.timeout = timeout
+        if timeout == None:
+            self.deadline = None
+        else:
+            self.deadline = time.time() + timeout
+        if target == None:
+            target = {}
+        self.max_chain = target.get("max-chain")
+        self.max_qubits = target.get("qubits")
+
+    def remaining(self):
+        "Return the number of seconds remaining or None if time is unlimited."
+        if self.deadline == None:
+            return None
+        return max(self.deadline - time.time(), 0.0)
+
+    def expired(self):
+        "Return True if no time remains."
+        return self.deadline != None and time.time() >= self.deadline
+
+    def has_target(self):
+        "Return True if a target chain length or qubit count was specified."
+        return self.max_chain != None or self.max_qubits != None
+
+    def met(self, embedding):
+        "Return True if an embedding meets every specified target."
+        if not self.has_target() or embedding == None or len(embedding) == 0:
+            return False
+        qubits, chain = embedding_score(embedding)
+        if self.max_chain != None and chain > self.max_chain:
+            return False
+        if self.max_qubits != None and qubits > self.max_qubits:
+            return False
+        return True
+
+    def keep_searching(self, best):
+        """Return True if it is worth looking for a better embedding than
+        best, which may be None.  Without a time limit or a target, any
+        embedding will do."""
+        if self.expired():
+            return False
+        if best == None:
+            return True
+        if self.deadline == None and not self.has_target():
+            return False
+        return not self.met(best)
+
 def report_embeddability(edges, adj):
     """Output some metrics on how likely a set of edges can be embedded in
     a given adjacency graph."""
@@ -168,9 +268,42 @@ def read_locations(fname, verbosity):
     return locations
 
 
+def read_binary_adjacency(fname, verbosity):
+    """Read a hardware adjacency list from a NumPy .npy file, which is
+    memory-mapped, or .npz file, which must contain an "edges" array.  Either
+    way, the edges form an N x 2 integer array.  Return an array of edges,
+    canonicalized and sorted as in read_hardware_adjacency."""
+    if verbosity >= 2:
+        sys.stderr.write("Reading hardware adjacency from %s ... " % fname)
+    try:
+        if fname.endswith(".npz"):
+            adj = numpy.load(fname)["edges"]
+        else:
+            adj = numpy.load(fname, mmap_mode="r")
+    except (IOError, ValueError, KeyError) as e:
+        qmasm.abend("Failed to read %s (%s)" % (fname, e))
+    if adj.ndim != 2 or adj.shape[1] != 2 or adj.dtype.kind not in "iu":
+        qmasm.abend("%s does not contain an N x 2 array of integers" % fname)
+    if numpy.any(adj[:, 0] == adj[:, 1]):
+        qmasm.abend("%s contains a self edge" % fname)
+
+    # Canonicalize and sort the edges unless they already are, in which case
+    # the file is used in place.
+    big = adj.max(axis=1).astype(numpy.int64)
+    small = adj.min(axis=1).astype(numpy.int64)
+    keys = big*(int(big.max()) + 1 if len(big) > 0 else 1) + small
+    if not (numpy.all(adj[:, 0] > adj[:, 1]) and numpy.all(keys[1:] > keys[:-1])):
+        keys, idx = numpy.unique(keys, return_index=True)
+        adj = numpy.column_stack((big[idx], small[idx]))
+    if verbosity >= 2:
+        sys.stderr.write("%d unique edges found\n\n" % len(adj))
+    return adj
+
 def read_hardware_adjacency(fname, verbosity):
     """Read a hardware adjacency list from a file.  Each line must contain
     a space-separated pair of vertex numbers."""
+    if fname.endswith(".npy") or fname.endswith(".npz"):
+        return read_binary_adjacency(fname, verbosity)
     adj = set()
     lineno = 0
     if verbosity >= 2:
@@ -197,6 +330,57 @@ def read_hardware_adjacency(fname, verbosity):
         sys.stderr.write("%d unique edges found\n\n" % len(adj))
     return sorted(adj)
 
+# Map from a topology file name (None for the solver) to a Topology object
+_hardware_topologies = {}
+
+def hardware_topology(hw_adj_file, verbosity):
+    """Return a Topology object describing either the current solver's
+    hardware graph or the graph in a topology file, or None if the solver lacks
+    a fixed hardware graph.  Each Topology is constructed only once per run
+    and, if $QMASMCACHE is set, is cached across runs."""
+    try:
+        return _hardware_topologies[hw_adj_file]
+    except KeyError:
+        pass
+
+    # Derive a cache key cheaply, without sorting the edges.
+    sha = hashlib.sha1()
+    if hw_adj_file == None:
+        try:
+            sha.update(("solver:%s:%s" % (qmasm.solver_name, repr(qmasm.solver.properties["couplers"]))).encode("utf-8"))
+        except KeyError:
+            _hardware_topologies[hw_adj_file] = None
+            return None
+    else:
+        st = os.stat(hw_adj_file)
+        sha.update(("file:%s:%d:%d" % (os.path.abspath(hw_adj_file), st.st_size, int(st.st_mtime))).encode("utf-8"))
+    try:
+        cname = os.path.join(os.environ["QMASMCACHE"], "topology-" + sha.hexdigest() + ".npz")
+    except KeyError:
+        cname = None
+
+    # Read the topology from the cache if possible.  Otherwise, construct it
+    # and write it to the cache.
+    topo = None
+    if cname != None and os.path.isfile(cname):
+        if verbosity >= 2:
+            sys.stderr.write("Reading hardware topology from %s.\n\n" % cname)
+        topo = qmasm.Topology.load(cname)
+    elif hw_adj_file == None:
+        try:
+            topo = qmasm.solver_topology(qmasm.solver)
+        except KeyError:
+            pass
+    else:
+        topo = qmasm.Topology(read_hardware_adjacency(hw_adj_file, verbosity))
+    if topo != None and cname != None and not os.path.isfile(cname):
+        try:
+            topo.save(cname)
+        except IOError:
+            pass
+    _hardware_topologies[hw_adj_file] = topo
+    return topo
+
 def simplify_problem(logical, verbosity):
     """Try to find spins that can be removed from the problem because their
     value is known a priori."""
@@ -256,8 +440,13 @@ def simplify_problem(logical, verbosity):
     new_obj.known_values = {s: 2*fixed_vars[n] - 1
                             for s, n in qmasm.sym_map.symbol_number_items()
                             if n in fixed_vars}
-    new_obj.simple_offset = simple["offset"]
     hs, Js, ising_offset = qubo_to_ising(simple["new_Q"])
+
+    # The original Ising energy is the QUBO energy plus qubo_offset.  The
+    # QUBO energy is the fixed variables' contribution, simple["offset"],
+    # plus the energy of new_Q, which is in turn the simplified Ising energy
+    # plus ising_offset.
+    new_obj.simple_offset += simple["offset"] + qubo_offset + ising_offset
     qubits_used = set([i for i in range(len(hs)) if hs[i] != 0.0])
     for q1, q2 in Js.keys():
         qubits_used.add(q1)
@@ -275,6 +464,9 @@ def simplify_problem(logical, verbosity):
     new_obj.pinned = [(qmap[q], b)
                       for q, b in new_obj.pinned
                       if q in qmap]
+    new_obj.pin_helpers = [(qmap[qh], qmap[qu], b)
+                           for qh, qu, b in new_obj.pin_helpers
+                           if qh in qmap and qu in qmap]
     qmasm.sym_map.overwrite_with({s: qmap[q]
                                   for s, q in qmasm.sym_map.symbol_number_items()
                                   if q in qmap})
@@ -286,46 +478,427 @@ def simplify_problem(logical, verbosity):
             sys.stderr.write("    Note: A complete solution can be found classically using roof duality and strongly connected components.\n\n")
     return new_obj
 
-def find_dwave_embedding(logical, optimization, verbosity, hw_adj_file, always_embed, embed_method, locations_file):
-    """Find an embedding of a logical problem in the D-Wave's physical topology.
-    Store the embedding within the Problem object."""
-    # SAPI tends to choke when embed_problem is told to embed a problem
-    # containing a zero-weight node whose adjacent couplers all have zero
-    # strength.  (Tested with SAPI 2.4.)  To help out SAPI, we simply remove
-    # all zero-strength couplers.
+def _presolve_dominated(q, h, nbrs):
+    """Fix a spin whose point weight outweighs all of its couplers combined.
+    Return None or a {neighbor, sign} pair with no neighbor."""
+    if abs(h[q]) > sum([abs(wt) for wt in nbrs[q].values()]):
+        if h[q] > 0.0:
+            return None, -1
+        return None, +1
+    return None
+
+def _presolve_degree_one(q, h, nbrs):
+    """Tie a spin with a single coupler stronger than its point weight to its
+    neighbor.  Return None or a {neighbor, sign} pair."""
+    if len(nbrs[q]) == 1:
+        (r, wt), = nbrs[q].items()
+        if abs(wt) > abs(h[q]):
+            if wt > 0.0:
+                return r, -1
+            return r, +1
+    return None
+
+def _presolve_dominant_coupler(q, h, nbrs):
+    """Tie a spin to a neighbor whose coupler outweighs the spin's point
+    weight and other couplers combined.  The spin's other couplers are merged
+    into the neighbor's.  Return None or a {neighbor, sign} pair."""
+    total = abs(h[q]) + sum([abs(wt) for wt in nbrs[q].values()])
+    for r, wt in sorted(nbrs[q].items()):
+        if 2.0*abs(wt) > total:
+            if wt > 0.0:
+                return r, -1
+            return r, +1
+    return None
+
+# List of presolve reductions as {minimum optimization level, description,
+# function} triples.  Each function accepts a spin, a map from spins to point
+# weights, and a map from spins to maps from neighbors to coupler strengths.
+# If a spin's value in every ground state is either constant or the same as or
+# the opposite of a neighbor's, the function returns {None, constant} or
+# {neighbor, +1 or -1}, respectively.  Otherwise, it returns None.
+presolve_reductions = [
+    (1, "dominated spins", _presolve_dominated),
+    (1, "degree-1 spins", _presolve_degree_one),
+    (2, "dominant couplers", _presolve_dominant_coupler)
+]
+
+def _presolve_eliminate(q, r, s, h, nbrs):
+    """Eliminate spin q by substituting either a constant s (if r is None) or
+    s times spin r.  Return the resulting constant energy."""
+    if r == None:
+        offset = h[q]*s
+        for k, wt in nbrs[q].items():
+            h[k] += wt*s
+            del nbrs[k][q]
+    else:
+        offset = -abs(nbrs[q][r])
+        h[r] += h[q]*s
+        for k, wt in nbrs[q].items():
+            del nbrs[k][q]
+            if k == r:
+                continue
+            new_wt = nbrs[r].get(k, 0.0) + wt*s
+            if new_wt == 0.0:
+                nbrs[r].pop(k, None)
+                nbrs[k].pop(r, None)
+            else:
+                nbrs[r][k] = new_wt
+                nbrs[k][r] = new_wt
+    del h[q]
+    del nbrs[q]
+    return offset
+
+def presolve_problem(logical, optimization, verbosity):
+    """Repeatedly eliminate spins whose value in every ground state either is
+    constant or is determined by a single neighbor's value until no more
+    spins can be eliminated.  Return a new logical Problem object."""
+    # Represent the problem as a map from spins to point weights and a map
+    # from spins to neighbors to coupler strengths.
+    all_nums = set(qmasm.sym_map.all_numbers())
+    all_nums.update(logical.weights.keys())
+    for q1, q2 in logical.strengths.keys():
+        all_nums.update([q1, q2])
+    h = {q: logical.weights.get(q, 0.0) for q in all_nums}
+    nbrs = {q: {} for q in all_nums}
+    for (q1, q2), wt in logical.strengths.items():
+        if wt != 0.0 and q1 != q2:
+            nbrs[q1][q2] = nbrs[q1].get(q2, 0.0) + wt
+            nbrs[q2][q1] = nbrs[q1][q2]
+    coupled = set([q for q in all_nums if len(nbrs[q]) > 0])
+    reductions = [(desc, func)
+                  for lvl, desc, func in presolve_reductions
+                  if optimization >= lvl]
+
+    # Apply reductions until none applies, revisiting only the spins whose
+    # terms have changed.
+    eliminated = []   # List of {spin, neighbor, sign} triples
+    free = set()      # Spins that can take either value
+    offset = 0.0
+    counts = {desc: 0 for desc, _ in reductions}
+    counts["free spins"] = 0
+    pending = deque(sorted(all_nums))
+    queued = set(all_nums)
+    while len(pending) > 0:
+        q = pending.popleft()
+        queued.discard(q)
+        if q not in h:
+            continue
+        for desc, func in reductions:
+            r_s = func(q, h, nbrs)
+            if r_s != None:
+                break
+        else:
+            # A spin left with no point weight and no couplers by the
+            # elimination of its neighbors can take either value.  Remove it
+            # from the problem, but don't fix its value.
+            if q not in coupled or len(nbrs[q]) > 0 or h[q] != 0.0:
+                continue
+            del h[q]
+            del nbrs[q]
+            free.add(q)
+            counts["free spins"] += 1
+            continue
+        r, s = r_s
+        touched = list(nbrs[q].keys())
+        offset += _presolve_eliminate(q, r, s, h, nbrs)
+        eliminated.append((q, r, s))
+        counts[desc] += 1
+        for k in touched:
+            if k not in queued:
+                pending.append(k)
+                queued.add(k)
+
+    # Express each eliminated spin in terms of a constant, a remaining spin,
+    # or a free spin.  Because a spin is always expressed in terms of a spin
+    # that was eliminated later, if at all, we work backwards.
+    resolved = {}   # Map from an eliminated spin to a {spin, sign} pair
+    for q, r, s in reversed(eliminated):
+        if r in resolved:
+            r, t = resolved[r]
+            s *= t
+        resolved[q] = (r, s)
+
+    # At high verbosity levels, report what we eliminated.
+    if verbosity >= 2:
+        sys.stderr.write("Eliminated qubits analytically:\n\n")
+        sys.stderr.write("  %6d logical qubits before presolve\n" % len(all_nums))
+        for desc in [d for d, _ in reductions] + ["free spins"]:
+            if counts[desc] > 0:
+                sys.stderr.write("  %6d %s\n" % (counts[desc], desc))
+        sys.stderr.write("  %6d logical qubits after presolve\n\n" % (len(all_nums) - len(resolved) - len(free)))
+    if len(resolved) == 0 and len(free) == 0:
+        return logical
 
-    try:
-        if verbosity >= 2:
-            sys.stderr.write("Embedding with: " + embed_method + "\n\n")
-        run_embed = globals()[embed_method]
-    except:
-        qmasm.abend("Not a valid embedding method")
+    # Map each eliminated spin's symbols to a known value, an alias of a
+    # remaining spin, the negation of a remaining spin, or a free spin.
+    new_obj = copy.deepcopy(logical)
+    num2syms = defaultdict(list)
+    for sym, q in qmasm.sym_map.symbol_number_items():
+        num2syms[q].append(sym)
+    new_sym2num = {}
+    free_syms = defaultdict(list)   # Map from a free spin to its {symbol, sign} pairs
+    for sym, q in qmasm.sym_map.symbol_number_items():
+        if q not in resolved:
+            if q in free:
+                free_syms[q].append((sym, 1))
+            else:
+                new_sym2num[sym] = q
+            continue
+        r, s = resolved[q]
+        if r in free:
+            free_syms[r].append((sym, s))
+        elif r == None:
+            new_obj.known_values[sym] = s
+        elif s == 1:
+            new_sym2num[sym] = r
+        else:
+            new_obj.anti_aliases[sym] = sorted(num2syms[r], key=lambda rs: ("$" in rs, rs))[0]
+    new_obj.free_spins += [sorted(free_syms[q]) for q in sorted(free_syms.keys())]
+    new_obj.simple_offset += offset
 
-    edges = [e for e in logical.strengths.keys() if logical.strengths[e] != 0.0]
-    edges.sort()
-    logical.edges = edges
-    if hw_adj_file == None:
-        try:
-            hw_adj = get_hardware_adjacency(qmasm.solver)
-        except KeyError:
-            # The Ising heuristic solver is an example of a solver that lacks a
-            # fixed hardware representation.  We therefore assert that the
-            # hardware is an all-to-all network that connects every node to
-            # every other node.
-            endpoints = set([a for a, b in edges] + [b for a, b in edges])
-            hw_adj = [(a, b) for a in endpoints for b in endpoints if a != b]
-    else:
-        hw_adj = read_hardware_adjacency(hw_adj_file, verbosity)
+    # Construct a simplified problem, renumbering so as to compact qubit
+    # numbers.
+    def remap(q):
+        "Map an old spin to a {new spin, sign} pair with a new spin of None if constant or free."
+        r, s = resolved.get(q, (q, 1))
+        if r == None or r in free:
+            return None, s
+        return qmap[r], s
+    qmap = dict(zip(sorted(h.keys()), range(len(h))))
+    new_obj.weights = defaultdict(lambda: 0.0,
+                                  {qmap[q]: wt
+                                   for q, wt in h.items()
+                                   if wt != 0.0})
+    new_obj.strengths = qmasm.canonicalize_strengths({(qmap[q1], qmap[q2]): wt
+                                                      for q1, nmap in nbrs.items()
+                                                      for q2, wt in nmap.items()
+                                                      if q1 < q2})
+    new_obj.chains = {(qmap[q1], qmap[q2]): None
+                      for q1, q2 in logical.chains.keys()
+                      if q1 in nbrs and q2 in nbrs[q1]}
+    new_pinned = {}
+    for q, b in logical.pinned:
+        r, s = remap(q)
+        if r != None:
+            new_pinned[r] = b == (s == 1)
+    new_obj.pinned = sorted(new_pinned.items())
+    new_obj.pin_helpers = [(qmap[qh], qmap[qu], b)
+                           for qh, qu, b in logical.pin_helpers
+                           if qh in qmap and qu in qmap]
+    qmasm.sym_map.overwrite_with({sym: qmap[q] for sym, q in new_sym2num.items()})
+    return new_obj
 
-    if locations_file == None:
-        locations = None
+def run_portfolio(edges, hw_adj, verbosity, locations, budget, select_by):
+    """Race every available embedding method in its own child process.
+    Depending on select_by, return the first successful embedding ("first")
+    or the best by total qubits then maximum chain length ("qubits") or by
+    maximum chain length then total qubits ("max-chain") found within the
+    budget.  Return an {embedding, method} pair, with [] and None on
+    failure."""
+    # Determine which methods can run.
+    methods = []
+    for m in portfolio_methods:
+        if m not in embedders:
+            if verbosity >= 2:
+                sys.stderr.write("  Omitting %s from the portfolio (%s).\n" % (m, embedder_errors[m]))
+        elif m == "layout" and locations == None:
+            if verbosity >= 2:
+                sys.stderr.write("  Omitting layout from the portfolio (no --locations-file).\n")
+        else:
+            methods.append(m)
+    if methods == []:
+        qmasm.abend("No embedding methods are available for --embed-method=portfolio")
+    if verbosity >= 2:
+        sys.stderr.write("  Racing %s ...\n\n" % ", ".join(methods))
+
+    # Launch one child per method.  Each child writes its embedding to a pipe
+    # in JSON format.
+    children = {}   # Map from a pipe's file descriptor to a {method, PID, chunks} list
+    start = time.time()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    for m in methods:
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # Child -- perform the embedding, keeping stdout clean.
+            os.close(r)
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull if verbosity < 2 else sys.stderr.fileno(), sys.stdout.fileno())
+            try:
+                embedding, _ = run_embedder(embedders[m], m, edges, hw_adj, 0, locations, budget)
+                embedding = [[int(q) for q in c] for c in embedding]
+            except BaseException:
+                embedding = []
+            sys.stdout.flush()
+            os.write(w, json.dumps(embedding).encode("utf-8"))
+            os.close(w)
+            os._exit(0)
+        os.close(w)
+        children[r] = [m, pid, []]
+
+    # Collect embeddings as they arrive until we have a winner, all children
+    # have finished, or we run out of time.
+    results = []    # List of {method, embedding, seconds} tuples
+    best = None
+    best_method = None
+    if select_by == "max-chain":
+        score = lambda e: tuple(reversed(embedding_score(e)))
     else:
-        locations = read_locations(locations_file, verbosity)
-
-    # Tell the user if we have any hope at all of embedding the problem.
+        score = embedding_score
+    while children != {}:
+        ready, _, _ = select.select(list(children.keys()), [], [], budget.remaining())
+        if ready == []:
+            break   # Out of time
+        for fd in ready:
+            data = os.read(fd, 65536)
+            if len(data) > 0:
+                children[fd][2].append(data)
+                continue
+            m, pid, chunks = children.pop(fd)
+            os.close(fd)
+            os.waitpid(pid, 0)
+            try:
+                embedding = json.loads(b"".join(chunks).decode("utf-8"))
+            except ValueError:
+                embedding = []
+            results.append((m, embedding, time.time() - start))
+            if len(embedding) > 0 and (best == None or score(embedding) < score(best)):
+                best = embedding
+                best_method = m
+        if best != None and (select_by == "first" or budget.met(best)):
+            break
+
+    # Cancel the losers.
+    for fd, (m, pid, chunks) in children.items():
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except OSError:
+            pass
+        os.close(fd)
+        os.waitpid(pid, 0)
+        results.append((m, None, time.time() - start))
+
+    # Report what happened.
     if verbosity >= 2:
-        report_embeddability(edges, hw_adj)
+        sys.stderr.write("    Method  Status     Qubits  Max chain  Time (s)\n")
+        sys.stderr.write("    ------  ---------  ------  ---------  --------\n")
+        for m, embedding, secs in results:
+            if embedding == None:
+                sys.stderr.write("    %-6s  %-9s  %6s  %9s  %8.3f\n" % (m, "cancelled", "-", "-", secs))
+            elif embedding == []:
+                sys.stderr.write("    %-6s  %-9s  %6s  %9s  %8.3f\n" % (m, "failed", "-", "-", secs))
+            else:
+                status = "winner" if m == best_method else "succeeded"
+                sys.stderr.write("    %-6s  %-9s  %6d  %9d  %8.3f\n" % ((m, status) + embedding_score(embedding) + (secs,)))
+        sys.stderr.write("\n")
+    if best == None:
+        return [], None
+    qmasm.profiler.add("portfolio_wins_" + best_method)
+    return best, best_method
+
+@contextlib.contextmanager
+def embedder_output(verbosity):
+    """Keep an embedder's chatter off the standard output device, which is
+    reserved for solutions, by discarding it or, at high verbosity levels,
+    redirecting it to the standard error device."""
+    sys.stdout.flush()
+    saved = os.dup(sys.stdout.fileno())
+    if verbosity < 2:
+        target = os.open(os.devnull, os.O_WRONLY)
+    else:
+        target = os.dup(sys.stderr.fileno())
+    os.dup2(target, sys.stdout.fileno())
+    os.close(target)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved, sys.stdout.fileno())
+        os.close(saved)
+
+def run_embedder(run_embed, embed_method, edges, hw_adj, verbosity, locations, budget, select_by="qubits"):
+    """Run an embedding method with whatever time remains in a budget.
+    Return an {embedding, method} pair, where the embedding is [] on failure
+    or expiration of the budget and the method is the name of the method
+    that found the embedding."""
+    if embed_method == "portfolio":
+        return run_portfolio(edges, hw_adj, verbosity, locations, budget, select_by)
+    if embed_method == "dwave":
+        # SAPI's find_embedding enforces its own time limit.
+        params = {}
+        if budget.deadline != None:
+            params["timeout"] = budget.remaining()
+        if verbosity < 2:
+            with embedder_output(verbosity):
+                return run_embed(edges, hw_adj, verbose=verbosity, **params), embed_method
+
+        # SAPI's find_embedding is hard-wired to write to stdout.  Trick it
+        # into writing into a pipe instead.
+        sepLine = "=== EMBEDDING ===\n"
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # Child -- perform the embedding.
+            os.close(r)
+            os.dup2(w, sys.stdout.fileno())
+            embedding = run_embed(edges, hw_adj, verbose=1, **params)
+            sys.stdout.flush()
+            os.write(w, sepLine)
+            os.write(w, json.dumps(embedding) + "\n")
+            os.close(w)
+            os._exit(0)
+
+        # Parent -- report the embedding's progress.  Kill the child if it
+        # overstays its time limit by more than embed_grace_period.
+        os.close(w)
+        watchdog = None
+        if budget.deadline != None:
+            watchdog = threading.Timer(budget.remaining() + embed_grace_period,
+                                       os.kill, [pid, signal.SIGKILL])
+            watchdog.daemon = True
+            watchdog.start()
+        pipe = os.fdopen(r, "r", 10000)
+        embedding = None
+        while True:
+            try:
+                rstr = pipe.readline()
+                if rstr == sepLine:
+                    break
+                if rstr == "":
+                    if budget.expired():
+                        embedding = []
+                        break
+                    qmasm.abend("Embedder failed to terminate properly")
+                sys.stderr.write("      %s" % rstr)
+            except:
+                pass
 
+        # Receive the embedding from the child.
+        if embedding == None:
+            embedding = json.loads(pipe.readline())
+        sys.stderr.write("\n")
+        pipe.close()
+        if watchdog != None:
+            watchdog.cancel()
+        os.waitpid(pid, 0)
+        return embedding, embed_method
+    with embedder_output(verbosity):
+        if embed_method == "layout":
+            embedding = run_embed(edges, hw_adj, verbose=verbosity, locations=locations, budget=budget)
+        else:
+            embedding = run_embed(edges, hw_adj, verbose=verbosity, budget=budget)
+    if embedding == None:
+        embedding = []
+    return embedding, embed_method
+
+def search_embedding(edges, num_vars, verbosity, topo, hw_adj, use_rectangles, compact, always_embed, run_embed, embed_method, locations, budget, portfolio_select="qubits"):
+    """Search for an embedding of a list of edges in a hardware adjacency,
+    consulting and updating the embedding cache.  If use_rectangles is True,
+    try successively larger rectangles of Chimera unit cells, starting with
+    the whole topology or, if compact is True, the fewest cells that could
+    possibly hold num_vars variables.  Return the best embedding and the
+    adjacency in which it was found or {None, None} on failure."""
     # Determine the edges of a rectangle of cells we want to use.  If we read
     # the topology from a file or otherwise can't prove that we have a Chimera
     # graph, we call this rectangle 0x0 and force the main embedding loop to
@@ -335,13 +908,12 @@ def find_dwave_embedding(logical, optimization, verbosity, hw_adj_file, always_e
     edgey = 0
     M = 0
     N = 0
-    num_vars = len(qmasm.sym_map.all_numbers())
     try:
-        if hw_adj_file == None:
-            L, M, N = qmasm.chimera_topology(qmasm.solver)
+        if use_rectangles:
+            L, M, N = topo.chimera_parameters()
             L2 = 2*L
             ncells = (num_vars + L2) // L2   # Round up the number of cells.
-            if optimization >= 2:
+            if compact:
                 edgey = max(int(math.sqrt(ncells)), 1)
                 edgex = max((ncells + edgey - 1) // edgey, 1)
             else:
@@ -350,31 +922,16 @@ def find_dwave_embedding(logical, optimization, verbosity, hw_adj_file, always_e
     except qmasm.NonChimera:
         pass
 
-    # Announce what we're about to do.
-    if verbosity >= 2:
-        sys.stderr.write("Embedding the logical adjacency within the physical topology.\n\n")
-
-    # Repeatedly expand edgex and edgey until the embedding works.
-    while edgex <= M and edgey <= N:
+    # Repeatedly expand edgex and edgey until the embedding works or, given a
+    # budget, until we run out of time or meet the target.
+    best = None
+    best_hw_adj = None
+    while edgex <= M and edgey <= N and budget.keep_searching(best):
         if edgex == M and edgey == N:
             alt_hw_adj = hw_adj
         else:
             # Retain adjacencies only within the rectangle.
-            alt_hw_adj = []
-            for q1, q2 in hw_adj:
-                c1 = q1//L2
-                if c1 % M >= edgex:
-                    continue
-                if c1 // M >= edgey:
-                    continue
-                c2 = q2//L2
-                if c2 % M >= edgex:
-                    continue
-                if c2 // M >= edgey:
-                    continue
-                alt_hw_adj.append((q1, q2))
-            alt_hw_adj = set(alt_hw_adj)
-        logical.hw_adj = alt_hw_adj
+            alt_hw_adj = topo.rectangle_adjacency(edgex, edgey)
 
         # See if we already have an embedding in the embedding cache.
         ec = EmbeddingCache(edges, alt_hw_adj)
@@ -385,7 +942,12 @@ def find_dwave_embedding(logical, optimization, verbosity, hw_adj_file, always_e
                 sys.stderr.write("  Using %s as the embedding cache directory ...\n" % ec.cachedir)
 
         if not always_embed:
-            embedding = ec.read()
+            with qmasm.profiler.measure("cache_lookup"):
+                embedding = ec.read()
+            if embedding == None:
+                qmasm.profiler.add("embedding_cache_misses")
+            else:
+                qmasm.profiler.add("embedding_cache_hits")
 
             if embedding == []:
                 # Cache hit, but embedding had failed
@@ -394,80 +956,144 @@ def find_dwave_embedding(logical, optimization, verbosity, hw_adj_file, always_e
             elif embedding != None:
                 # Successful cache hit!
                 if verbosity >= 2:
-                    sys.stderr.write("  Found successful embedding %s in the embedding cache.\n\n" % ec.hash)
-                logical.embedding = embedding
-                return
-            if verbosity >= 2 and ec.cachedir != None:
+                    if ec.method == None:
+                        sys.stderr.write("  Found successful embedding %s in the embedding cache.\n\n" % ec.hash)
+                    else:
+                        sys.stderr.write("  Found successful embedding %s (from --embed-method=%s) in the embedding cache.\n\n" % (ec.hash, ec.method))
+            if verbosity >= 2 and ec.cachedir != None and embedding == None:
                 sys.stderr.write("  No existing embedding found in the embedding cache.\n")
 
         else:
             embedding = None
         # Try to find an embedding, unless we previously determined that it had
         # failed.
-        if embedding != []:
-            if verbosity >= 2 and embed_method=='dwave':
-                # SAPI's find_embedding is hard-wired to write to stdout.
-                # Trick it into writing into a pipe instead.
-                if edgex == 0 and edgey == 0:
-                    sys.stderr.write("  Trying to embed ... ")
-                else:
-                    sys.stderr.write("  Trying a %dx%d unit-cell embedding ...\n\n" % (edgex, edgey))
-                sepLine = "=== EMBEDDING ===\n"
-                r, w = os.pipe()
-                pid = os.fork()
-                if pid == 0:
-                    # Child -- perform the embedding.
-                    os.close(r)
-                    os.dup2(w, sys.stdout.fileno())
-                    embedding = run_embed(edges, alt_hw_adj, verbose=1)
-                    sys.stdout.flush()
-                    os.write(w, sepLine)
-                    os.write(w, json.dumps(embedding) + "\n")
-                    os.close(w)
-                    os._exit(0)
-                else:
-                    # Parent -- report the embedding's progress.
-                    os.close(w)
-                    pipe = os.fdopen(r, "r", 10000)
-                    while True:
-                        try:
-                            rstr = pipe.readline()
-                            if rstr == sepLine:
-                                break
-                            if rstr == "":
-                                qmasm.abend("Embedder failed to terminate properly")
-                            sys.stderr.write("      %s" % rstr)
-                        except:
-                            pass
-
-                    # Receive the embedding from the child.
-                    embedding = json.loads(pipe.readline())
-                    sys.stderr.write("\n")
-            else:
-                if embed_method=='layout':
-                    embedding = run_embed(edges, alt_hw_adj, verbose=verbosity, locations=locations)
-                else:
-                    embedding = run_embed(edges, alt_hw_adj, verbose=verbosity)
-            ec.write(embedding)
-            if len(embedding) > 0:
-                # Success!
-                break
-
-        # Continued failure -- increase edgex or edgey and try again.
+        if embedding == None:
+            with qmasm.profiler.measure("search"):
+                if verbosity >= 2:
+                    if edgex == 0 and edgey == 0:
+                        sys.stderr.write("  Trying to embed ... ")
+                    else:
+                        sys.stderr.write("  Trying a %dx%d unit-cell embedding ...\n\n" % (edgex, edgey))
+                embedding, found_by = run_embedder(run_embed, embed_method, edges, alt_hw_adj,
+                                                   verbosity, locations, budget,
+                                                   portfolio_select)
+
+            # Don't cache a failure that may be due only to a lack of time.
+            if len(embedding) > 0 or not budget.expired():
+                ec.write(embedding, found_by)
+        if len(embedding) > 0 and (best == None or embedding_score(embedding) < embedding_score(best)):
+            best = embedding
+            best_hw_adj = alt_hw_adj
+
+        # Increase edgex or edgey and try again.
         if edgex < edgey:
             edgex += 1
         else:
             edgey += 1
-    if not(edgex <= M and edgey <= N):
-        qmasm.abend("Failed to embed the problem")
-    logical.embedding = embedding
-    sys.stdout.write(str(embedding) + '\n')
+    return best, best_hw_adj
+
+def find_dwave_embedding(logical, optimization, verbosity, hw_adj_file, always_embed, embed_method, locations_file, budget=None, portfolio_select="qubits", components=None, strategy="pack"):
+    """Find an embedding of a logical problem in the D-Wave's physical topology.
+    Store the embedding within the Problem object.  If an EmbeddingBudget is
+    provided, keep the best embedding found before it expires or meets its
+    target.  portfolio_select applies only to the "portfolio" method.  Given
+    a list of connected components, embed each one separately and either
+    pack them into a single QMI or, if strategy is "separate", mark them to
+    be solved as separate QMIs."""
+    # SAPI tends to choke when embed_problem is told to embed a problem
+    # containing a zero-weight node whose adjacent couplers all have zero
+    # strength.  (Tested with SAPI 2.4.)  To help out SAPI, we simply remove
+    # all zero-strength couplers.
+
+    if verbosity >= 2:
+        sys.stderr.write("Embedding with: " + embed_method + "\n\n")
+    try:
+        if embed_method == "portfolio":
+            run_embed = None
+        else:
+            run_embed = embedders[embed_method]
+    except KeyError:
+        if embed_method in embedder_errors:
+            qmasm.abend("The %s embedding method is unavailable (%s)" % (embed_method, embedder_errors[embed_method]))
+        qmasm.abend("Not a valid embedding method")
+    if budget == None:
+        budget = EmbeddingBudget()
 
-def embed_problem_on_dwave(logical, optimization, verbosity, hw_adj_file, always_embed, embed_method, locations_file):
-    """Embed a logical problem in the D-Wave's physical topology.  Return a
-    physical Problem object."""
+    edges = [e for e in logical.strengths.keys() if logical.strengths[e] != 0.0]
+    edges.sort()
+    logical.edges = edges
+    topo = hardware_topology(hw_adj_file, verbosity)
+    if topo == None:
+        # The Ising heuristic solver is an example of a solver that lacks a
+        # fixed hardware representation.  We therefore assert that the
+        # hardware is an all-to-all network that connects every node to
+        # every other node.
+        endpoints = set([a for a, b in edges] + [b for a, b in edges])
+        hw_adj = [(a, b) for a in endpoints for b in endpoints if a != b]
+    else:
+        hw_adj = topo.edges
+
+    if locations_file != None:
+        locations = read_locations(locations_file, verbosity)
+    else:
+        locations = None
+
+    # Tell the user if we have any hope at all of embedding the problem.
+    if verbosity >= 2:
+        report_embeddability(edges, hw_adj)
+
+    # Embed each connected component separately if so instructed.
+    num_vars = len(qmasm.sym_map.all_numbers())
+    use_rectangles = hw_adj_file == None and topo != None
+    if components != None and len(components) > 1 and strategy != "whole":
+        if verbosity >= 2:
+            sys.stderr.write("Embedding each of %d connected components separately.\n\n" % len(components))
+        found = qmasm.embed_components(edges, components, num_vars, strategy,
+                                       verbosity, topo, hw_adj, use_rectangles,
+                                       always_embed, run_embed, embed_method,
+                                       locations, budget, portfolio_select)
+        if found != None:
+            logical.embedding, logical.hw_adj, logical.parts = found
+            return
+        if verbosity >= 2:
+            sys.stderr.write("Embedding the problem as a whole instead.\n\n")
+
+    # Place the variables automatically for the layout-aware embedder if it
+    # was requested explicitly.  The portfolio races the layout-aware
+    # embedder only when given locations.
+    if locations == None and embed_method == "layout":
+        with qmasm.profiler.measure("placement"):
+            locations = qmasm.place_problem(edges, num_vars, verbosity)
+
+    # Announce what we're about to do.
+    if verbosity >= 2:
+        sys.stderr.write("Embedding the logical adjacency within the physical topology.\n\n")
+    best, best_hw_adj = search_embedding(edges, num_vars, verbosity, topo,
+                                         hw_adj, use_rectangles,
+                                         optimization >= 2, always_embed,
+                                         run_embed, embed_method, locations,
+                                         budget, portfolio_select)
+    if budget.expired():
+        qmasm.profiler.add("embedding_timeouts")
+        if verbosity >= 2:
+            sys.stderr.write("  Stopped searching for an embedding after %g seconds.\n\n" % budget.timeout)
+    if best == None:
+        if budget.expired():
+            qmasm.abend("Failed to embed the problem within %g seconds" % budget.timeout)
+        qmasm.abend("Failed to embed the problem")
+    if verbosity >= 2 and budget.has_target():
+        sys.stderr.write("  Best embedding found uses %d qubits with a maximum chain length of %d (target %s).\n\n" %
+                         (embedding_score(best) + ("met" if budget.met(best) else "not met",)))
+    logical.hw_adj = best_hw_adj
+    logical.embedding = best
+    logical.parts = None
+
+def embed_problem_on_dwave(logical, optimization, verbosity, hw_adj_file, always_embed, embed_method, locations_file, budget=None, portfolio_select="qubits", components=None, strategy="pack"):
+    """Embed a logical problem in the D-Wave's physical topology, optionally
+    within an EmbeddingBudget and component by component.  Return a physical
+    Problem object."""
     # Embed the problem.  Abort on failure.
-    find_dwave_embedding(logical, optimization, verbosity, hw_adj_file, always_embed, embed_method, locations_file)
+    find_dwave_embedding(logical, optimization, verbosity, hw_adj_file, always_embed, embed_method, locations_file, budget, portfolio_select, components, strategy)
     try:
         h_range = qmasm.solver.properties["h_range"]
         j_range = qmasm.solver.properties["j_range"]
@@ -477,9 +1103,10 @@ def embed_problem_on_dwave(logical, optimization, verbosity, hw_adj_file, always
     weight_list = qmasm.dict_to_list(logical.weights)
     smearable = any([s != 0.0 for s in logical.strengths.values()])
     try:
-        [new_weights, new_strengths, new_chains, new_embedding] = embed_problem(
-            weight_list, logical.strengths, logical.embedding, logical.hw_adj,
-            True, smearable, h_range, j_range)
+        with qmasm.profiler.measure("embed_problem"):
+            [new_weights, new_strengths, new_chains, new_embedding] = embed_problem(
+                weight_list, logical.strengths, logical.embedding, logical.hw_adj,
+                True, smearable, h_range, j_range)
     except ValueError as e:
         qmasm.abend("Failed to embed the problem in the solver (%s)" % e)
 
@@ -499,31 +1126,166 @@ def embed_problem_on_dwave(logical, optimization, verbosity, hw_adj_file, always
         physical.pinned.extend([(p, v) for p in physical.embedding[l]])
     return physical
 
-def update_strengths_from_chains(physical):
-    """Update strengths using the chains introduced by embedding.  Return a new
-    physical Problem object."""
-    new_physical = copy.deepcopy(physical)
-    new_physical.chains = {c: qmasm.chain_strength for c in physical.chains.keys()}
-    new_physical.strengths.update(new_physical.chains)
-    return new_physical
-
-def scale_weights_strengths(physical, verbosity):
-    "Manually scale the weights and strengths so Qubist doesn't complain."
+class FrozenDict(dict):
+    "Dictionary that cannot be modified once constructed."
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("%s objects are immutable" % self.__class__.__name__)
+
+    __setitem__ = __delitem__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self),))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+class Payload(object):
+    """Hold a physical problem exactly as it is submitted to the solver: a
+    tuple of point weights indexed by qubit, a FrozenDict of coupler
+    strengths (chains included), and a tuple of chain couplers.  A Payload is
+    built once per problem variant and shared by every sub-QMI, retry, and
+    output writer."""
+
+    def __init__(self, weights, strengths, chains):
+        object.__setattr__(self, "weights", tuple(weights))
+        if not isinstance(strengths, FrozenDict):
+            strengths = FrozenDict(strengths)
+        object.__setattr__(self, "strengths", strengths)
+        object.__setattr__(self, "chains", tuple(chains))
+
+    def __setattr__(self, name, value):
+        raise TypeError("Payload objects are immutable")
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+def finalize_physical(physical, verbosity, chain_str=None):
+    """Prepare an embedded physical Problem object for submission in a single
+    pass.  Set every chain the embedder introduced to the given chain
+    strength (default: the global chain strength), scale the weights and
+    strengths so Qubist doesn't complain, and attach a Payload.  Return a new
+    physical Problem object whose strengths are those of the Payload."""
+    if chain_str == None:
+        chain_str = qmasm.chain_strength
+
+    # Combine the embedder's chains with the other strengths.
+    strengths = dict(physical.strengths)
+    strengths.update(dict.fromkeys(physical.chains, chain_str))
+    skeys = list(strengths.keys())
+    svals = numpy.array([strengths[k] for k in skeys], dtype=float)
+    wkeys = numpy.array(list(physical.weights.keys()), dtype=numpy.int64)
+    wvals = numpy.array([physical.weights[q] for q in wkeys.tolist()], dtype=float)
+
+    # Scale everything by the same factor.
     h_range = physical.h_range
     j_range = physical.j_range
-    weight_list = qmasm.dict_to_list(physical.weights)
-    old_cap = max([abs(w) for w in weight_list + list(physical.strengths.values())])
+    old_cap = max([numpy.abs(svals).max() if len(svals) > 0 else 0.0,
+                   numpy.abs(wvals).max() if len(wvals) > 0 else 0.0])
     new_cap = min(-h_range[0], h_range[1], -j_range[0], j_range[1])
     if old_cap == 0.0:
         # Handle the obscure case of a zero old_cap.
         old_cap = new_cap
-    new_weights = qmasm.list_to_dict([w*new_cap/old_cap for w in weight_list])
-    new_strengths = {js: w*new_cap/old_cap for js, w in physical.strengths.items()}
+    svals = svals*new_cap/old_cap
+    wvals = wvals*new_cap/old_cap
     if verbosity >= 1 and old_cap != new_cap:
         sys.stderr.write("Scaling weights and strengths from [%.10g, %.10g] to [%.10g, %.10g].\n\n" % (-old_cap, old_cap, -new_cap, new_cap))
-    new_physical = copy.deepcopy(physical)
-    new_physical.weights = new_weights
-    new_physical.strengths = new_strengths
+
+    # Construct the payload and a Problem object that shares its strengths.
+    nonzero = wvals != 0.0
+    wkeys, wvals = wkeys[nonzero], wvals[nonzero]
+    weight_list = numpy.zeros(int(wkeys.max()) + 1 if len(wkeys) > 0 else 0)
+    weight_list[wkeys] = wvals
+    new_physical = copy.copy(physical)
+    new_physical.chains = dict.fromkeys(physical.chains, chain_str)
+    new_physical.payload = Payload(weight_list.tolist(),
+                                   zip(skeys, svals.tolist()),
+                                   new_physical.chains.keys())
+    new_physical.weights = defaultdict(lambda: 0.0, zip(wkeys.tolist(), wvals.tolist()))
+    new_physical.strengths = new_physical.payload.strengths
+    return new_physical
+
+def restrengthen_physical(logical, physical, chain_str, pin_str):
+    """Return a copy of a physical Problem object, as produced by
+    embed_problem_on_dwave, in which the strengths of user-specified chains
+    and pins are replaced by new values.  The embedding is reused as is.
+    Pass the result to finalize_physical with the same chain strength to
+    strengthen the chains introduced by the embedder."""
+    chain_delta = chain_str - qmasm.chain_strength
+    pin_delta = pin_str - qmasm.pin_strength
+    new_physical = copy.copy(physical)
+    new_physical.weights = defaultdict(lambda: 0.0, physical.weights)
+    new_physical.strengths = defaultdict(lambda: 0.0, physical.strengths)
+    new_physical.payload = None
+
+    # Group the physical couplers that connect two chains by the logical
+    # coupler they implement.
+    owner = {}
+    for l in range(len(physical.embedding)):
+        for q in physical.embedding[l]:
+            owner[q] = l
+    log2phys = defaultdict(list)
+    for q1, q2 in physical.strengths.keys():
+        l1, l2 = owner[q1], owner[q2]
+        if l1 == l2:
+            continue
+        if l1 > l2:
+            l1, l2 = l2, l1
+        log2phys[(l1, l2)].append((q1, q2))
+
+    # Determine how much each logical weight and strength changes.
+    weight_deltas = defaultdict(lambda: 0.0)
+    strength_deltas = defaultdict(lambda: 0.0)
+    for c in logical.chains.keys():
+        strength_deltas[c] += chain_delta
+    for qh, qu, b in logical.pin_helpers:
+        q1, q2 = min(qh, qu), max(qh, qu)
+        strength_deltas[(q1, q2)] -= chain_delta
+        if b:
+            weight_deltas[qh] -= pin_delta
+        else:
+            weight_deltas[qh] += pin_delta
+
+    # Spread each change evenly across the corresponding physical qubits and
+    # couplers, just as embedding did.
+    for q, dw in weight_deltas.items():
+        chain = new_physical.embedding[q]
+        for pq in chain:
+            new_physical.weights[pq] += dw/len(chain)
+    for ls, ds in strength_deltas.items():
+        couplers = log2phys[ls]
+        for pc in couplers:
+            new_physical.strengths[pc] += ds/len(couplers)
+    return new_physical
+
+def pin_variant(physical, pins):
+    """Return a copy of a physical Problem object in which each of a list of
+    Pin objects is applied as a point weight on its variable's chain.  Unlike
+    pin_qubits, this introduces no helper qubits so the embedding is unchanged."""
+    new_physical = copy.copy(physical)
+    new_physical.weights = defaultdict(lambda: 0.0, physical.weights)
+    new_physical.payload = None
+    new_physical.pinned = list(physical.pinned)
+    for pin in pins:
+        try:
+            num = qmasm.sym_map.to_number(pin.sym)
+        except KeyError:
+            qmasm.abend('Failed to pin unknown variable "%s"' % pin.sym)
+        chain = new_physical.embedding[num]
+        if pin.goal:
+            wt = qmasm.pin_strength/len(chain)
+        else:
+            wt = -qmasm.pin_strength/len(chain)
+        for q in chain:
+            new_physical.weights[q] += wt
+        new_physical.pinned.extend([(q, pin.goal) for q in chain])
     return new_physical
 
 # Define a function that says whether a solution contains no broken pins and no
@@ -543,6 +1305,30 @@ def solution_is_intact(physical, soln):
     # The solution looks good!
     return True
 
+def sweep_statistics(logical, physical, answer):
+    """Return the number of samples in an answer, the number with broken chains
+    or broken pins, and a map from the logical energy of each intact sample
+    to its tally."""
+    try:
+        tallies = answer["num_occurrences"]
+    except KeyError:
+        tallies = [1] * len(answer["solutions"])
+    num_samples = 0
+    num_broken = 0
+    energy_tallies = defaultdict(lambda: 0)
+    for soln, tally in zip(answer["solutions"], tallies):
+        num_samples += tally
+        if not solution_is_intact(physical, soln):
+            num_broken += tally
+            continue
+        lsoln = unembed_answer([soln], physical.embedding,
+                               broken_chains="discard",
+                               h=physical.weights, j=physical.strengths)[0]
+        energy = sum([wt*lsoln[q] for q, wt in logical.weights.items()])
+        energy += sum([wt*lsoln[q1]*lsoln[q2] for (q1, q2), wt in logical.strengths.items()])
+        energy_tallies[energy] += tally
+    return num_samples, num_broken, energy_tallies
+
 # Determine a suitable annealing time to use if none was specified.
 def get_default_annealing_time():
     try:
@@ -695,30 +1481,133 @@ def merge_answers(answers):
                 pass
         num_occurrences.append(n_occ)
 
-    # Timing measurements that represent <something> per <something> are
-    # averaged.  All other timing measurements are summed.
+    # Construct a unified answer dictionary and return it.
+    merged_answers = {
+        "solutions": solutions,
+        "energies": energies,
+        "num_occurrences": num_occurrences,
+        "timing": merge_timing(answers)
+    }
+    return merged_answers
+
+def merge_timing(answers):
+    """Combine the timing measurements of a list of answers.  Measurements
+    that represent <something> per <something> are averaged.  All other
+    timing measurements are summed."""
     timing = {}
     for ans in answers:
-        for k, v in ans["timing"].items():
+        for k, v in ans.get("timing", {}).items():
             try:
                 timing[k] += v
             except KeyError:
                 timing[k] = v
     for k, v in timing.items():
         if "_per_" in k:
-            timing[k] = int(v/float(n_ans) + 0.5)
+            timing[k] = int(v/float(len(answers)) + 0.5)
+    return timing
+
+def join_answers(parts, answers, max_ground_states=1000, energy_delta=0.005):
+    """Join the answers to separately solved components into a single answer
+    over the components' combined qubits, given the {offset, size} of each
+    component's range of qubits.  Because the components are independent,
+    every combination of their minimum-energy solutions is a ground state of
+    the whole, so these combinations come first, up to max_ground_states of
+    them.  The remaining samples are then paired in order of increasing
+    energy: the kth joint sample combines each component's kth-lowest-energy
+    sample, so joint energies are likewise nondecreasing."""
+    def tally(ans, i):
+        "Return the number of occurrences of an answer's ith solution."
+        try:
+            return ans["num_occurrences"][i]
+        except KeyError:
+            return 1
+    solutions = []
+    energies = []
+    num_occurrences = []
 
-    # Construct a unified answer dictionary and return it.
-    merged_answers = {
+    def add_solution(idx, count):
+        "Combine the given solution of each component into a joint sample."
+        soln = []
+        energy = 0.0
+        for (offset, size), ans, i in zip(parts, answers, idx):
+            piece = list(ans["solutions"][i][:size])
+            soln.extend(piece + [3]*(size - len(piece)))
+            energy += ans["energies"][i]
+        solutions.append(soln)
+        energies.append(energy)
+        num_occurrences.append(count)
+
+    # Combine each component's minimum-energy solutions in every possible
+    # way.  A combination is credited with the tally of its rarest piece.
+    ground = []
+    for ans in answers:
+        ground.append([i for i, e in enumerate(ans["energies"])
+                       if abs(e - ans["energies"][0]) < energy_delta])
+    for idx in itertools.islice(itertools.product(*ground), max_ground_states):
+        add_solution(idx, min([tally(ans, i) for ans, i in zip(answers, idx)]))
+
+    # Pair the remaining samples, skipping those in which every component
+    # is in a ground state, as we've already reported all such combinations.
+    idx = [0]*len(answers)                          # Current solution of each component
+    left = [0]*len(answers)                         # Samples remaining at each current solution
+    exhausted = [True]*len(answers)                 # Whether each component has run out of samples
+    if all([len(ans["energies"]) > 0 for ans in answers]):
+        left = [tally(ans, 0) for ans in answers]
+        exhausted = [False]*len(answers)
+    nground = [len(g) for g in ground]
+    while not all(exhausted):
+        step = min([left[c] for c in range(len(answers)) if not exhausted[c]])
+        if any([i >= n for i, n in zip(idx, nground)]):
+            add_solution(idx, step)
+
+        # Advance each component past the samples we just consumed.  A
+        # component that runs out of samples retains its final solution.
+        for c, ans in enumerate(answers):
+            if exhausted[c]:
+                continue
+            left[c] -= step
+            if left[c] == 0:
+                if idx[c] + 1 < len(ans["energies"]):
+                    idx[c] += 1
+                    left[c] = tally(ans, idx[c])
+                else:
+                    exhausted[c] = True
+    return {
         "solutions": solutions,
         "energies": energies,
         "num_occurrences": num_occurrences,
-        "timing": timing
+        "timing": merge_timing(answers)
     }
-    return merged_answers
 
-def submit_dwave_problem(verbosity, physical, samples, anneal_time, spin_revs, postproc, discard):
-    "Submit a QMI to the D-Wave."
+def split_payload(payload, embedding, parts):
+    """Split a payload over the combined qubits of separately solved
+    components into one {weights, strengths, chains} tuple per component,
+    renumbering each component's qubits from zero."""
+    starts = [offset for offset, size in parts]
+    weights = [list(payload.weights[offset:offset + size]) for offset, size in parts]
+    strengths = [{} for _ in parts]
+    for (q1, q2), wt in payload.strengths.items():
+        p = bisect.bisect_right(starts, q1) - 1
+        strengths[p][(q1 - starts[p], q2 - starts[p])] = wt
+    chains = [[] for _ in parts]
+    for chain in embedding:
+        if len(chain) > 0:
+            p = bisect.bisect_right(starts, chain[0]) - 1
+            chains[p].append([q - starts[p] for q in chain])
+    return list(zip(weights, strengths, chains))
+
+class PendingProblem(object):
+    "Represent a QMI that has been submitted to the D-Wave but not yet collected."
+
+    def __init__(self, physical, problems, samples_list, spin_rev_list):
+        self.physical = physical            # Physical Problem object that was submitted
+        self.problems = problems            # One SAPI problem handle per sub-QMI
+        self.samples_list = samples_list    # Number of samples requested by each sub-QMI
+        self.spin_rev_list = spin_rev_list  # Number of spin reversals requested by each sub-QMI
+
+def start_dwave_problem(verbosity, physical, samples, anneal_time, spin_revs, postproc):
+    """Asynchronously submit a QMI to the D-Wave.  Return a PendingProblem
+    to pass to complete_dwave_problem."""
     # Map abbreviated to full names for postprocessing types.
     postproc = {"none": "", "opt": "optimization", "sample": "sampling"}[postproc]
 
@@ -732,45 +1621,63 @@ def submit_dwave_problem(verbosity, physical, samples, anneal_time, spin_revs, p
     spin_rev_list = compute_spin_rev_counts(spin_revs, samples_list)
     nqmis = len(samples_list)   # Number of (non-unique) QMIs to submit
 
-    # Submit one or more QMIs to the D-Wave.
+    # Submit one or more QMIs to the D-Wave, all sharing the same payload.
+    # Separately solved components are submitted as separate QMIs.
+    payload = physical.payload
+    if payload == None:
+        payload = Payload(qmasm.dict_to_list(physical.weights), physical.strengths, physical.chains.keys())
+    if physical.parts == None:
+        pieces = [(payload.weights, payload.strengths, physical.embedding)]
+    else:
+        pieces = split_payload(payload, physical.embedding, physical.parts)
     problems = []
-    for i in range(nqmis):
-        solver_params = dict(chains=physical.embedding,
-                             num_reads=samples_list[i],
-                             annealing_time=anneal_time,
-                             num_spin_reversal_transforms=spin_rev_list[i],
-                             postprocess=postproc)
-        unused_params = dict()
-        while True:
-            # Repeatedly remove parameters the particular solver doesn't like
-            # until it actually works -- or fails for a different reason.
-            try:
-                weight_list = qmasm.dict_to_list(physical.weights)
-                p = async_solve_ising(qmasm.solver, weight_list, physical.strengths, **solver_params)
-                problems.append(p)
-                break
-            except ValueError as e:
-                # Is there a better way to extract the failing symbol than a
-                # regular expression match?
-                bad_name_match = re.match(r'"(.*?)"', str(e))
-                if bad_name_match == None:
-                    raise e
-                bad_name = bad_name_match.group(1)
-                unused_params[bad_name] = solver_params[bad_name]
-                del solver_params[bad_name]
-            except RuntimeError as e:
-                qmasm.abend(e)
+    for weights, strengths, chains in pieces:
+        for i in range(nqmis):
+            solver_params = dict(chains=chains,
+                                 num_reads=samples_list[i],
+                                 annealing_time=anneal_time,
+                                 num_spin_reversal_transforms=spin_rev_list[i],
+                                 postprocess=postproc)
+            unused_params = dict()
+            while True:
+                # Repeatedly remove parameters the particular solver doesn't like
+                # until it actually works -- or fails for a different reason.
+                try:
+                    p = async_solve_ising(qmasm.solver, weights, strengths, **solver_params)
+                    problems.append(p)
+                    break
+                except ValueError as e:
+                    # Is there a better way to extract the failing symbol than a
+                    # regular expression match?
+                    bad_name_match = re.match(r'"(.*?)"', str(e))
+                    if bad_name_match == None:
+                        raise e
+                    bad_name = bad_name_match.group(1)
+                    unused_params[bad_name] = solver_params[bad_name]
+                    del solver_params[bad_name]
+                except RuntimeError as e:
+                    qmasm.abend(e)
     if verbosity >= 2:
         report_parameters_used(solver_params, unused_params)
 
     # Output problem IDs as soon as they become available.
     if verbosity >= 1:
         try:
-            while any([problems[i].status()["problem_id"] == "" for i in range(nqmis)]):
-                await_completion(problems, nqmis, 1)
-            report_subproblems_submitted(nqmis, problems, samples_list, spin_rev_list)
+            while any([p.status()["problem_id"] == "" for p in problems]):
+                await_completion(problems, len(problems), 1)
+            report_subproblems_submitted(len(problems), problems,
+                                         samples_list*len(pieces),
+                                         spin_rev_list*len(pieces))
         except KeyError:
             pass   # Not all solvers support "problem_id".
+    return PendingProblem(physical, problems, samples_list, spin_rev_list)
+
+def complete_dwave_problem(verbosity, pending, discard):
+    """Wait for a previously submitted QMI to complete, and return its
+    unembedded answer."""
+    physical = pending.physical
+    problems = pending.problems
+    nqmis = len(problems)
 
     # Wait for the solver to complete.
     if verbosity >= 2:
@@ -778,39 +1685,108 @@ def submit_dwave_problem(verbosity, physical, samples, anneal_time, spin_revs, p
         cdigits = len(str(nqmis))     # Digits in the number of completed QMIs
         tdigits = len(str(nqmis*5))   # Estimate 5 seconds per QMI submission
         start_time = time.time()
-    done = False
-    while not done:
-        done = await_completion(problems, nqmis, 10)
-        if verbosity >= 2:
-            ncomplete = sum([problems[i].status()["state"] == "DONE" for i in range(nqmis)])
-            sys.stderr.write("    %*d of %d (%3.0f%%) after %*.0f seconds\n" %
-                             (cdigits, ncomplete, nqmis,
-                              100.0*float(ncomplete)/float(nqmis),
-                              tdigits, time.time() - start_time))
+    with qmasm.profiler.measure("wait"):
+        done = False
+        poll_time = 0.1   # Seconds to wait before checking again; backs off to 10
+        while not done:
+            done = await_completion(problems, nqmis, poll_time)
+            poll_time = min(2.0*poll_time, 10.0)
+            if verbosity >= 2:
+                ncomplete = sum([problems[i].status()["state"] == "DONE" for i in range(nqmis)])
+                sys.stderr.write("    %*d of %d (%3.0f%%) after %*.0f seconds\n" %
+                                 (cdigits, ncomplete, nqmis,
+                                  100.0*float(ncomplete)/float(nqmis),
+                                  tdigits, time.time() - start_time))
     if verbosity >= 2:
         sys.stderr.write("\n")
     answers = [p.result() for p in problems]
 
-    # Tally the occurrences of each solution
-    answer = merge_answers(answers)
-    solutions = answer["solutions"]
-    semifinal_answer = unembed_answer(solutions, physical.embedding,
-                                      broken_chains="minimize_energy",
-                                      h=physical.weights, j=physical.strengths)
-    try:
-        num_occurrences = {tuple(k): v
-                           for k, v in zip(semifinal_answer, answer["num_occurrences"])}
-    except KeyError:
-        num_occurrences = {tuple(a): 1 for a in semifinal_answer}
-
-    # Discard solutions with broken pins or broken chains unless instructed
-    # not to.
-    valid_solns = [s for s in solutions if solution_is_intact(physical, s)]
-    num_not_broken = len(valid_solns)
-    if discard in ["yes", "maybe"]:
-        final_answer = unembed_answer(valid_solns, physical.embedding,
-                                      broken_chains="discard",
-                                      h=physical.weights, j=physical.strengths)
-    if discard == "no" or (discard == "maybe" and len(final_answer) == 0):
-        final_answer = semifinal_answer
+    # Tally the occurrences of each solution, and discard solutions with
+    # broken pins or broken chains unless instructed not to.
+    with qmasm.profiler.measure("unembed"):
+        if physical.parts == None:
+            answer = merge_answers(answers)
+        else:
+            # Merge each component's answers then join the components.
+            n = nqmis//len(physical.parts)
+            answer = join_answers(physical.parts, [merge_answers(answers[i*n:(i + 1)*n])
+                                                   for i in range(len(physical.parts))])
+        solutions = answer["solutions"]
+        semifinal_answer = unembed_answer(solutions, physical.embedding,
+                                          broken_chains="minimize_energy",
+                                          h=physical.weights, j=physical.strengths)
+        try:
+            num_occurrences = {tuple(k): v
+                               for k, v in zip(semifinal_answer, answer["num_occurrences"])}
+        except KeyError:
+            num_occurrences = {tuple(a): 1 for a in semifinal_answer}
+
+        valid_solns = [s for s in solutions if solution_is_intact(physical, s)]
+        num_not_broken = len(valid_solns)
+        if discard in ["yes", "maybe"]:
+            final_answer = unembed_answer(valid_solns, physical.embedding,
+                                          broken_chains="discard",
+                                          h=physical.weights, j=physical.strengths)
+        if discard == "no" or (discard == "maybe" and len(final_answer) == 0):
+            final_answer = semifinal_answer
     return answer, final_answer, num_occurrences, num_not_broken
+
+def submit_dwave_problem(verbosity, physical, samples, anneal_time, spin_revs, postproc, discard):
+    "Submit a QMI to the D-Wave and wait for it to complete."
+    pending = start_dwave_problem(verbosity, physical, samples, anneal_time, spin_revs, postproc)
+    return complete_dwave_problem(verbosity, pending, discard)
+
+class SubmissionPipeline(object):
+    """Overlap the CPU-side preparation of QMIs with the execution of
+    previously submitted QMIs.  Each QMI is awaited and unembedded by a
+    background thread while the caller prepares the next one."""
+
+    def __init__(self, verbosity, samples, anneal_time, spin_revs, postproc, discard):
+        self.verbosity = verbosity
+        self.samples = samples
+        self.anneal_time = anneal_time
+        self.spin_revs = spin_revs
+        self.postproc = postproc
+        self.discard = discard
+        self.slots = []             # One {event, result, exception} list per QMI
+        self.work = queue.Queue()   # PendingProblems for the collector to await
+        self.collector = threading.Thread(target=self._collect)
+        self.collector.daemon = True
+        self.collector.start()
+
+    def _collect(self):
+        "Await and unembed each submitted QMI in turn."
+        while True:
+            item = self.work.get()
+            if item == None:
+                return
+            pending, slot = item
+            try:
+                # Progress reports would interleave with the caller's output.
+                slot[1] = complete_dwave_problem(min(self.verbosity, 1), pending, self.discard)
+            except BaseException as e:
+                slot[2] = e
+            slot[0].set()
+
+    def submit(self, physical):
+        "Submit a physical Problem object and return its PendingProblem."
+        pending = start_dwave_problem(self.verbosity, physical, self.samples,
+                                      self.anneal_time, self.spin_revs,
+                                      self.postproc)
+        slot = [threading.Event(), None, None]
+        self.slots.append((pending, slot))
+        self.work.put((pending, slot))
+        return pending
+
+    def results(self):
+        """Yield a {PendingProblem, complete_dwave_problem result} pair for
+        each submitted QMI, in submission order."""
+        self.work.put(None)
+        for pending, slot in self.slots:
+            # Wait in short increments so Ctrl-C remains responsive.
+            while not slot[0].wait(1.0):
+                pass
+            if slot[2] != None:
+                raise slot[2]
+            yield pending, slot[1]
+        self.collector.join()
@@ -3,6 +3,9 @@
 # By Scott Pakin <pakin@lanl.gov>             #
 ###############################################
 
+from collections import deque
+import math
+import numpy
 import qmasm
 
 class FakeSolver(object):
@@ -44,8 +47,9 @@ def ising_to_qubo(hs, js):
     # Discard zeroes.
     qs = {k: v for k, v in qs.items() if v != 0.0}
 
-    # Compute an energy offset.
-    qoffset = sum(hs) + sum(js.values())
+    # Compute the energy offset that converts a QUBO energy to an Ising
+    # energy.
+    qoffset = sum(js.values()) - sum(hs)
 
     # Return the QUBO matrix and energy offset.
     return qs, qoffset
@@ -56,10 +60,9 @@ def qubo_to_ising(qs):
     hs = {}  # We'll convert to a list later.
     js = {}
     for (i, j), s in qs.items():
-        if i == j:
-            hs[i] = 0.0
-            hs[j] = 0.0
-        else:
+        hs[i] = 0.0
+        hs[j] = 0.0
+        if i != j:
             js[(i, j)] = 0.0
 
     # Peform an initial conversion.
@@ -74,20 +77,583 @@ def qubo_to_ising(qs):
             hs[j] += s/4.0
 
     # Convert hs to a list and elide zeroes from js.
-    mh = max(hs.keys())
+    mh = max(list(hs.keys()) + [-1])
     hlist = [0] * (mh + 1)
     for i, s in hs.items():
         hlist[i] = s
     js = {k: v for k, v in js.items() if v != 0.0}
 
-    # QMASM doesn't use an offset so ignore it.
-    return hs, js, None
+    # Compute the energy offset that converts an Ising energy to a QUBO
+    # energy.
+    ioffset = sum([s/2.0 if i == j else s/4.0 for (i, j), s in qs.items()])
+    return hlist, js, ioffset
+
+class LocalProblem(object):
+    """Stand in for a submitted SAPI problem by sampling the Ising problem
+    locally with simulated annealing.  This is intended for testing, not
+    for producing high-quality solutions."""
+
+    next_id = 1   # Number to assign to the next problem
+
+    def __init__(self, hs, js, num_reads, sweeps=100, seed=None):
+        self.problem_id = "local-%d" % LocalProblem.next_id
+        LocalProblem.next_id += 1
+        self.answer = self._anneal(hs, js, num_reads, sweeps, numpy.random.RandomState(seed))
+
+    def _anneal(self, hs, js, num_reads, sweeps, rng):
+        """Return a SAPI-style answer dictionary.  All reads are annealed
+        at once, and qubits are updated a color class at a time so that no
+        two qubits updated together are coupled."""
+        # Store the couplers as a CSR adjacency over all qubits.
+        nqubits = len(hs)
+        q1 = numpy.array([q for q, _ in js.keys()], dtype=numpy.int64)
+        q2 = numpy.array([q for _, q in js.keys()], dtype=numpy.int64)
+        wts = numpy.array(list(js.values()), dtype=float)
+        if len(wts) > 0:
+            nqubits = max(nqubits, int(q1.max()) + 1, int(q2.max()) + 1)
+        hs = numpy.concatenate((numpy.array(hs, dtype=float), numpy.zeros(nqubits - len(hs))))
+        src = numpy.concatenate((q1, q2))
+        order = numpy.argsort(src, kind="mergesort")
+        src = src[order]
+        dst = numpy.concatenate((q2, q1))[order]
+        half_wts = numpy.concatenate((wts, wts))[order]
+        offsets = numpy.zeros(nqubits + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.bincount(src, minlength=nqubits), out=offsets[1:])
+        is_active = hs != 0.0
+        is_active[src] = True
+        active = numpy.nonzero(is_active)[0]
+
+        # Greedily color the active qubits.
+        color = {}
+        for q in active.tolist():
+            taken = set([color.get(n) for n in dst[offsets[q]:offsets[q + 1]].tolist()])
+            c = 0
+            while c in taken:
+                c += 1
+            color[q] = c
+        classes = []
+        for c in range(max(list(color.values()) + [-1]) + 1):
+            members = numpy.array(sorted([q for q, qc in color.items() if qc == c]), dtype=numpy.int64)
+            edges = numpy.concatenate([numpy.arange(offsets[q], offsets[q + 1]) for q in members])
+            bounds = numpy.concatenate(([0], numpy.cumsum(offsets[members + 1] - offsets[members])))
+            classes.append((members, dst[edges], half_wts[edges], bounds))
+
+        # Anneal every read concurrently.
+        spins = numpy.full((num_reads, nqubits), 3, dtype=numpy.int8)   # SAPI uses 3 for inactive qubits.
+        spins[:, active] = 2*rng.randint(0, 2, (num_reads, len(active))) - 1
+        strength = numpy.abs(hs) + numpy.bincount(src, weights=numpy.abs(half_wts), minlength=nqubits)
+        max_field = max([strength.max() if nqubits > 0 else 0.0, 1.0])
+        for t in range(sweeps):
+            temp = max_field*(1.0 - float(t)/sweeps) + 0.01
+            for members, nbrs, nwts, bounds in classes:
+                partial = numpy.zeros((num_reads, len(nwts) + 1))
+                numpy.cumsum(spins[:, nbrs]*nwts, axis=1, out=partial[:, 1:])
+                field = hs[members] + partial[:, bounds[1:]] - partial[:, bounds[:-1]]
+                old = spins[:, members]
+                delta = -2.0*old*field
+                flip = (delta <= 0.0) | (rng.random_sample(delta.shape) < numpy.exp(numpy.minimum(-delta/temp, 0.0)))
+                spins[:, members] = numpy.where(flip, -old, old)
+
+        # Tally each distinct solution, and sort the solutions by increasing
+        # energy.
+        solns, tallies = numpy.unique(spins, axis=0, return_counts=True)
+        values = numpy.where(solns == 3, 0, solns).astype(float)
+        energies = values.dot(hs) + (values[:, q1]*values[:, q2]).dot(wts)
+        order = numpy.argsort(energies, kind="mergesort")
+        return {"solutions": solns[order].tolist(),
+                "energies": energies[order].tolist(),
+                "num_occurrences": tallies[order].tolist(),
+                "timing": {}}
+
+    def status(self):
+        return {"problem_id": self.problem_id, "state": "DONE"}
+
+    def result(self):
+        return self.answer
+
+def async_solve_ising(solver, hs, js, num_reads=1, **params):
+    "Solve an Ising problem locally.  Solver parameters other than num_reads are ignored."
+    return LocalProblem(hs, js, num_reads)
+
+def await_completion(problems, min_done, timeout):
+    "Local problems complete as soon as they are submitted."
+    return True
 
 def get_hardware_adjacency(solver):
     qmasm.abend("Without D-Wave's libraries, QMASM can do little more than output qbsolv, MiniZinc, and flattened QMASM files")
 
+def _chain_arrays(embeddings):
+    """Return the qubits of all chains concatenated, the variable owning each
+    such qubit, and the offset of each chain within the concatenation."""
+    lengths = numpy.array([len(c) for c in embeddings], dtype=numpy.int64)
+    offsets = numpy.zeros(len(embeddings) + 1, dtype=numpy.int64)
+    numpy.cumsum(lengths, out=offsets[1:])
+    qubits = numpy.array([q for c in embeddings for q in c], dtype=numpy.int64)
+    owners = numpy.repeat(numpy.arange(len(embeddings), dtype=numpy.int64), lengths)
+    return qubits, owners, offsets
+
+def _clean_chains(embeddings, owner, eu, ev, needed):
+    """Repeatedly remove from each chain of two or more qubits the qubits
+    that connect to at most one other qubit in the chain and to no qubit in
+    a chain with which the chain needs a coupler.  owner, which maps each
+    qubit to its variable (-1 for none), is updated in place."""
+    nqubits = len(owner)
+    nvars = len(embeddings)
+    cu, cv = owner[eu], owner[ev]
+    inter = (cu >= 0) & (cv >= 0) & (cu != cv)
+    lkeys = numpy.minimum(cu, cv)[inter]*nvars + numpy.maximum(cu, cv)[inter]
+    used = numpy.zeros(nqubits, dtype=bool)
+    touching = numpy.isin(lkeys, needed)
+    used[eu[inter][touching]] = True
+    used[ev[inter][touching]] = True
+    while True:
+        cu, cv = owner[eu], owner[ev]
+        intra = (cu >= 0) & (cu == cv)
+        degree = numpy.bincount(eu[intra], minlength=nqubits) + numpy.bincount(ev[intra], minlength=nqubits)
+        sizes = numpy.bincount(owner[owner >= 0], minlength=nvars)
+        leaves = numpy.nonzero((owner >= 0) & (degree <= 1) & ~used)[0]
+        leaves = leaves[sizes[owner[leaves]] > 1]
+        if len(leaves) == 0:
+            break
+
+        # Never remove every qubit of a chain.
+        order = numpy.lexsort((leaves, owner[leaves]))
+        leaves = leaves[order]
+        lvars = owner[leaves]
+        first = numpy.ones(len(leaves), dtype=bool)
+        first[1:] = lvars[1:] != lvars[:-1]
+        emptied = numpy.bincount(lvars, minlength=nvars) >= sizes
+        leaves = leaves[~(first & emptied[lvars])]
+        owner[leaves] = -1
+    return [[q for q in c if owner[q] == v] for v, c in enumerate(embeddings)]
+
+def _smear_chains(embeddings, owner, hs, h_range, topo):
+    """Grow each chain whose weight, spread evenly, would fall outside
+    h_range onto unused neighboring qubits until it fits or no unused
+    neighbors remain.  owner is updated in place."""
+    for v, c in enumerate(embeddings):
+        if len(c) == 0 or hs[v] == 0.0:
+            continue
+        bound = h_range[1] if hs[v] > 0.0 else -h_range[0]
+        if bound <= 0.0:
+            continue
+        want = int(math.ceil(abs(hs[v])/bound - 1e-9))
+        frontier = deque(c)
+        while len(c) < want and len(frontier) > 0:
+            q = frontier.popleft()
+            for n in topo.neighbors(q).tolist():
+                if len(c) < want and owner[n] == -1:
+                    owner[n] = v
+                    c.append(n)
+                    frontier.append(n)
+    return embeddings
+
+def embed_problem(h, j, embeddings, adj, clean=False, smear=False, h_range=(-1.0, 1.0), j_range=(-1.0, 1.0)):
+    """Map a logical Ising problem onto physical qubits given a chain of
+    qubits for each variable and the hardware adjacency.  Each variable's
+    weight is spread evenly across its chain, and each coupler's strength is
+    spread evenly across all hardware couplers between the two chains.
+    clean prunes chain qubits that touch no needed inter-chain coupler, and
+    smear grows chains until their per-qubit weights lie within h_range.
+    j_range is accepted for SAPI compatibility.  Return a list of physical
+    weights, a dictionary of physical strengths, a dictionary of chain
+    couplers, and the resulting embedding."""
+    embeddings = [list(c) for c in embeddings]
+    nvars = len(embeddings)
+    topo = qmasm.Topology(adj)
+    chain_qubits, owners, offsets = _chain_arrays(embeddings)
+    nqubits = topo.num_qubits
+    if len(chain_qubits) > 0:
+        nqubits = max(nqubits, int(chain_qubits.max()) + 1)
+    owner = numpy.full(nqubits, -1, dtype=numpy.int64)
+    owner[chain_qubits] = owners
+    if len(numpy.unique(chain_qubits)) != len(chain_qubits):
+        raise ValueError("a qubit appears in more than one chain")
+
+    # Gather the logical weights and the distinct logical couplers.
+    hs = numpy.zeros(max(len(h), nvars))
+    hs[:len(h)] = h
+    lengths = offsets[1:] - offsets[:-1]
+    for v in numpy.nonzero(hs)[0].tolist():
+        if v >= nvars or lengths[v] == 0:
+            raise ValueError("variable %d has a weight but no chain" % v)
+    lu = numpy.array([min(u, v) for u, v in j.keys()], dtype=numpy.int64)
+    lv = numpy.array([max(u, v) for u, v in j.keys()], dtype=numpy.int64)
+    lw = numpy.array(list(j.values()), dtype=float)
+    for u, v in zip(lu.tolist(), lv.tolist()):
+        if v >= nvars or lengths[u] == 0 or lengths[v] == 0:
+            raise ValueError("variables %d and %d are coupled but lack chains" % (u, v))
+    lkeys, inverse = numpy.unique(lu*nvars + lv, return_inverse=True)
+    lweights = numpy.bincount(inverse, weights=lw, minlength=len(lkeys))
+
+    # Enumerate each hardware coupler once from the CSR adjacency.
+    rows = numpy.repeat(numpy.arange(topo.num_qubits, dtype=numpy.int64),
+                        topo.adj_offsets[1:] - topo.adj_offsets[:-1])
+    forward = rows < topo.adj_targets
+    eu = rows[forward]
+    ev = topo.adj_targets[forward]
+
+    # Optionally prune and grow the chains.
+    if clean:
+        embeddings = _clean_chains(embeddings, owner, eu, ev, lkeys[lweights != 0.0])
+    if smear:
+        embeddings = _smear_chains(embeddings, owner, hs, h_range, topo)
+    chain_qubits, owners, offsets = _chain_arrays(embeddings)
+    lengths = offsets[1:] - offsets[:-1]
+
+    # Spread each weight evenly across its chain.
+    h0 = numpy.zeros(nqubits)
+    if len(chain_qubits) > 0:
+        h0[chain_qubits] = hs[owners]/lengths[owners]
+
+    # Spread each strength evenly across the couplers between its chains.
+    cu, cv = owner[eu], owner[ev]
+    inter = numpy.nonzero((cu >= 0) & (cv >= 0) & (cu != cv))[0]
+    ekeys = numpy.minimum(cu[inter], cv[inter])*nvars + numpy.maximum(cu[inter], cv[inter])
+    which = numpy.minimum(numpy.searchsorted(lkeys, ekeys), max(len(lkeys) - 1, 0))
+    if len(lkeys) > 0:
+        match = lkeys[which] == ekeys
+    else:
+        match = numpy.zeros(len(ekeys), dtype=bool)
+    inter, which = inter[match], which[match]
+    ncouplers = numpy.bincount(which, minlength=len(lkeys))
+    missing = numpy.nonzero((ncouplers == 0) & (lweights != 0.0))[0]
+    if len(missing) > 0:
+        u, v = divmod(int(lkeys[missing[0]]), nvars)
+        raise ValueError("no coupler connects the chains of variables %d and %d" % (u, v))
+    strengths = lweights[which]/ncouplers[which]
+    j0 = {(u, v): s
+          for u, v, s in zip(eu[inter].tolist(), ev[inter].tolist(), strengths.tolist())
+          if s != 0.0}
+
+    # Couple every pair of adjacent qubits within a chain.
+    intra = (cu >= 0) & (cu == cv)
+    jc = {(u, v): -1.0 for u, v in zip(eu[intra].tolist(), ev[intra].tolist())}
+    return [h0.tolist(), j0, jc, embeddings]
+
+def unembed_answer(solutions, embeddings, broken_chains="minimize_energy", h=None, j=None):
+    """Map physical solutions back to logical solutions.  Intact chains take
+    their qubits' common value, and variables without a chain take the
+    inactive value 3.  Broken chains are handled according to broken_chains:
+    "discard" drops the solution, "vote" takes the majority value (breaking
+    ties with the chain's first qubit), and "minimize_energy" starts from the
+    vote then greedily sets each broken chain to whichever value lowers the
+    physical energy given h and j.  Return a list of logical solutions."""
+    if broken_chains not in ["minimize_energy", "vote", "discard"]:
+        raise ValueError('Unknown broken_chains method "%s"' % broken_chains)
+    nvars = len(embeddings)
+    if len(solutions) == 0:
+        return []
+    spins = numpy.array(solutions, dtype=numpy.int64).reshape(len(solutions), -1)
+    logical = numpy.full((len(solutions), nvars), 3, dtype=numpy.int64)
+    chain_qubits, owners, offsets = _chain_arrays(embeddings)
+    if len(chain_qubits) == 0:
+        return logical.tolist()
+
+    # Find each chain's value in each solution and whether it is broken.
+    lengths = offsets[1:] - offsets[:-1]
+    has_chain = numpy.nonzero(lengths > 0)[0]
+    starts = offsets[has_chain]
+    chain_spins = spins[:, chain_qubits]
+    low = numpy.minimum.reduceat(chain_spins, starts, axis=1)
+    broken = low != numpy.maximum.reduceat(chain_spins, starts, axis=1)
+    logical[:, has_chain] = low
+    if not broken.any():
+        return logical.tolist()
+    if broken_chains == "discard":
+        return logical[~broken.any(axis=1)].tolist()
+
+    # Take a majority vote on every broken chain.
+    active_spins = numpy.where(chain_spins == 3, 0, chain_spins)
+    votes = numpy.add.reduceat(active_spins, starts, axis=1)
+    votes = numpy.where(votes == 0, chain_spins[:, starts], numpy.sign(votes))
+    logical[:, has_chain] = numpy.where(broken, votes, low)
+    if broken_chains == "vote":
+        return logical.tolist()
+
+    # Gather the physical weights and the couplers leaving each chain.
+    nqubits = spins.shape[1]
+    hq = numpy.zeros(nqubits)
+    if isinstance(h, dict):
+        for q, wt in h.items():
+            if q < nqubits:
+                hq[q] = wt
+    elif h != None:
+        hq[:min(len(h), nqubits)] = list(h)[:nqubits]
+    owner = numpy.full(nqubits, -1, dtype=numpy.int64)
+    owner[chain_qubits] = owners
+    chain_h = numpy.bincount(owners, weights=hq[chain_qubits], minlength=nvars)
+    if j == None:
+        j = {}
+    ju = numpy.array([u for u, _ in j.keys()], dtype=numpy.int64)
+    jv = numpy.array([v for _, v in j.keys()], dtype=numpy.int64)
+    jw = numpy.array(list(j.values()), dtype=float)
+    src = numpy.concatenate((ju, jv))
+    dst = numpy.concatenate((jv, ju))
+    wts = numpy.concatenate((jw, jw))
+    leaving = (owner[src] >= 0) & (owner[src] != owner[dst])
+    src, dst, wts = src[leaving], dst[leaving], wts[leaving]
+    order = numpy.argsort(owner[src], kind="mergesort")
+    dst, wts = dst[order], wts[order]
+    src_vars = owner[src][order]
+    bounds = numpy.searchsorted(src_vars, numpy.arange(nvars + 1))
+    outside = numpy.where(spins == 3, 0, spins)
+
+    # Greedily set each broken chain to its lower-energy value.
+    chain_index = numpy.zeros(nvars, dtype=numpy.int64)
+    chain_index[has_chain] = numpy.arange(len(has_chain))
+    for v in has_chain[broken.any(axis=0)].tolist():
+        rows = numpy.nonzero(broken[:, chain_index[v]])[0]
+        nbrs = dst[bounds[v]:bounds[v + 1]]
+        nwts = wts[bounds[v]:bounds[v + 1]]
+        nvars_of = owner[nbrs]
+        in_chain = nvars_of >= 0
+        values = numpy.empty((len(rows), len(nbrs)), dtype=numpy.int64)
+        values[:, in_chain] = logical[rows][:, nvars_of[in_chain]]
+        values[:, ~in_chain] = outside[rows][:, nbrs[~in_chain]]
+        values = numpy.where(values == 3, 0, values)
+        field = chain_h[v] + values.dot(nwts)
+        logical[rows, v] = numpy.where(field > 0.0, -1, numpy.where(field < 0.0, 1, logical[rows, v]))
+    return logical.tolist()
+
+class ImplicationNetwork(object):
+    """Represent a QUBO as the implication network of Boros and Hammer: a flow
+    network with one node per literal plus a source (node 0, the constant 1)
+    and a sink (node 1, the constant 0).  Variable n's literals are nodes
+    2n+2 (x) and 2n+3 (not x), so complementing a node is an XOR with 1.  Arcs
+    are added in mirror-image pairs, u -> v and ~v -> ~u, so arc e's mirror is
+    arc e^2 and its reverse is arc e^1."""
+
+    def __init__(self, num_vars, tolerance):
+        self.num_nodes = 2*num_vars + 2
+        self.adj = [[] for _ in range(self.num_nodes)]  # Node to arc numbers
+        self.to = []       # Arc to head node
+        self.cap = []      # Arc to capacity
+        self.flow = []     # Arc to flow
+        self.tolerance = tolerance
+
+    def _add_arc(self, u, v, cap):
+        "Add an arc and its reverse."
+        for a, b, c in [(u, v, cap), (v, u, 0.0)]:
+            self.adj[a].append(len(self.to))
+            self.to.append(b)
+            self.cap.append(c)
+            self.flow.append(0.0)
+
+    def add_term(self, u, v, coeff):
+        """Add a posiform term coeff*u*v, where u and v are literal nodes and
+        coeff is positive.  The term implies both u -> ~v and v -> ~u."""
+        self._add_arc(u, v ^ 1, coeff/2.0)
+        self._add_arc(v, u ^ 1, coeff/2.0)
+
+    def residual(self, e):
+        "Return True if arc e has residual capacity."
+        return self.cap[e] - self.flow[e] > self.tolerance
+
+    def _augment(self, level, it):
+        "Push flow along one shortest source-to-sink path.  Return the amount pushed."
+        path = []
+        u = 0
+        while u != 1:
+            adj = self.adj[u]
+            while it[u] < len(adj):
+                e = adj[it[u]]
+                if level[self.to[e]] == level[u] + 1 and self.residual(e):
+                    break
+                it[u] += 1
+            else:
+                # Dead end: retreat one step.
+                if len(path) == 0:
+                    return 0.0
+                level[u] = -1
+                u = self.to[path.pop() ^ 1]
+                it[u] += 1
+                continue
+            path.append(e)
+            u = self.to[e]
+        amount = min([self.cap[e] - self.flow[e] for e in path])
+        for e in path:
+            self.flow[e] += amount
+            self.flow[e ^ 1] -= amount
+        return amount
+
+    def maximize_flow(self):
+        """Compute a maximum flow from the source to the sink using Dinic's
+        algorithm then make it symmetric by averaging each arc with its
+        mirror image, which preserves maximality."""
+        while True:
+            # Assign each node a level by breadth-first search.
+            level = [-1]*self.num_nodes
+            level[0] = 0
+            queue = deque([0])
+            while len(queue) > 0:
+                u = queue.popleft()
+                for e in self.adj[u]:
+                    v = self.to[e]
+                    if level[v] < 0 and self.residual(e):
+                        level[v] = level[u] + 1
+                        queue.append(v)
+            if level[1] < 0:
+                break
+
+            # Augment along shortest paths until none remain.
+            it = [0]*self.num_nodes
+            while self._augment(level, it) > 0.0:
+                pass
+        for e in range(0, len(self.flow), 4):
+            for f in [e, e + 1]:
+                avg = (self.flow[f] + self.flow[f ^ 2])/2.0
+                self.flow[f] = avg
+                self.flow[f ^ 2] = avg
+
+    def reachable_from_source(self):
+        "Return the set of nodes reachable from the source in the residual network."
+        seen = set([0])
+        queue = deque([0])
+        while len(queue) > 0:
+            u = queue.popleft()
+            for e in self.adj[u]:
+                v = self.to[e]
+                if v not in seen and self.residual(e):
+                    seen.add(v)
+                    queue.append(v)
+        return seen
+
+    def strongly_connected_components(self, nodes):
+        """Return the strongly connected components of the residual network
+        restricted to a given set of nodes, in reverse topological order (as
+        produced by Tarjan's algorithm), plus each node's successor list."""
+        succ = {u: [self.to[e] for e in self.adj[u]
+                    if self.to[e] in nodes and self.residual(e)]
+                for u in nodes}
+        index = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+        components = []
+        for root in sorted(nodes):
+            if root in index:
+                continue
+            index[root] = lowlink[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(succ[root]))]
+            while len(work) > 0:
+                u, children = work[-1]
+                for v in children:
+                    if v not in index:
+                        index[v] = lowlink[v] = len(index)
+                        stack.append(v)
+                        on_stack.add(v)
+                        work.append((v, iter(succ[v])))
+                        break
+                    if v in on_stack:
+                        lowlink[u] = min(lowlink[u], index[v])
+                else:
+                    work.pop()
+                    if len(work) > 0:
+                        p = work[-1][0]
+                        lowlink[p] = min(lowlink[p], lowlink[u])
+                    if lowlink[u] == index[u]:
+                        comp = []
+                        while True:
+                            v = stack.pop()
+                            on_stack.discard(v)
+                            comp.append(v)
+                            if v == u:
+                                break
+                        components.append(comp)
+        return components, succ
+
 def fix_variables(Q, method="optimized"):
-    "Return the original QUBO unmodified."
-    return {"new_Q": Q,
-            "offset": 0.0,
-            "fixed_variables": {}}
+    """Find QUBO variables whose values can be determined a priori using roof
+    duality.  The "standard" method fixes only variables that take the same
+    value in every minimum-energy solution (strong persistencies).  The
+    "optimized" method additionally uses the strongly connected components of
+    the residual implication network to fix variables to values that appear in
+    at least one minimum-energy solution (weak persistencies).  Return the
+    fixed variables, the QUBO over the remaining variables, and the energy
+    contributed by the fixed variables."""
+    if method not in ["standard", "optimized"]:
+        raise ValueError('Unknown fix_variables method "%s"' % method)
+
+    # Gather linear and quadratic coefficients over compactly numbered
+    # variables.
+    variables = sorted(set([i for i, _ in Q.keys()] + [j for _, j in Q.keys()]))
+    vnum = {v: n for n, v in enumerate(variables)}
+    lin = [0.0]*len(variables)
+    quad = {}
+    for (i, j), q in Q.items():
+        if i == j:
+            lin[vnum[i]] += q
+        elif q != 0.0:
+            key = tuple(sorted([vnum[i], vnum[j]]))
+            quad[key] = quad.get(key, 0.0) + q
+    max_coeff = max([abs(q) for q in Q.values()] + [1.0])
+    net = ImplicationNetwork(len(variables), max_coeff*1e-9)
+
+    # Express the QUBO as a posiform (all coefficients positive) and add
+    # each term to the implication network.  A linear term c*u is treated as
+    # c*u*1, i.e., a term involving the source.
+    for (a, b), q in quad.items():
+        if q > 0.0:
+            net.add_term(2*a + 2, 2*b + 2, q)
+        elif q < 0.0:
+            # q*x_a*x_b = q*x_a - q*x_a*(not x_b)
+            lin[a] += q
+            net.add_term(2*a + 2, 2*b + 3, -q)
+    for a, c in enumerate(lin):
+        if c > 0.0:
+            net.add_term(2*a + 2, 0, c)
+        elif c < 0.0:
+            # c*x_a = c - c*(not x_a)
+            net.add_term(2*a + 3, 0, -c)
+
+    # Literals reachable from the source after a maximum flow are true in
+    # every minimum-energy solution.
+    net.maximize_flow()
+    value = {}       # Map from literal node to True or False
+    for u in net.reachable_from_source():
+        if u >= 2:
+            value[u] = True
+            value[u ^ 1] = False
+
+    # Set true every literal in a strongly connected component whose
+    # successors are all true.  This zeroes every residual term that touches
+    # the component without affecting any other term.
+    if method == "optimized":
+        free = set([u for u in range(2, net.num_nodes) if u not in value])
+        components, succ = net.strongly_connected_components(free)
+        for comp in components:
+            if comp[0] in value:
+                continue
+            comp_set = set(comp)
+            if any([u ^ 1 in comp_set for u in comp]):
+                continue
+            if all([v in comp_set or value.get(v) == True
+                    for u in comp for v in succ[u]]):
+                for u in comp:
+                    value[u] = True
+                    value[u ^ 1] = False
+    fixed_vars = {v: int(value[2*n + 2])
+                  for n, v in enumerate(variables)
+                  if 2*n + 2 in value}
+
+    # Substitute the fixed variables into the QUBO.
+    new_Q = {}
+    offset = 0.0
+    for (i, j), q in Q.items():
+        if i in fixed_vars and j in fixed_vars:
+            offset += q*fixed_vars[i]*fixed_vars[j]
+        elif i in fixed_vars:
+            if fixed_vars[i] == 1:
+                new_Q[(j, j)] = new_Q.get((j, j), 0.0) + q
+        elif j in fixed_vars:
+            if fixed_vars[j] == 1:
+                new_Q[(i, i)] = new_Q.get((i, i), 0.0) + q
+        else:
+            new_Q[(i, j)] = new_Q.get((i, j), 0.0) + q
+    new_Q = {k: q for k, q in new_Q.items() if q != 0.0}
+    return {"new_Q": new_Q,
+            "offset": offset,
+            "fixed_variables": fixed_vars}
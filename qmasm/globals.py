@@ -18,3 +18,6 @@ qmasm.program = []
 # Define our internal representation.
 qmasm.chain_strength = 0    # Strength of chain couplers
 qmasm.pin_strength = 0      # Strength of pin couplers
+
+# Per-stage time and memory measurements
+qmasm.profiler = qmasm.StageProfiler()
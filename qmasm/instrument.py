@@ -0,0 +1,186 @@
+###################################
+# Measure QMASM's pipeline stages #
+# By Scott Pakin <pakin@lanl.gov> #
+###################################
+
+import atexit
+import contextlib
+import json
+import os
+import qmasm
+import sys
+import threading
+import time
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def peak_rss():
+    "Return the process's peak resident-set size in kilobytes or None if unknown."
+    if resource == None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        rss //= 1024   # macOS reports bytes, not kilobytes.
+    return rss
+
+def cpu_time():
+    "Return the user plus system time consumed by this process and its children."
+    t = os.times()
+    return t[0] + t[1] + t[2] + t[3]
+
+class StageProfiler(object):
+    """Record the wall-clock time, CPU time, and peak resident-set size of
+    each stage of the QMASM pipeline plus assorted counters.  Top-level stages
+    run back to back; nested stages are named by appending a suffix to the
+    enclosing top-level stage's name.  Nested stages and counters may be
+    recorded from any thread."""
+
+    def __init__(self):
+        self.lock = threading.RLock()   # Protects everything below
+        self.enabled = False
+        self.stages = []      # List of {name, wall, cpu, peak RSS} dictionaries
+        self.counters = {}    # Map from a counter name to a number
+        self.current = None   # {stage, wall time, CPU time} at the start of the current stage
+        self.capture_stage = None   # Name of a stage to profile in detail
+        self.capture_tool = None    # Either "cprofile" or "pyinstrument"
+        self.capture = None         # Profiler object for capture_stage
+
+    def enable(self, report=False, json_fname=None, capture_stage=None, capture_tool="cprofile"):
+        """Begin measuring stages.  When the program exits, output a table of
+        stages if report is True and write JSON to json_fname if not None."""
+        self.enabled = True
+        self.capture_stage = capture_stage
+        self.capture_tool = capture_tool
+        if capture_tool == "pyinstrument" and capture_stage != None:
+            try:
+                import pyinstrument
+            except ImportError:
+                qmasm.abend("--profile-tool=pyinstrument requires the pyinstrument Python module")
+        if not report and json_fname == None:
+            return
+
+        def wrap_up():
+            "Finish the final stage and report the results."
+            self.finish()
+            if report:
+                self.report()
+            if json_fname != None:
+                self.write_json(json_fname)
+        atexit.register(wrap_up)
+
+    def start(self, name):
+        "End the current top-level stage, if any, and begin a new one."
+        with self.lock:
+            self.finish()
+            if self.enabled:
+                self.current = self._begin(name)
+
+    def finish(self):
+        "End the current top-level stage, if any."
+        with self.lock:
+            if self.current != None:
+                self._end(self.current)
+                self.current = None
+
+    @contextlib.contextmanager
+    def measure(self, name):
+        "Measure a stage nested within the current top-level stage."
+        if not self.enabled:
+            yield
+            return
+        with self.lock:
+            if self.current != None:
+                name = self.current[0]["name"] + "." + name
+            rec = self._begin(name)
+        try:
+            yield
+        finally:
+            with self.lock:
+                self._end(rec)
+
+    def count(self, name, value):
+        "Set a counter to a given value."
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = value
+
+    def add(self, name, delta=1):
+        "Increment a counter by a given amount."
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + delta
+
+    def _begin(self, name):
+        """Reserve a place for a stage, so stages are listed in the order in
+        which they began, and return a record of the state at its start."""
+        stage = {"name": name}
+        self.stages.append(stage)
+        if name == self.capture_stage and self.capture == None:
+            if self.capture_tool == "pyinstrument":
+                import pyinstrument
+                self.capture = pyinstrument.Profiler()
+                self.capture.start()
+            else:
+                import cProfile
+                self.capture = cProfile.Profile()
+                self.capture.enable()
+        return [stage, time.time(), cpu_time()]
+
+    def _end(self, rec):
+        "Log a stage given the record returned by _begin."
+        stage, wall, cpu = rec
+        if stage["name"] == self.capture_stage and self.capture != None:
+            self._report_capture()
+        stage["wall"] = time.time() - wall
+        stage["cpu"] = cpu_time() - cpu
+        stage["peak_rss_kb"] = peak_rss()
+
+    def _report_capture(self):
+        "Output the detailed profile of capture_stage."
+        sys.stderr.write("Detailed profile of stage %s:\n\n" % self.capture_stage)
+        if self.capture_tool == "pyinstrument":
+            self.capture.stop()
+            sys.stderr.write(self.capture.output_text())
+        else:
+            import pstats
+            self.capture.disable()
+            stats = pstats.Stats(self.capture, stream=sys.stderr)
+            stats.sort_stats("cumulative").print_stats(30)
+        self.capture = None
+
+    def report(self):
+        "Output a table of stages and counters to the standard error device."
+        with self.lock:
+            name_len = max([len(s["name"]) for s in self.stages] + [len("Stage")])
+            sys.stderr.write("Time and memory consumed by each stage:\n\n")
+            sys.stderr.write("    %-*s  Wall (s)  CPU (s)  Peak RSS (MB)\n" % (name_len, "Stage"))
+            sys.stderr.write("    %s  --------  -------  -------------\n" % ("-" * name_len))
+            for s in self.stages:
+                if s["peak_rss_kb"] == None:
+                    rss = "?"
+                else:
+                    rss = "%.1f" % (s["peak_rss_kb"]/1024.0)
+                sys.stderr.write("    %-*s  %8.3f  %7.3f  %13s\n" % (name_len, s["name"], s["wall"], s["cpu"], rss))
+            sys.stderr.write("\n")
+            if len(self.counters) == 0:
+                return
+            name_len = max([len(k) for k in self.counters.keys()] + [len("Counter")])
+            sys.stderr.write("    %-*s  Value\n" % (name_len, "Counter"))
+            sys.stderr.write("    %s  -----\n" % ("-" * name_len))
+            for k, v in sorted(self.counters.items()):
+                sys.stderr.write("    %-*s  %5s\n" % (name_len, k, v))
+            sys.stderr.write("\n")
+
+    def write_json(self, fname):
+        "Write all stages and counters to a file in JSON format."
+        try:
+            with open(fname, "w") as outfile, self.lock:
+                json.dump({"command_line": qmasm.get_command_line(),
+                           "stages":       self.stages,
+                           "counters":     self.counters},
+                          outfile, indent=2, sort_keys=True)
+                outfile.write("\n")
+        except IOError:
+            sys.stderr.write("%s: Failed to write %s\n" % (qmasm.progname, fname))
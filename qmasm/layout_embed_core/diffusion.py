@@ -3,6 +3,7 @@ Created on Mar 27, 2017
 
 @author: JosePinilla
 '''
+import time
 import numpy as np
 import networkx as nx
 from math import floor, sqrt
@@ -22,6 +23,7 @@ VARIANCE_THR = None      # target variance
 VARIANCE_GROUP = None    # number of iterations used to calculate variance
 D_SCALER = None          # value to scale the density metric (# of cells * scaler) / (# of qubits)
 CIRCUIT = None
+DEADLINE = None          # time.time() after which to stop diffusing
 
 
 PLOT = True
@@ -371,9 +373,10 @@ def parseConfiguraion(configuration):
 
     M, N, L = configuration['M'], configuration['N'], configuration['L']
 
-    global CIRCUIT
+    global CIRCUIT, DEADLINE
 
     CIRCUIT = configuration['CIRCUIT']
+    DEADLINE = configuration['DEADLINE']
 
     global PLOT, VERBOSE, WRITE
 
@@ -420,6 +423,10 @@ def diffusion(QCA, bins, tiles, configuration):
     diffuse = True
     while (diffuse and (i<100)):
 
+        # Stop spreading cells once out of time; any placement is legal
+        if DEADLINE is not None and time.time() >= DEADLINE:
+            break
+
         # Density Matrix
         if VERBOSE: printConcentration()
 
@@ -147,6 +147,7 @@ def defaultConf ():
     DEFAULT_CONF['WRITELP'] = False
 
     DEFAULT_CONF['SEED'] =                              None
+    DEFAULT_CONF['DEADLINE'] =                          None
 
     DEFAULT_CONF['D_MAX'] =                             8.0
     DEFAULT_CONF['MAX_DEG'] =                           6.0
@@ -4,6 +4,8 @@ Created on Jun 16, 2017
 @author: JosePinilla
 '''
 import sys
+import time
+import heapq
 import random
 import networkx as nx
 import matplotlib.pyplot as plt
@@ -16,6 +18,7 @@ M = 8
 N = 8
 L = 4
 SEED = None
+DEADLINE = None     # time.time() after which to stop routing
 COST_THRESHOLD = 100000.0
 
 # ROUTER FLAGS
@@ -40,6 +43,25 @@ BASE_C = 0.0
 DELTA_P = 0.0
 
 
+class RoutingError(Exception):
+    '''
+    Raised when a lowest-cost path cannot be found or traced
+    '''
+    pass
+
+class RoutingTimeout(RoutingError):
+    '''
+    Raised when routing runs past DEADLINE
+    '''
+    pass
+
+def checkDeadline():
+    '''
+    Abandon routing if we're out of time
+    '''
+    if DEADLINE is not None and time.time() >= DEADLINE:
+        raise RoutingTimeout('Out of time')
+
 ## ROUTING RESOURCES
 _alpha_p = 0            # Present-sharing cost scaler
 _max_edge = sys.maxsize
@@ -48,6 +70,26 @@ _QCA = None
 _Chimera =  None
 _RGraph = None
 
+## COMPILED ROUTING GRAPH
+_nodes = []             # Routing-graph node of each index
+_index = {}             # Index of each routing-graph node
+_qubits = []            # Indices of the Chimera qubits
+_indptr = []            # CSR row pointers of the qubit couplers
+_indices = []           # CSR column indices of the qubit couplers
+_cells = []             # Cells assigned to each qubit (shared with _RGraph)
+_tile = []              # Tile of each qubit
+_degree = []            # Degree of each qubit
+_history = []           # Historical congestion cost of each qubit
+_shared = []            # Number of distinct cell mappings on each qubit
+
+## SEARCH STATE (valid only where stamped with the current generation)
+_gen = 0                # Search generation
+_cost = []              # Path cost to each node
+_parent = []            # Path parent of each node
+_stamp = []             # Generation in which cost and parent were set
+_done = []              # Generation in which the node was visited
+_joined = []            # Generation in which the qubit was joined to the target
+
 def plotGraph(G):
     print("PLOT GRAPH")
     plt.clf()
@@ -79,6 +121,9 @@ def ripUpAll():
         _RGraph.nodes[node]['cells'].clear()
         _RGraph.nodes[node]['mapped'].clear()
 
+    for i in _qubits:
+        _shared[i] = 0
+
 def confChimeraGraph():
     '''
 
@@ -104,8 +149,6 @@ def confChimeraGraph():
         _Chimera.nodes[node]['tile'] = (row, col)
 
         # NEGOTIATED CONGESTION
-        # historical cost
-        _Chimera.nodes[node]['history'] = 1.0
         # Degree/2 (In directed graph)
         _Chimera.nodes[node]['degree'] = _Chimera.degree(node)/2
 
@@ -162,12 +205,63 @@ def setupRGraph():
     V_QCA.add_nodes_from(_QCA.nodes(data=False))
     # QCA U Chimera
     _RGraph = nx.compose(V_QCA, _Chimera)
+    # Array representation for the router
+    compileRGraph()
 
     if PLOT:
         plotGraph(_QCA)
         plotGraph(_Chimera)
         plotGraph(_RGraph)
 
+def compileRGraph():
+    '''
+    Number the routing graph nodes and store the qubit couplers in CSR form,
+    with per-node attributes and search state in flat lists. Sets of cells
+    are shared with _RGraph, which solveChains still reads.
+    '''
+
+    global _nodes, _index, _qubits, _indptr, _indices
+    global _cells, _tile, _degree, _history, _shared
+    global _gen, _cost, _parent, _stamp, _done, _joined
+
+    _nodes = list(_RGraph.nodes())
+    _index = dict((node, i) for i, node in enumerate(_nodes))
+    _qubits = [_index[node] for node in _Chimera]
+
+    # Cells have no outgoing edges; edges into the target cell of a search
+    # are kept in _joined instead
+    _indptr = [0]
+    _indices = []
+    for node in _nodes:
+        _indices.extend(_index[neighbor] for neighbor in _RGraph.successors(node))
+        _indptr.append(len(_indices))
+
+    num_nodes = len(_nodes)
+    _cells = [_RGraph.nodes[node].get('cells', set()) for node in _nodes]
+    _tile = [_RGraph.nodes[node].get('tile') for node in _nodes]
+    _degree = [_RGraph.nodes[node].get('degree', 0) for node in _nodes]
+    _history = [1.0]*num_nodes
+    _shared = [0]*num_nodes
+
+    _gen = 0
+    _cost = [COST_THRESHOLD + 1]*num_nodes
+    _parent = [-1]*num_nodes
+    _stamp = [0]*num_nodes
+    _done = [0]*num_nodes
+    _joined = [0]*num_nodes
+
+def countShared(qubit):
+    '''
+    Recount the distinct cell mappings on a qubit after its paths change
+    :param qubit:
+    '''
+
+    mapped = _RGraph.nodes[qubit]['mapped']
+    embedding = set()
+    for path in _RGraph.nodes[qubit]['path']:
+        embedding.add( tuple(mapped[path]) )
+    _shared[_index[qubit]] = len(embedding)
+
 def neighbourTiles(tile):
     tile_x = tile % N
     tile_y = (tile-tile_x) / N
@@ -266,61 +360,56 @@ def initSearch(source_cell):
     :param source_cell:
     '''
 
-    # initialize graph search
-    nx.set_node_attributes(_RGraph, COST_THRESHOLD + 1, 'cost')
-    nx.set_node_attributes(_RGraph, None, 'parent')
-    nx.set_node_attributes(_RGraph, False, 'visited')
+    global _gen
+
+    # initialize graph search; state from earlier generations is stale
+    _gen = _gen + 1
 
-    _RGraph.nodes[source_cell]['level'] = 0
-    _RGraph.nodes[source_cell]['cost'] = 0.0
+    source = _index[source_cell]
+    _cost[source] = 0.0
+    _parent[source] = -1
+    _stamp[source] = _gen
 
-def getCost(node, neighbor, source_cell, target_cell):
+def getCost(node, neighbor, source_cell, target_cell, edge_cost=0.0):
     '''
 
-    :param node:
-    :param neighbor:
+    :param node: Index of node
+    :param neighbor: Index of neighbor
     :param source_cell:
     :param target_cell:
+    :param edge_cost: Edge length cost of source_cell to target_cell
     '''
 
     # Found target
-    if (neighbor==target_cell):
+    if (_nodes[neighbor]==target_cell):
         return 0.0
 
-    cells = _RGraph.nodes[neighbor]['cells']
+    cells = _cells[neighbor]
     # Qubit is assigned to target or source
     if (target_cell in cells):
         return 0.0
     if (source_cell in cells):
         return 0.0
 
-    edge_cost = 0.0
     scope_cost = 0.0
     if target_cell:
-        # Edge length cost
-        path_len = _QCA.edges[source_cell,target_cell]['size']
-        edge_cost = path_len / _max_edge
         # Scope cost
-        node_tile = _RGraph.nodes[node]['tile']
-        neighbor_tile = _RGraph.nodes[neighbor]['tile']
-        scope_cost = 0.0 if (node_tile==neighbor_tile) else BASE_B
+        scope_cost = 0.0 if (_tile[node]==_tile[neighbor]) else BASE_B
 
-    # Degree Cost
-    degree_q = _RGraph.nodes[neighbor]['degree']
-    degree_cost = (1 - (degree_q/MAX_DEG))
+    # Degree Cost; never negative, even on non-Chimera topologies whose
+    # qubits exceed MAX_DEG, as negative costs corrupt the path parents
+    degree_q = _degree[neighbor]
+    degree_cost = max(0.0, 1 - (degree_q/MAX_DEG))
 
     # Base Cost (b_n)
     base_cost =  1 + BASE_A*(degree_cost) + scope_cost
 
     # Present-sharing Cost (p_n)
-    embedding = set()
-    for path in _RGraph.nodes[neighbor]['path']:
-        embedding.add( tuple(_RGraph.nodes[neighbor]['mapped'][path]) )
-    k = len(embedding)
+    k = _shared[neighbor]
     sharing_cost = 1.0 + k * _alpha_p
 
     # History cost (h_n)
-    history_cost = _RGraph.nodes[neighbor]['history']
+    history_cost = _history[neighbor]
 
     # Node Cost (c_n = b_n * h_n * p_n)
     node_cost =  base_cost * sharing_cost * history_cost
@@ -336,52 +425,81 @@ def getCost(node, neighbor, source_cell, target_cell):
 
 def BFS(source_cell, target_cell, queue):
     '''
-
+    Lowest-cost search from the expanded nodes to the target cell
     :param source_cell:
     :param target_cell:
+    :param queue: Heap of (cost, index) pairs
     '''
 
-    node = queue.pop()
-    while (node != target_cell):
+    gen = _gen
+    target = _index[target_cell]
 
-        for neighbor in _RGraph.neighbors(node):
+    # Edge length cost is the same for every node in the search
+    edge_cost = 0.0
+    if target_cell:
+        path_len = _QCA.edges[source_cell,target_cell]['size']
+        edge_cost = path_len / _max_edge
+
+    node = None
+    while queue:
+        checkDeadline()
+        # Get min cost node, skipping entries superseded by a lower cost
+        node_cost, node = heapq.heappop(queue)
+        if _done[node] == gen:
+            continue
+        if node == target:
+            break
 
-            if not _RGraph.nodes[neighbor]['visited']:
+        neighbors = _indices[_indptr[node]:_indptr[node+1]]
+        if _joined[node] == gen:
+            neighbors.append(target)
+
+        for neighbor in neighbors:
+
+            if _done[neighbor] != gen:
 
                 # Calculate cost of using node in path
-                cost = getCost(node, neighbor, source_cell, target_cell)
+                cost = getCost(node, neighbor, source_cell, target_cell, edge_cost)
 
-                path_cost = _RGraph.nodes[node]['cost'] + cost
+                path_cost = node_cost + cost
 
-                if ( path_cost < _RGraph.nodes[neighbor]['cost'] ):
+                best_cost = _cost[neighbor] if _stamp[neighbor] == gen else COST_THRESHOLD + 1
+                if ( path_cost < best_cost ):
                     # Assign cost to node
-                    _RGraph.nodes[neighbor]['cost'] = path_cost
+                    _cost[neighbor] = path_cost
                     # Set path parent of node
-                    _RGraph.nodes[neighbor]['parent'] = node
+                    _parent[neighbor] = node
+                    _stamp[neighbor] = gen
                     # Add to queue
-                    queue.add(neighbor)
+                    heapq.heappush(queue, (path_cost, neighbor))
 
         # Set node as visited
-        _RGraph.nodes[node]['visited'] = True
-        # Get min cost node
-        node = min(queue, key=lambda node: _RGraph.nodes[node]['cost'])
-        # Remove node from queue
-        queue.remove(node)
+        _done[node] = gen
 
-    assert(node==target_cell)
+    if node != target:
+        raise RoutingError('No path from ' + str(source_cell) + ' to ' + str(target_cell))
 
 def traceback(source_cell, target_cell):
     '''
-
+    Follow the path parents set by the current search from the target cell
+    back to the source cell
     :param source_cell:
     :param target_cell:
     '''
 
+    source = _index[source_cell]
+
     path = []
-    node = _RGraph.nodes[target_cell]['parent']
-    while (node!=source_cell):
-        path.insert(0, node)
-        node = _RGraph.nodes[node]['parent']
+    node = _parent[_index[target_cell]]
+    while (node!=source):
+        # A parent left over from an earlier search or a path longer than
+        # the routing graph means the parents don't lead back to the source
+        if node < 0 or _stamp[node] != _gen or len(path) > len(_nodes):
+            raise RoutingError('Failed to trace the path from ' + str(source_cell) + ' to ' + str(target_cell))
+        checkDeadline()
+        path.append(_nodes[node])
+        node = _parent[node]
+    path.reverse()
 
     return path
 
@@ -449,29 +567,24 @@ def populateQubits(path, source_cell, target_cell):
         _RGraph.nodes[qubit]['path'].append(edge)
     ###################################################################################
 
+    # Update sharing counts of all modified qubits
+    for qubit in [source_main, target_main] + path:
+        countShared(qubit)
+
 def joinTargetCell(source_cell, target_cell, target_main):
     '''
-
+    Connect qubits to the target cell for the current search only
     :param target_cell:
     :param target_main:
     '''
 
-    global _RGraph
-
     if not target_main:
         candidates = getCandidates(target_cell)
         for qubit in candidates:
             if source_cell not in _RGraph.nodes[qubit]['cells']:
-                _RGraph.add_edge(qubit, target_cell)
+                _joined[_index[qubit]] = _gen
     else:
-        _RGraph.add_edge(target_main, target_cell)
-
-
-def splitTargetCell(target_cell):
-    global _RGraph
-
-    to_remove = [n for n in _RGraph.in_edges(target_cell)]
-    _RGraph.remove_edges_from(to_remove)
+        _joined[_index[target_main]] = _gen
 
 def populateConflictedQubit(qubit, source_cell, target_cell):
     '''
@@ -492,6 +605,7 @@ def populateConflictedQubit(qubit, source_cell, target_cell):
     # Assign cells to main qubits
     _RGraph.nodes[qubit]['path'].append(edge)
     _RGraph.nodes[qubit]['mapped'][edge] = [source_cell, target_cell]
+    countShared(qubit)
 
 
 def expandPaths(source_cell, source_main):
@@ -502,13 +616,15 @@ def expandPaths(source_cell, source_main):
     :param target_cell:
     '''
 
-    # set with intersection of qubits in paths
-    queue = set()
+    # heap of (cost, index) of qubits in paths
+    queue = []
 
     # Expand on main qubit
-    _RGraph.nodes[source_main]['cost'] = 0.0
-    _RGraph.nodes[source_main]['parent'] = source_cell
-    queue.add(source_main)
+    main = _index[source_main]
+    _cost[main] = 0.0
+    _parent[main] = _index[source_cell]
+    _stamp[main] = _gen
+    queue.append((0.0, main))
 
     # Expand on qubits used in all paths
     tree = [edge for edge in _RGraph.nodes[source_main]['path'] if source_cell in edge]
@@ -516,20 +632,23 @@ def expandPaths(source_cell, source_main):
 
         neighbor = [x for x in edge if x!=source_cell].pop()
         path = _QCA.edges[source_cell,neighbor]['path']
-        parent = source_main
+        parent = main
 
         for qubit in path[1:]:
-            if (source_cell in _RGraph.nodes[qubit]['cells']):
+            i = _index[qubit]
+            if (source_cell in _cells[i]):
                 # Expand qubit
-                _RGraph.nodes[qubit]['cost'] = 0.0
-                _RGraph.nodes[qubit]['parent'] = parent
+                _cost[i] = 0.0
+                _parent[i] = parent
+                _stamp[i] = _gen
                 # add to BFS queue
-                queue.add(qubit)
+                queue.append((0.0, i))
                 # Parent of next qubit
-                parent = qubit
+                parent = i
             else:
                 break
 
+    heapq.heapify(queue)
 
     return queue
 
@@ -565,8 +684,6 @@ def routingTree(source_cell, targets, iteration):
             BFS(source_cell, target_cell, queue)
             # Trace back the lowest cost path
             path = traceback(source_cell, target_cell)
-            # Disconnect target cell from qubits
-            splitTargetCell(target_cell)
 
             if VERBOSE: print(path)
 
@@ -586,32 +703,14 @@ def updateHistoryCost():
 
     global _RGraph
 
-    conflict_qubits = set()
-    conflict_cells = set()
-    conflict_paths = set()
-
-    conflicts = 0
-    occ_qubits = 0
     # Count qubits with conflicts
-    for qubit in _Chimera:
-        embedded = set()
-        paths = _RGraph.nodes[qubit]['path']
-        for path in paths:
-            cells = tuple(_RGraph.nodes[qubit]['mapped'][path])
-            embedded.add(cells)
-
-        num_cells = len(embedded)
-        if (num_cells>1):
-            conflicts = conflicts+1
-            conflict_qubits.add(qubit)
-            for mapping in embedded:
-                for cell in [mapping]:
-                    conflict_cells.add(cell)
-            conflict_paths.update(paths)
+    occupied = [i for i in _qubits if _shared[i]>0]
+    conflict_qubits = [_nodes[i] for i in occupied if _shared[i]>1]
+    conflicts = len(conflict_qubits)
+    occ_qubits = len(occupied)
 
-        if (num_cells>0):
-            occ_qubits = occ_qubits + 1
-            _RGraph.nodes[qubit]['history'] = _RGraph.nodes[qubit]['history'] + (DELTA_H*num_cells)
+    for i in occupied:
+        _history[i] = _history[i] + (DELTA_H*_shared[i])
 
 
 
@@ -665,7 +764,8 @@ def embedFirst(cell):
     if RANDOMIZE_CANDIDATES:
         random.Random(SEED).shuffle(candidates)
 
-    qubit = min(candidates , key=lambda candidate: getCost(cell, candidate, cell, None))
+    node = _index[cell]
+    qubit = min(candidates , key=lambda candidate: getCost(node, _index[candidate], cell, None))
 
     _QCA.nodes[cell]['main']  =  qubit
     _QCA.nodes[cell]['qubits'].add(qubit)
@@ -701,6 +801,10 @@ def negotiatedCongestion():
     legal = False; itry = 0
     while ((not legal) and (itry < 100)):
 
+        # Give up on an illegal routing once out of time
+        if DEADLINE is not None and time.time() >= DEADLINE:
+            break
+
         if VERBOSE: print('########### ROUTER ITERATION: ' + str(itry))
 
         ripUpAll()
@@ -720,8 +824,13 @@ def negotiatedCongestion():
             # Sinks are QCA neighbours
             targets = getTargets(source_cell)
 
-            # Get Routing Tree dictionary
-            routingTree(source_cell, targets, itry)
+            # Get Routing Tree dictionary; running out of time midway
+            # leaves the routing illegal
+            try:
+                routingTree(source_cell, targets, itry)
+            except RoutingTimeout:
+                stats['ROUTER_ITERATIONS'] = itry
+                return False, stats
 
             # Mark routed cell
             _QCA.nodes[source_cell]['routed'] =  True
@@ -745,10 +854,11 @@ def negotiatedCongestion():
 
 def parseConfiguration(configuration):
 
-    global M, N, L, SEED
+    global M, N, L, SEED, DEADLINE
 
     M, N, L = configuration['M'], configuration['N'], configuration['L']
     SEED = configuration['SEED']
+    DEADLINE = configuration['DEADLINE']
 
     global VERBOSE, PLOT
 
@@ -4,11 +4,16 @@ Created on Mar 11, 2017
 @author: JosePinilla
 '''
 
-import pulp
+try:
+    import pulp
+except ImportError:
+    pulp = None
+from qmasm.chainsplit import min_max_split
 
 WRITE = False
 VERBOSE = False
 PLOT = False
+USE_PULP = False    # Solve a MIP with PuLP instead of splitting chains exactly
 
 
 _RGraph = None
@@ -114,23 +119,88 @@ def setupProblem(fixed, shared, chains, chain_lengths):
     return prob, var_map
 
 
-def assignQubits(LpSolution, var_map):
+def solveFlow(fixed, chains, chain_lengths):
     '''
-    Format the solution given by PuLP into
-    dictionaries key : path (source = s_sol, target = t_sol)
-    :param LpSolution:
+    Split the shared qubits of each path between its cells, minimizing the
+    largest model, with a parametric max-flow instead of a MIP.
+    Returns a dictionary key : path, value : shared qubits joined to source
+    or None if the paths cannot be split
+    :param fixed: key = cell, value = number of fixed qubits assigned to cell
+    :param chains:
+    :param chain_lengths:
     '''
 
+    # Both directions of an edge share a path; split only the first seen
+    paths = []
+    seen = set()
+    for chain in chains:
+        if chains[chain] and (chain[1],chain[0]) not in seen:
+            paths.append(chain)
+            seen.add(chain)
+
+    base = {}
+    for path in paths:
+        for cell in path:
+            base[cell] = fixed[cell]
+
+    bound, split = min_max_split(base, [(path, chain_lengths[path], 0) for path in paths])
+    if split is None:
+        return None
+
+    if VERBOSE:
+        print('Largest model: ' + str(bound))
+
+    limits = {}
+    for path, amounts in zip(paths, split):
+        limits[path] = amounts[0]
+    return limits
+
+def solvePuLP(fixed, shared, chains, chain_lengths):
+    '''
+    Split the shared qubits of each path by solving a MIP with PuLP.
+    Returns a dictionary key : path, value : shared qubits joined to source
+    :param fixed:
+    :param shared:
+    :param chains:
+    :param chain_lengths:
+    '''
+
+    if pulp is None:
+        raise Exception('PuLP is required to split these chains')
+
+    prob, var_map = setupProblem(fixed, shared, chains, chain_lengths)
+
+    if WRITE:
+        prob.writeLP("SHARING.lp")
+
+    prob.solve(solver=pulp.GLPK_CMD(msg=VERBOSE))
+
+    # read solution
+    LpSolution = {}
+    for v in  prob.variables():
+        LpSolution[v.name] = v.varValue
+
     if VERBOSE:
         print(LpSolution)
 
+    limits = {}
     for path in var_map:
+        limits[path] = LpSolution[ var_map[path][path[0]] ]
+    return limits
+
+def assignQubits(limits):
+    '''
+    Join the shared qubits of each path to its source cell until the
+    path's limit is reached and to its target cell thereafter
+    :param limits: key : path, value : shared qubits joined to source
+    '''
+
+    for path in limits:
         
         cell_S = path[0]
         cell_T = path[1]
         
-        var_S = var_map[path][cell_S]
-        limit_S = LpSolution[ var_S ]
+        limit_S = limits[path]
         
         # join nodes to source until limit is reached
         # other nodes belong to target
@@ -183,19 +253,13 @@ def solveChains(RGraph, QCA, configuration):
     fixed, shared, chains, chain_lengths, sharing = parseSystem()
     
     if sharing:
-        prob, var_map = setupProblem(fixed, shared, chains, chain_lengths)
-        
-        if WRITE:
-            prob.writeLP("SHARING.lp")       
-        
-        prob.solve(solver=pulp.GLPK_CMD(msg=VERBOSE))
-        
-        # read solution
-        LpSolution = {}
-        for v in  prob.variables():
-            LpSolution[v.name] = v.varValue
-            
+        limits = None
+        if not USE_PULP:
+            limits = solveFlow(fixed, chains, chain_lengths)
+        # Fall back to a MIP if the exact split fails
+        if limits is None:
+            limits = solvePuLP(fixed, shared, chains, chain_lengths)
         
-        assignQubits(LpSolution, var_map)
+        assignQubits(limits)
     
     
\ No newline at end of file
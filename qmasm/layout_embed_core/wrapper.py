@@ -100,6 +100,9 @@ def find_layout_embedding(Q, A, **params):
 
             locations: problem nodes locations (list of coordinate pairs)
 
+            budget: qmasm.EmbeddingBudget bounding the time spent
+                (default: unlimited)
+
     Returns:
         embeddings: A list of lists of embeddings. embeddings[i] is the
             list of qubits representing logical variable i. If
@@ -115,6 +118,11 @@ def find_layout_embedding(Q, A, **params):
     else:
         qmasm.abend("Embedder requires nodes locations")
 
+    if 'budget' in params and params['budget'] is not None:
+        deadline = params['budget'].deadline
+    else:
+        deadline = None
+
     chimera_adj, m, n, t = parse_chimera(A)
 
     problem_adj = parse_problem(Q)
@@ -130,6 +138,7 @@ def find_layout_embedding(Q, A, **params):
     test_conf['SEED'] = None
     test_conf['RANDOMIZE_CANDIDATES'] = True
     test_conf['PLOT'] = False
+    test_conf['DEADLINE'] = deadline
     test_conf['diffusion'] = {}
     test_conf['diffusion']['ENABLE'] = True
     test_conf['diffusion']['DELTA_T'] = 0.2
@@ -142,13 +151,17 @@ def find_layout_embedding(Q, A, **params):
         good, cell_map = layoutEmbed(configuration, stats)
         if good:
             sys.stderr.write('Layout-Aware Embedding Successful\n')
+        else:
+            # Routing never became legal (e.g., the time budget ran out)
+            sys.stderr.write('Layout-Aware Embedding Failed\n')
+            return []
     except Exception as e:
         good = False
         if type(e).__name__ == 'KeyboardInterrupt':
             raise KeyboardInterrupt
-        sys.stderr.write('Layout-Aware Embedding Failed')
+        sys.stderr.write('Layout-Aware Embedding Failed\n')
         print (traceback.print_exc())
-        return
+        return []
 
     models = layoutToModels(cell_map)
 
@@ -4,7 +4,9 @@
 ###################################
 
 import datetime
+import itertools
 import json
+import numpy
 import os
 import qmasm
 import random
@@ -15,13 +17,15 @@ try:
 except ImportError:
     from .fake_dwave import *
 
-def open_output_file(oname):
+def open_output_file(oname, mode="w"):
     "Open a file or standard output."
     if oname == "<stdout>":
         outfile = sys.stdout
+        if "b" in mode:
+            outfile = getattr(sys.stdout, "buffer", sys.stdout)
     else:
         try:
-            outfile = open(oname, "w")
+            outfile = open(oname, mode)
         except IOError:
             qmasm.abend('Failed to open %s for output' % oname)
     return outfile
@@ -45,6 +49,48 @@ def coupler_number(M, N, L, q1, q2):
         return total_intra + total_horiz + L*(imin*M + jmin) + kmin
     raise IndexError("No coupler exists between Q%04d and Q%04d" % (q1, q2))
 
+# Number of lines to format before each bulk write to an output file
+output_chunk_lines = 16384
+
+def _sorted_terms(weights, strengths):
+    """Return NumPy arrays of qubits and weights, sorted by qubit, and of
+    qubit pairs and strengths, sorted by pair."""
+    nw = len(weights)
+    wq = numpy.fromiter(weights.keys(), dtype=numpy.int64, count=nw)
+    wc = numpy.fromiter(weights.values(), dtype=float, count=nw)
+    order = numpy.argsort(wq, kind="mergesort")
+    ns = len(strengths)
+    sq = numpy.fromiter(itertools.chain.from_iterable(strengths.keys()),
+                        dtype=numpy.int64, count=2*ns).reshape(ns, 2)
+    sc = numpy.fromiter(strengths.values(), dtype=float, count=ns)
+    sorder = numpy.lexsort((sq[:, 1], sq[:, 0]))
+    return wq[order], wc[order], sq[sorder], sc[sorder]
+
+def _canonical_terms(sq, sc):
+    """Combine array-backed edges (A, B) and (B, A) into (A, B) with A < B,
+    discarding vertex weights and zero weights, as canonicalize_strengths
+    does for dictionaries.  Return the sorted pairs and strengths."""
+    keep = (sq[:, 0] != sq[:, 1]) & (sc != 0.0)
+    sq, sc = numpy.sort(sq[keep], axis=1), sc[keep]
+    if len(sc) == 0:
+        return sq, sc
+    order = numpy.lexsort((sq[:, 1], sq[:, 0]))
+    sq, sc = sq[order], sc[order]
+    first = numpy.ones(len(sc), dtype=bool)
+    first[1:] = numpy.any(sq[1:] != sq[:-1], axis=1)
+    starts = numpy.flatnonzero(first)
+    return sq[starts], numpy.add.reduceat(sc, starts)
+
+def _write_rows(outfile, fmt, columns, sep=""):
+    """Write one line per row of a set of equal-length NumPy columns, formatting
+    and writing output_chunk_lines rows at a time."""
+    nrows = len(columns[0])
+    for i in range(0, nrows, output_chunk_lines):
+        if i > 0:
+            outfile.write(sep)
+        chunk = zip(*[c[i:i + output_chunk_lines].tolist() for c in columns])
+        outfile.write(sep.join([fmt % r for r in chunk]))
+
 def output_qubist(outfile, as_qubo, problem):
     "Output weights and strengths in Qubist format, either Ising or QUBO."
     if as_qubo and not problem.qubo:
@@ -56,13 +102,10 @@ def output_qubist(outfile, as_qubo, problem):
     else:
         output_weights = problem.weights
         output_strengths = problem.strengths
-    data = []
-    for q, wt in sorted(output_weights.items()):
-        if wt != 0.0:
-            data.append("%d %d %.10g" % (q, q, wt))
-    for sp, str in sorted(output_strengths.items()):
-        if str != 0.0:
-            data.append("%d %d %.10g" % (sp[0], sp[1], str))
+    wq, wc, sq, sc = _sorted_terms(output_weights, output_strengths)
+    wnz = wc != 0.0
+    snz = sc != 0.0
+    wq, wc, sq, sc = wq[wnz], wc[wnz], sq[snz], sc[snz]
 
     # Output the header and data in Qubist format.
     try:
@@ -72,9 +115,9 @@ def output_qubist(outfile, as_qubo, problem):
         # fixed hardware representation.  We therefore assert that the number
         # of qubits is exactly the number of qubits we require.
         num_qubits = len(output_weights)
-    outfile.write("%d %d\n" % (num_qubits, len(data)))
-    for d in data:
-        outfile.write("%s\n" % d)
+    outfile.write("%d %d\n" % (num_qubits, len(wc) + len(sc)))
+    _write_rows(outfile, "%d %d %.10g\n", [wq, wq, wc])
+    _write_rows(outfile, "%d %d %.10g\n", [sq[:, 0], sq[:, 1], sc])
 
 def output_dw(outfile, problem):
     "Output weights and strengths in dw format."
@@ -113,18 +156,21 @@ def output_qbsolv(outfile, problem):
     else:
         output_weights = problem.weights
         output_strengths = problem.strengths
-    max_node = max(list(output_weights.keys()) + [max(qs) for qs in output_strengths.keys()])
-    num_nonzero_weights = len([q for q, wt in output_weights.items() if wt != 0.0])
-    num_nonzero_strengths = len([qs for qs, wt in output_strengths.items() if wt != 0.0])
+    wq, wc, sq, sc = _sorted_terms(output_weights, output_strengths)
+    max_node = max([a.max() for a in [wq, sq] if a.size > 0])
+    wnz = wc != 0.0
+    snz = sc != 0.0
+    wq, wc, sq, sc = wq[wnz], wc[wnz], sq[snz], sc[snz]
 
     # Assign dummy qubit numbers to qubits whose value is known a priori.
-    n_known = len(problem.known_values)
-    extra_nodes = dict(zip(sorted(problem.known_values.keys()),
-                           range(max_node + 1, max_node + 1 + n_known)))
+    # These follow all real qubits so they can be written after them without
+    # disturbing the sort order.
+    known_syms = sorted(problem.known_values.keys())
+    n_known = len(known_syms)
+    extra_nodes = dict(zip(known_syms, range(max_node + 1, max_node + 1 + n_known)))
+    kq = numpy.array([extra_nodes[sym] for sym in known_syms], dtype=numpy.int64)
+    kc = numpy.array([problem.known_values[sym]*qmasm.pin_strength for sym in known_syms], dtype=float)
     max_node += n_known
-    num_nonzero_weights += n_known
-    output_weights.update({num: problem.known_values[sym]*qmasm.pin_strength
-                           for sym, num in extra_nodes.items()})
     sym2num = dict(qmasm.sym_map.symbol_number_items())
     sym2num.update(extra_nodes)
 
@@ -149,13 +195,11 @@ def output_qbsolv(outfile, problem):
         outfile.write("c %-*s --> %-*s\n" % (key_width, s, val_width, nstr))
 
     # Output all nonzero weights and strengths.
-    outfile.write("p qubo 0 %d %d %d\n" % (max_node + 1, num_nonzero_weights, num_nonzero_strengths))
-    for q, wt in sorted(output_weights.items()):
-        if wt != 0.0:
-            outfile.write("%d %d %.10g\n" % (q, q, wt))
-    for qs, wt in sorted(output_strengths.items()):
-        if wt != 0.0:
-            outfile.write("%d %d %.10g\n" % (qs[0], qs[1], wt))
+    outfile.write("p qubo 0 %d %d %d\n" % (max_node + 1, len(wc) + n_known, len(sc)))
+    _write_rows(outfile, "%d %d %.10g\n", [wq, wq, wc])
+    knz = kc != 0.0
+    _write_rows(outfile, "%d %d %.10g\n", [kq[knz], kq[knz], kc[knz]])
+    _write_rows(outfile, "%d %d %.10g\n", [sq[:, 0], sq[:, 1], sc])
 
 def output_qmasm(outfile):
     "Output weights and strengths as a flattened QMASM source file."
@@ -293,6 +337,22 @@ def output_minizinc(outfile, problem, energy=None):
     outlist.sort()
     outfile.write("  %s\n];\n" % ",\n  ".join(outlist))
 
+def _write_json_member(outfile, key, value, last=False):
+    "Write a key and small value as a member of a top-level JSON object."
+    vstr = json.dumps(value, indent=2, sort_keys=True,
+                      separators=(",", ": ")).replace("\n", "\n  ")
+    outfile.write('  %s: %s%s\n' % (json.dumps(key), vstr, "" if last else ","))
+
+def _write_json_rows(outfile, key, fmt, columns):
+    """Write a key and an array of values formatted from a set of NumPy columns
+    as a member of a top-level JSON object."""
+    if len(columns[0]) == 0:
+        outfile.write('  %s: [],\n' % json.dumps(key))
+        return
+    outfile.write('  %s: [\n' % json.dumps(key))
+    _write_rows(outfile, fmt, columns, ",\n")
+    outfile.write('\n  ],\n')
+
 def output_bqpjson(outfile, as_qubo, problem):
     "Output weights and strengths in bqpjson format, either Ising or QUBO."
     # Prepare the "easy" fields.
@@ -306,30 +366,10 @@ def output_bqpjson(outfile, as_qubo, problem):
     else:
         bqp["variable_domain"] = "spin"
 
-    # Prepare the list of all variables.
-    var_ids = set(problem.weights.keys())
-    for q1, q2 in problem.strengths.keys():
-        var_ids.add(q1)
-        var_ids.add(q2)
-    bqp["variable_ids"] = sorted(var_ids)
-
-    # Prepare the linear terms.
-    lin_terms = []
-    for q, wt in sorted(problem.weights.items()):
-        lin_terms.append({
-            "id": q,
-            "coeff": wt})
-    bqp["linear_terms"] = lin_terms
-
-    # Prepare the quadratic terms.
-    quad_terms = []
-    strengths = qmasm.canonicalize_strengths(problem.strengths)
-    for (q1, q2), wt in sorted(strengths.items()):
-        quad_terms.append({
-            "id_tail": q1,
-            "id_head": q2,
-            "coeff": wt})
-    bqp["quadratic_terms"] = quad_terms
+    # Prepare the linear and quadratic terms and the list of all variables.
+    wq, wc, sq, sc = _sorted_terms(problem.weights, problem.strengths)
+    var_ids = numpy.union1d(wq, sq.ravel())
+    sq, sc = _canonical_terms(sq, sc)
 
     # Prepare some metadata.
     metadata = {}
@@ -362,14 +402,113 @@ def output_bqpjson(outfile, as_qubo, problem):
                                       for s, n in qmasm.sym_map.symbol_number_items()}
     bqp["metadata"] = metadata
 
-    # Output the problem in JSON format.
-    outfile.write(json.dumps(bqp, indent=2, sort_keys=True) + "\n")
+    # Output the problem in JSON format, member by member in sorted-key
+    # order, streaming the (potentially huge) term and variable arrays.
+    outfile.write("{\n")
+    _write_json_member(outfile, "id", bqp["id"])
+    _write_json_rows(outfile, "linear_terms",
+                     '    {\n      "coeff": %r,\n      "id": %d\n    }',
+                     [wc, wq])
+    _write_json_member(outfile, "metadata", bqp["metadata"])
+    _write_json_member(outfile, "offset", bqp["offset"])
+    _write_json_rows(outfile, "quadratic_terms",
+                     '    {\n      "coeff": %r,\n      "id_head": %d,\n      "id_tail": %d\n    }',
+                     [sc, sq[:, 1], sq[:, 0]])
+    _write_json_member(outfile, "scale", bqp["scale"])
+    _write_json_member(outfile, "variable_domain", bqp["variable_domain"])
+    _write_json_rows(outfile, "variable_ids", "    %d", [var_ids])
+    _write_json_member(outfile, "version", bqp["version"], last=True)
+    outfile.write("}\n")
+
+def _string_table(strs):
+    """Encode a list of strings as a UTF-8 byte array and an array of offsets
+    into it (the inverse of decode_string_table)."""
+    encoded = [st.encode("utf-8") for st in strs]
+    indptr = numpy.zeros(len(encoded) + 1, dtype=numpy.int64)
+    indptr[1:] = numpy.cumsum([len(e) for e in encoded])
+    chars = numpy.frombuffer(b"".join(encoded), dtype=numpy.uint8)
+    return chars, indptr
+
+def _symbol_arrays(problem):
+    """Return a map from .npz member name to array for a problem's symbol table,
+    known values, and spins that can take either value."""
+    arrays = {}
+    sym_nums = sorted(qmasm.sym_map.symbol_number_items())
+    arrays["sym_chars"], arrays["sym_indptr"] = _string_table([s for s, n in sym_nums])
+    arrays["sym_numbers"] = numpy.array([n for s, n in sym_nums], dtype=numpy.int32)
+    known = sorted(problem.known_values.items())
+    arrays["known_chars"], arrays["known_indptr"] = _string_table([s for s, v in known])
+    arrays["known_spins"] = numpy.array([v for s, v in known], dtype=numpy.int8)
+    anti = sorted(problem.anti_aliases.items())
+    arrays["anti_chars"], arrays["anti_indptr"] = _string_table([s for s, o in anti])
+    arrays["anti_numbers"] = numpy.array([qmasm.sym_map.to_number(o) for s, o in anti],
+                                         dtype=numpy.int32)
+    free = [(s, sign, i) for i, pairs in enumerate(problem.free_spins) for s, sign in pairs]
+    arrays["free_chars"], arrays["free_indptr"] = _string_table([s for s, sign, i in free])
+    arrays["free_signs"] = numpy.array([sign for s, sign, i in free], dtype=numpy.int8)
+    arrays["free_groups"] = numpy.array([i for s, sign, i in free], dtype=numpy.int32)
+    return arrays
+
+def output_npz(outfile, as_qubo, problem):
+    """Output weights, strengths, embedding, and symbol table as uncompressed
+    NumPy arrays in a .npz file, either Ising or QUBO."""
+    if as_qubo and not problem.qubo:
+        problem = problem.convert_to_qubo()
+    elif not as_qubo and problem.qubo:
+        problem = problem.convert_to_ising()
+    wq, wc, sq, sc = _sorted_terms(problem.weights, problem.strengths)
+    wnz = wc != 0.0
+    snz = sc != 0.0
+    arrays = _symbol_arrays(problem)
+    arrays["npz_version"] = numpy.int32(1)
+    arrays["qubo"] = numpy.bool_(problem.qubo)
+    arrays["offset"] = numpy.float64(problem.offset)
+    arrays["simple_offset"] = numpy.float64(problem.simple_offset)
+    arrays["h_index"] = wq[wnz].astype(numpy.int32)
+    arrays["h_value"] = wc[wnz]
+    arrays["J_index"] = sq[snz].astype(numpy.int32)
+    arrays["J_value"] = sc[snz]
+
+    # Store the logical-to-physical mapping, if any, in CSR form: logical
+    # qubit i maps to embed_indices[embed_indptr[i]:embed_indptr[i + 1]].
+    if hasattr(problem, "embedding"):
+        chain_lens = [len(c) for c in problem.embedding]
+        indptr = numpy.zeros(len(chain_lens) + 1, dtype=numpy.int64)
+        indptr[1:] = numpy.cumsum(chain_lens)
+        arrays["embed_indptr"] = indptr
+        arrays["embed_indices"] = numpy.fromiter(itertools.chain.from_iterable(problem.embedding),
+                                                 dtype=numpy.int32, count=int(indptr[-1]))
+    numpy.savez(outfile, **arrays)
+
+def write_solutions_npz(fname, problem, solutions, energies, num_occurrences):
+    """Write logical solutions as bit-packed spins (bit set for +1) plus their
+    energies and tallies and the symbol table to an uncompressed .npz file."""
+    nsolns = len(solutions)
+    nvars = max([len(s) for s in solutions] + [0])
+    spins = numpy.full((nsolns, nvars), 3, dtype=numpy.int8)
+    for i, soln in enumerate(solutions):
+        spins[i, :len(soln)] = soln
+    arrays = _symbol_arrays(problem)
+    arrays["npz_version"] = numpy.int32(1)
+    arrays["num_vars"] = numpy.int64(nvars)
+    arrays["spins"] = numpy.packbits(spins == 1, axis=1)
+    arrays["unused"] = numpy.packbits(numpy.any(spins == 3, axis=0))
+    arrays["energies"] = numpy.array(energies[:nsolns], dtype=numpy.float64)
+    arrays["num_occurrences"] = numpy.array([num_occurrences.get(tuple(s), 0) for s in solutions],
+                                            dtype=numpy.int64)
+    outfile = open_output_file(fname, "wb")
+    numpy.savez(outfile, **arrays)
+    if fname != "<stdout>":
+        outfile.close()
 
 def write_output(problem, oname, oformat, as_qubo):
     "Write an output file in one of a variety of formats."
 
     # Open the output file.
-    outfile = open_output_file(oname)
+    if oformat == "npz":
+        outfile = open_output_file(oname, "wb")
+    else:
+        outfile = open_output_file(oname)
 
     # Output the weights and strengths in the specified format.
     if oformat == "qubist":
@@ -384,6 +523,8 @@ def write_output(problem, oname, oformat, as_qubo):
         output_minizinc(outfile, problem)
     elif oformat == "bqpjson":
         output_bqpjson(outfile, as_qubo, problem)
+    elif oformat == "npz":
+        output_npz(outfile, as_qubo, problem)
 
     # Close the output file.
     if oname != "<stdout>":
@@ -411,6 +552,34 @@ def output_energy_tallies(physical_ising, answer, energies):
         sys.stderr.write("    %10.4f  %6d\n" % (e, new_energy_tallies[e]))
     sys.stderr.write("\n")
 
+def output_sweep_results(results, min_energy_delta):
+    """Output a table of broken-chain and ground-state rates, one row per
+    {chain strength, pin strength, num_samples, num_broken, energy tallies}
+    tuple."""
+    # Find the lowest logical energy observed across the entire sweep.
+    all_energies = [e for r in results for e in r[4].keys()]
+    if len(all_energies) == 0:
+        min_energy = None
+    else:
+        min_energy = min(all_energies)
+
+    # Output one row per point in the sweep.
+    if min_energy == None:
+        print("Ground-state energy: N/A\n")
+    else:
+        print("Ground-state energy: %.2f\n" % min_energy)
+    print("    Chain str.  Pin str.  Samples  Broken (%)  Ground state (%)")
+    print("    ----------  --------  -------  ----------  ----------------")
+    for chain_str, pin_str, num_samples, num_broken, energy_tallies in results:
+        num_gs = sum([t for e, t in energy_tallies.items()
+                      if abs(e - min_energy) < min_energy_delta])
+        if num_samples == 0:
+            num_samples = 1   # Avoid dividing by zero.
+        print("    %10.4f  %8.4f  %7d  %10.2f  %16.2f" %
+              (chain_str, pin_str, num_samples,
+               100.0*num_broken/num_samples, 100.0*num_gs/num_samples))
+    print("")
+
 def _numeric_solution(soln):
     "Convert single- and multi-bit values to numbers."
     # Map each name to a number and to the number of bits required.
@@ -427,13 +596,13 @@ def _numeric_solution(soln):
             match = idx_re.search(nm)
             if match == None:
                 # No array index: Treat as a 1-bit number.
-                name2num[nm] = (spin + 1)/2
+                name2num[nm] = (spin + 1)//2
                 name2nbits[nm] = 1
                 continue
 
             # Integrate the current spin into the overall number.
             array, idx = match.groups()
-            b = ((spin + 1)/2) << int(idx)
+            b = ((spin + 1)//2) << int(idx)
             try:
                 name2num[array] += b
                 name2nbits[array] = max(name2nbits[array], int(idx) + 1)
@@ -528,7 +697,7 @@ def output_solution(id2solution, num_occurrences, style, verbosity, show_asserts
     sorted_solns = [id2solution[s] for s in sorted(id2solution.keys(), key=soln_key)]
     if len(sorted_solns) == 0:
         print("No valid solutions found.")
-        sys.exit(0)
+        return
     for snum in range(len(sorted_solns)):
         soln = sorted_solns[snum]
         try:
@@ -544,3 +713,97 @@ def output_solution(id2solution, num_occurrences, style, verbosity, show_asserts
             raise Exception('Output style "%s" not recognized' % style)
         if show_asserts:
             _output_solution_asserts(soln, verbosity)
+
+class SolutionStream(object):
+    """Stream solutions and a final metrics record to standard output as a
+    single JSON document, as newline-delimited JSON, or as a sequence of
+    MessagePack maps.  Each record is written as soon as it is produced.
+    In batch mode, the stream contains the solutions and metrics of each
+    variant in turn, and every record is tagged with its variant's index
+    and pins."""
+
+    def __init__(self, style, batch=False):
+        self.style = style
+        self.batch = batch
+        self.variant = None   # Index and pins of the current batch variant
+        self.num_written = 0
+        if style == "msgpack":
+            try:
+                import msgpack
+            except ImportError:
+                qmasm.abend("--values=msgpack requires the msgpack Python module")
+            self.packer = msgpack.Packer(use_bin_type=True)
+            self.outfile = getattr(sys.stdout, "buffer", sys.stdout)
+        else:
+            self.outfile = sys.stdout
+        if style == "json":
+            if batch:
+                self.outfile.write('{"variants": [')
+            else:
+                self.outfile.write('{"solutions": [')
+
+    def begin_variant(self, index, pins):
+        """Begin the records of a batch variant, given its index and a map
+        from each pinned variable to its value."""
+        if self.style == "json":
+            sep = ",\n" if self.variant != None else "\n"
+            self.outfile.write(sep + '{"variant": %d,\n"pins": %s,\n"solutions": [' % (index, json.dumps(pins, sort_keys=True)))
+        self.variant = {"variant": index, "pins": pins}
+        self.num_written = 0
+
+    def _write_record(self, rtype, record):
+        "Write a single record of a given type."
+        if self.style == "json":
+            return
+        record = dict(record, type=rtype)
+        if self.variant != None:
+            record.update(self.variant)
+        if self.style == "ndjson":
+            self.outfile.write(json.dumps(record, sort_keys=True) + "\n")
+        else:
+            self.outfile.write(self.packer.pack(record))
+
+    def write_solution(self, soln, tally):
+        "Write one solution with its tally (None if unknown)."
+        spins = {}
+        for q in range(len(soln.spins)):
+            spin = soln.spins[q]
+            if spin == 3:
+                spin = None   # Unused qubit
+            else:
+                spin = int(spin)
+            for nm in soln.names[q].split():
+                spins[nm] = spin
+        record = {
+            "energy": float(soln.energy),
+            "tally":  tally,
+            "spins":  spins,
+            "values": {nm: int(num) for nm, (num, nbits) in _numeric_solution(soln).items()}
+        }
+        if len(soln.problem.assertions) > 0:
+            record["failed_assertions"] = [astr for astr, ok in soln.check_assertions() if not ok]
+        if self.style == "json":
+            sep = ",\n" if self.num_written > 0 else "\n"
+            self.outfile.write(sep + json.dumps(record, sort_keys=True))
+        else:
+            self._write_record("solution", record)
+        self.num_written += 1
+
+    def write_metrics(self, metrics):
+        """Write the final metrics record.  This finishes the stream unless
+        we're in batch mode, in which case it finishes only the current
+        variant."""
+        if self.style == "json":
+            self.outfile.write('\n],\n"metrics": %s}' % json.dumps(metrics, sort_keys=True))
+        else:
+            self._write_record("metrics", metrics)
+        if not self.batch:
+            self.finish()
+
+    def finish(self):
+        "Finish the stream."
+        if self.style == "json":
+            if self.batch:
+                self.outfile.write("\n]}")
+            self.outfile.write("\n")
+        self.outfile.flush()
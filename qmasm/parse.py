@@ -506,6 +506,26 @@ def process_pin(filename, lineno, pin_str):
         qmasm.abend('Different number of left- and right-hand-side values in "%s" (%d vs. %d)' % (pin_str, len(lhs_list), len(rhs_list)))
     return [Pin(filename, lineno, l, r) for l, r in zip(lhs_list, rhs_list)]
 
+def read_batch_file(fname):
+    """Read a file of pin statements, one variant per line, and return a list
+    of {pin statement, list of Pin objects} pairs."""
+    variants = []
+    try:
+        infile = open(fname)
+    except IOError:
+        qmasm.abend('Failed to open %s for input' % fname)
+    lineno = 0
+    for line in infile:
+        lineno += 1
+        pin_str = line.partition("#")[0].strip()
+        if pin_str == "":
+            continue
+        variants.append((pin_str, process_pin(fname, lineno, pin_str)))
+    infile.close()
+    if len(variants) == 0:
+        qmasm.abend("No pin statements were found in %s" % fname)
+    return variants
+
 def process_chain(filename, lineno, chain_str):
     "Parse a chain statement into one or more Chain objects and add these to the program."
     # We use the LHS parser from PinParser to parse both sides of the chain.
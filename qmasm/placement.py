@@ -0,0 +1,210 @@
+###################################
+# Place logical variables for the #
+# layout-aware embedder           #
+# By Scott Pakin <pakin@lanl.gov> #
+###################################
+
+import hashlib
+import marshal
+import math
+import numpy
+import os
+import qmasm
+import sys
+try:
+    import scipy.sparse
+    import scipy.sparse.linalg
+except ImportError:
+    scipy = None
+
+# Largest connected component for which to compute eigenvectors with a dense
+# eigensolver
+dense_placement_limit = 2000
+
+class PlacementCache(object):
+    "Read and write a cached placement of a set of edges."
+
+    def __init__(self, edges):
+        # Ensure we have a valid cache directory.
+        self.hash = None
+        try:
+            self.cachedir = os.environ["QMASMCACHE"]
+        except KeyError:
+            self.cachedir = None
+            return None
+        if not os.path.isdir(self.cachedir):
+            qmasm.abend("QMASMCACHE is set to %s, which is not an extant directory" % self.cachedir)
+
+        # Compute a SHA-1 sum of our inputs.
+        sha = hashlib.sha1()
+        sha.update(str(sorted(edges)))
+        self.hash = "placement-" + sha.hexdigest()
+
+    def read(self):
+        "Read a placement from the cache or None on a cache miss."
+        if self.hash == None:
+            return None
+        try:
+            h = open(os.path.join(self.cachedir, self.hash))
+        except IOError:
+            return None
+        locations = marshal.load(h)
+        h.close()
+        return locations
+
+    def write(self, locations):
+        "Write a placement to the cache."
+        if self.hash == None:
+            return
+        try:
+            h = open(os.path.join(self.cachedir, self.hash), "w")
+        except IOError:
+            return None
+        marshal.dump(locations, h)
+        h.close()
+
+def _connected_components(n, u, v):
+    """Label the connected components of an n-vertex graph given as arrays of
+    edge endpoints.  Return an array of component labels."""
+    labels = numpy.arange(n)
+    while True:
+        # Propagate the smallest label across each edge then jump pointers.
+        old = labels.copy()
+        m = numpy.minimum(labels[u], labels[v])
+        numpy.minimum.at(labels, u, m)
+        numpy.minimum.at(labels, v, m)
+        labels = labels[labels]
+        if numpy.array_equal(labels, old):
+            return labels
+
+def _spectral_coordinates(k, u, v):
+    """Return a k x 2 array of coordinates for a connected graph of k
+    vertices, given as arrays of edge endpoints, from the eigenvectors of its
+    Laplacian corresponding to the two smallest nonzero eigenvalues."""
+    deg = numpy.bincount(u, minlength=k) + numpy.bincount(v, minlength=k)
+    if k <= dense_placement_limit:
+        # Small graph: Use a dense eigensolver.
+        L = numpy.diag(deg.astype(float))
+        numpy.add.at(L, (u, v), -1.0)
+        numpy.add.at(L, (v, u), -1.0)
+        vals, vecs = numpy.linalg.eigh(L)
+        return vecs[:, 1:3]
+    if scipy != None:
+        # Large graph, SciPy available: Use a sparse eigensolver, shifting
+        # the spectrum slightly so the Laplacian can be factored.
+        rows = numpy.concatenate([u, v, numpy.arange(k)])
+        cols = numpy.concatenate([v, u, numpy.arange(k)])
+        data = numpy.concatenate([-numpy.ones(2*len(u)), deg.astype(float)])
+        L = scipy.sparse.csc_matrix((data, (rows, cols)), shape=(k, k))
+        vals, vecs = scipy.sparse.linalg.eigsh(L, k=3, sigma=-1e-3, which="LM")
+        order = numpy.argsort(vals)
+        return vecs[:, order[1:3]]
+
+    # Large graph, no SciPy: Use degree-normalized power iteration (Koren,
+    # "Drawing graphs by eigenvectors: theory and practice", 2005), keeping
+    # each vector D-orthogonal to the constant vector and its predecessor.
+    rng = numpy.random.RandomState(0)
+    inv_deg = 1.0/deg
+    coords = numpy.empty((k, 2))
+    basis = [numpy.ones(k)/math.sqrt(k)]
+    for d in range(2):
+        x = rng.uniform(-1.0, 1.0, k)
+        for it in range(1000):
+            for b in basis:
+                x -= numpy.dot(x*deg, b)/numpy.dot(b*deg, b)*b
+            x /= numpy.linalg.norm(x)
+            Ax = numpy.bincount(u, weights=x[v], minlength=k) + numpy.bincount(v, weights=x[u], minlength=k)
+            new_x = 0.5*(x + inv_deg*Ax)
+            new_x /= numpy.linalg.norm(new_x)
+            if numpy.dot(new_x, x) > 1.0 - 1e-9:
+                x = new_x
+                break
+            x = new_x
+        coords[:, d] = x
+        basis.append(x)
+    return coords
+
+def _snap_to_grid(coords):
+    """Spread a k x 2 array of coordinates evenly over a roughly square grid
+    while preserving their relative order.  Return a k x 2 array of integer
+    grid coordinates."""
+    k = coords.shape[0]
+    ncols = int(math.ceil(math.sqrt(k)))
+    nrows = (k + ncols - 1)//ncols
+    grid = numpy.empty((k, 2), dtype=int)
+    by_x = numpy.argsort(coords[:, 0], kind="mergesort")
+    for c in range(ncols):
+        col = by_x[c*nrows:(c + 1)*nrows]
+        by_y = col[numpy.argsort(coords[col, 1], kind="mergesort")]
+        grid[by_y, 0] = c
+        grid[by_y, 1] = numpy.arange(len(by_y))
+    return grid
+
+def place_problem(edges, num_vars, verbosity):
+    """Compute integer locations for the variables of a logical problem
+    given its edges.  Each connected component is laid out by a spectral
+    drawing snapped to a grid, and the components are packed onto shelves.
+    Return a list of {x, y} lists indexed by variable number, as would
+    read_locations, with None for variables that appear in no edge."""
+    if len(edges) == 0:
+        return num_vars*[None]
+
+    # Consult the placement cache first.
+    pc = PlacementCache(edges)
+    locations = pc.read()
+    if locations != None:
+        if verbosity >= 2:
+            sys.stderr.write("Found node locations %s in the placement cache.\n\n" % pc.hash)
+        return locations
+    if verbosity >= 2:
+        sys.stderr.write("Computing node locations for the layout-aware embedder ...\n\n")
+
+    # Renumber the variables that appear in edges to 0, ..., n-1.
+    edge_array = numpy.array(sorted(edges), dtype=int).reshape(-1, 2)
+    vars_used, local = numpy.unique(edge_array, return_inverse=True)
+    local = local.reshape(-1, 2)
+    n = len(vars_used)
+    labels = _connected_components(n, local[:, 0], local[:, 1])
+
+    # Group vertices and edges by component.
+    vorder = numpy.argsort(labels, kind="mergesort")
+    vbounds = numpy.searchsorted(labels[vorder], numpy.arange(n + 1))
+    edge_labels = labels[local[:, 0]]
+    eorder = numpy.argsort(edge_labels, kind="mergesort")
+    ebounds = numpy.searchsorted(edge_labels[eorder], numpy.arange(n + 1))
+    sizes = vbounds[1:] - vbounds[:-1]
+    comps = numpy.nonzero(sizes)[0]
+    comps = comps[numpy.argsort(-sizes[comps], kind="mergesort")]
+
+    # Lay out each component individually, largest first.
+    total_width = int(math.ceil(math.sqrt(n))) + len(comps)
+    grid = numpy.empty((n, 2), dtype=int)
+    remap = numpy.empty(n, dtype=int)
+    shelf_x, shelf_y, shelf_h = 0, 0, 0
+    for c in comps:
+        members = vorder[vbounds[c]:vbounds[c + 1]]
+        k = len(members)
+        if k <= 2:
+            coords = numpy.arange(2*k, dtype=float).reshape(k, 2)
+        else:
+            remap[members] = numpy.arange(k)
+            cedges = local[eorder[ebounds[c]:ebounds[c + 1]]]
+            coords = _spectral_coordinates(k, remap[cedges[:, 0]], remap[cedges[:, 1]])
+        cgrid = _snap_to_grid(coords)
+        width = cgrid[:, 0].max() + 1
+        height = cgrid[:, 1].max() + 1
+
+        # Start a new shelf if the component doesn't fit on the current one.
+        if shelf_x > 0 and shelf_x + width > total_width:
+            shelf_x, shelf_y, shelf_h = 0, shelf_y + shelf_h + 1, 0
+        grid[members, 0] = cgrid[:, 0] + shelf_x
+        grid[members, 1] = cgrid[:, 1] + shelf_y
+        shelf_x += width + 1
+        shelf_h = max(shelf_h, height)
+
+    # Return a list of locations indexed by variable number.
+    locations = max(num_vars, int(vars_used.max()) + 1)*[None]
+    for q, (x, y) in zip(vars_used.tolist(), grid.tolist()):
+        locations[q] = [x, y]
+    pc.write(locations)
+    return locations
@@ -50,10 +50,15 @@ class Problem(object):
         self.strengths = defaultdict(lambda: 0.0)  # Map from a pair of spins to a coupler strength
         self.chains = {}     # Subset of strengths keys that represents chains
         self.pinned = []     # Pairs of {unique number, Boolean} to pin
+        self.pin_helpers = []     # Triples of {helper number, pinned number, Boolean} introduced by pin_qubits
         self.offset = 0.0    # Value to add to QUBO energy to convert to Ising energy or vice versa
         self.known_values = {}    # Map from symbol name to spin for values known a priori
+        self.anti_aliases = {}    # Map from symbol name to a symbol whose spin it always negates
+        self.free_spins = []      # Lists of {symbol name, sign} pairs, one per spin that can take either value
         self.simple_offset = 0.0  # Value to add to Ising energy to compensate for problem simplification
         self.assertions = []      # List of assertions (as ASTs) to enforce
+        self.payload = None       # Immutable form of a finalized physical problem
+        self.parts = None         # {offset, size} of each separately solved component's qubits
 
     def assign_chain_strength(self, ch_str):
         """Define a strength for each user-specified and automatically generated
@@ -108,6 +113,7 @@ class Problem(object):
             else:
                 self.weights[q_helper] += pin_str
             self.strengths[(q1, q2)] += -chain_str
+            self.pin_helpers.append((q_helper, q_user, b))
 
     def convert_to_ising(self):
         """Transform a QUBO problem into an Ising problem.  Return the new
@@ -122,6 +128,7 @@ class Problem(object):
         new_obj.weights.update({i: hvals[i] for i in range(len(hvals))})
         new_obj.offset = qoffset
         new_obj.qubo = False
+        new_obj.payload = None
         return new_obj
 
     def convert_to_qubo(self):
@@ -130,7 +137,11 @@ class Problem(object):
         if self.qubo:
             raise TypeError("Can convert only Ising problems to QUBO problems")
         new_obj = copy.deepcopy(self)
-        qmatrix, qoffset = ising_to_qubo(qmasm.dict_to_list(self.weights), self.strengths)
+        if self.payload == None:
+            weight_list = qmasm.dict_to_list(self.weights)
+        else:
+            weight_list = list(self.payload.weights)
+        qmatrix, qoffset = ising_to_qubo(weight_list, self.strengths)
         new_obj.offset = qoffset
         new_obj.weights = defaultdict(lambda: 0.0,
                                       {q1: wt
@@ -140,6 +151,7 @@ class Problem(object):
                                                           for (q1, q2), wt in qmatrix.items()
                                                           if q1 != q2})
         new_obj.qubo = True
+        new_obj.payload = None
         return new_obj
 
     def convert_chains_to_aliases(self):
@@ -198,6 +210,9 @@ class Problem(object):
             except KeyError:
                 new_q2 = q2
             if new_q1 == new_q2:
+                # Aliased qubits always agree, so the coupler contributes a
+                # constant energy.
+                self.simple_offset += wt
                 continue
             if new_q1 > new_q2:
                 new_q1, new_q2 = new_q2, new_q1
@@ -214,6 +229,20 @@ class Problem(object):
             new_pinned[new_q] = b
         self.pinned = sorted(new_pinned.items())
 
+        # Regenerate our pin helpers.
+        new_pin_helpers = []
+        for qh, qu, b in self.pin_helpers:
+            try:
+                new_qh = num2alias[qh].find().contents
+            except KeyError:
+                new_qh = qh
+            try:
+                new_qu = num2alias[qu].find().contents
+            except KeyError:
+                new_qu = qu
+            new_pin_helpers.append((new_qh, new_qu, b))
+        self.pin_helpers = new_pin_helpers
+
         # Regenerate the global symbol table.
         new_sym2num = {}
         for s, q in qmasm.sym_map.symbol_number_items():
@@ -235,6 +264,7 @@ class Problem(object):
                                    {qmap[q]: wt for q, wt in self.weights.items()})
         self.strengths = qmasm.canonicalize_strengths({(qmap[q1], qmap[q2]): wt for (q1, q2), wt in self.strengths.items()})
         self.pinned = [(qmap[q], b) for q, b in self.pinned]
+        self.pin_helpers = [(qmap[qh], qmap[qu], b) for qh, qu, b in self.pin_helpers]
         qmasm.sym_map.overwrite_with({s: qmap[q] for s, q in qmasm.sym_map.symbol_number_items()})
 
     def find_disconnected_variables(self):
@@ -253,3 +283,21 @@ class Problem(object):
             if num not in valid_nums:
                 invalid_syms.update(qmasm.sym_map.to_symbols(num))
         return invalid_syms
+
+    def connected_components(self):
+        """Partition the variables coupled by nonzero strengths into connected
+        components.  Return a list of sorted lists of variable numbers, ordered
+        by each component's smallest variable."""
+        num2set = {}  # Map from a qubit number to a disjoint set (which maps to a qubit number)
+        for (q1, q2), str in self.strengths.items():
+            if str == 0.0:
+                continue
+            if q1 not in num2set:
+                num2set[q1] = DisjointSet(q1)
+            if q2 not in num2set:
+                num2set[q2] = DisjointSet(q2)
+            num2set[q1].union(num2set[q2])
+        members = defaultdict(list)
+        for q in sorted(num2set.keys()):
+            members[num2set[q].find().contents].append(q)
+        return sorted(members.values())
@@ -4,9 +4,16 @@
 ###################################
 
 from collections import defaultdict
+try:
+    from dwave_sapi2.util import get_hardware_adjacency
+except ImportError:
+    from .fake_dwave import *
 import math
+import numpy
 import qmasm
+import struct
 import sys
+import zipfile
 
 class RemainingNextException(Exception):
     'This exception is thrown if a "!next." directive can\'t be replaced.'
@@ -64,29 +71,143 @@ class NonChimera(Exception):
     "Exception thrown when finding the topology of a non-Chimera graph."
     pass
 
-def chimera_topology(solver):
-    """Return the topology of the Chimera graph associated with a given solver.
-    Throw NonChimera if the topology is not known to be a Chimera graph."""
+class Topology(object):
+    """Represent a hardware graph.  Adjacency is stored in compressed sparse
+    row (CSR) form, and the Chimera parameters, if known, are derived only
+    once."""
+
+    def __init__(self, edges, nominal_qubits=None, chimera=None):
+        # Accept either a sequence of vertex pairs or an N x 2 array, which
+        # may be memory-mapped and is used without copying.
+        if isinstance(edges, numpy.ndarray):
+            self._edges = None
+            self.edge_array = edges.reshape(-1, 2)
+        else:
+            self._edges = list(edges)
+            self.edge_array = numpy.array(self._edges, dtype=numpy.int64).reshape(-1, 2)
+        self.num_qubits = nominal_qubits or 0
+        if len(self.edge_array) > 0:
+            self.num_qubits = max(self.num_qubits, int(self.edge_array.max()) + 1)
+
+        # Construct a symmetric CSR adjacency, discarding duplicate edges.
+        nq = max(self.num_qubits, 1)
+        src = numpy.concatenate((self.edge_array[:, 0], self.edge_array[:, 1])).astype(numpy.int64)
+        dst = numpy.concatenate((self.edge_array[:, 1], self.edge_array[:, 0])).astype(numpy.int64)
+        pairs = numpy.unique(src*nq + dst)
+        self.adj_targets = pairs % nq
+        self.adj_offsets = numpy.zeros(self.num_qubits + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.bincount(pairs // nq, minlength=self.num_qubits),
+                     out=self.adj_offsets[1:])
+
+        # Determine the Chimera parameters.
+        self.chimera = chimera       # {L, M, N} tuple or None if not Chimera
+        if chimera == None and nominal_qubits != None and len(self.edge_array) > 0:
+            self.chimera = self._derive_chimera(nominal_qubits)
+        self._edge_extents = None    # Column and row of each edge's farther cell
+        self._rectangles = {}        # Map from {width, height} to a set of edges
+
+    @property
+    def edges(self):
+        "Return the edges as a list of vertex pairs in their original order and orientation."
+        if self._edges == None:
+            self._edges = [tuple(e) for e in self.edge_array.tolist()]
+        return self._edges
+
+    def _derive_chimera(self, nominal_qubits):
+        """Derive {L, M, N} from the distribution of coupler lengths, assuming
+        the graph is a Chimera graph."""
+        deltas = numpy.abs(self.edge_array[:, 0] - self.edge_array[:, 1])
+        values, tallies = numpy.unique(deltas, return_counts=True)
+        order = numpy.lexsort((values, -tallies))
+        sorted_deltas = [int(d) for d in values[order]]
+        L = sorted_deltas[0]
+        M = 1
+        for d in sorted_deltas[1:]:
+            if d > 2*L:
+                M = d // (2*L)
+                break
+        N = (nominal_qubits + 2*L*M - 1) // (2*L*M)
+        return L, M, N
+
+    def chimera_parameters(self):
+        """Return {L, M, N} for a Chimera graph.  Throw NonChimera if the
+        graph is not known to be a Chimera graph."""
+        if self.chimera == None:
+            raise NonChimera
+        return self.chimera
+
+    def neighbors(self, q):
+        "Return an array of the qubits adjacent to a given qubit."
+        if q >= self.num_qubits:
+            return self.adj_targets[0:0]
+        return self.adj_targets[self.adj_offsets[q]:self.adj_offsets[q + 1]]
+
+    def cell_qubits(self, cell):
+        "Return the range of qubits in a given Chimera unit cell."
+        L2 = 2*self.chimera_parameters()[0]
+        return range(cell*L2, (cell + 1)*L2)
+
+    def rectangle_adjacency(self, edgex, edgey):
+        """Return the set of edges lying entirely within the upper-left
+        edgex by edgey unit cells of a Chimera graph."""
+        try:
+            return self._rectangles[(edgex, edgey)]
+        except KeyError:
+            pass
+        L, M, N = self.chimera_parameters()
+        if self._edge_extents == None:
+            cells = self.edge_array // (2*L)
+            self._edge_extents = ((cells % M).max(axis=1), (cells // M).max(axis=1))
+        cols, rows = self._edge_extents
+        mask = (cols < edgex) & (rows < edgey)
+        rect = set([self.edges[i] for i in numpy.nonzero(mask)[0]])
+        self._rectangles[(edgex, edgey)] = rect
+        return rect
+
+    def save(self, fname):
+        "Write the topology to a file."
+        if self.chimera == None:
+            chimera = numpy.zeros(0, dtype=numpy.int64)
+        else:
+            chimera = numpy.array(self.chimera, dtype=numpy.int64)
+        with open(fname, "wb") as f:
+            numpy.savez(f, edges=self.edge_array, chimera=chimera,
+                        num_qubits=numpy.array([self.num_qubits]))
+
+    @staticmethod
+    def load(fname):
+        "Read a topology from a file written by save."
+        data = numpy.load(fname)
+        chimera = tuple(data["chimera"].tolist()) or None
+        return Topology(data["edges"], int(data["num_qubits"][0]), chimera)
+
+# Map from a solver object's ID to a Topology object
+_solver_topologies = {}
+
+def solver_topology(solver):
+    """Return a Topology object describing a solver's hardware graph,
+    constructing it only once per solver.  Throw KeyError if the solver lacks
+    a fixed hardware graph."""
+    try:
+        return _solver_topologies[id(solver)][1]
+    except KeyError:
+        pass
     try:
         nominal_qubits = solver.properties["num_qubits"]
     except KeyError:
+        nominal_qubits = None
+    topo = Topology(get_hardware_adjacency(solver), nominal_qubits)
+    _solver_topologies[id(solver)] = (solver, topo)   # Keep solver alive so its ID isn't reused.
+    return topo
+
+def chimera_topology(solver):
+    """Return the topology of the Chimera graph associated with a given solver.
+    Throw NonChimera if the topology is not known to be a Chimera graph."""
+    if "num_qubits" not in solver.properties:
         # The Ising heuristic solver is an example of a solver that lacks a
         # fixed hardware representation.
         raise NonChimera
-    couplers = solver.properties["couplers"]
-    deltas = [abs(c1 - c2) for c1, c2 in couplers]
-    delta_tallies = {d: 0 for d in deltas}
-    for d in deltas:
-        delta_tallies[d] += 1
-        sorted_tallies = sorted(delta_tallies.items(), key=lambda dt: dt[1], reverse=True)
-    L = sorted_tallies[0][0]
-    M = 1
-    for d, t in sorted_tallies[1:]:
-        if d > 2*L:
-            M = d // (2*L)
-            break
-    N = (nominal_qubits + 2*L*M - 1) // (2*L*M)
-    return L, M, N
+    return solver_topology(solver).chimera_parameters()
 
 def edges_to_neighbor_list(pairs):
     "Return a mapping from each node to every node it touches."
@@ -157,6 +278,53 @@ def canonicalize_strengths(strs):
         new_strs[(q1, q2)] += wt
     return new_strs
 
+def load_npz(fname):
+    """Load all arrays from a .npz file.  Arrays stored uncompressed (as
+    numpy.savez and QMASM's npz writers store them) are returned as read-only
+    memory maps of the file itself rather than being copied into memory."""
+    arrays = {}
+    with zipfile.ZipFile(fname) as zf, open(fname, "rb") as raw:
+        for info in zf.infolist():
+            name = info.filename
+            if name.endswith(".npy"):
+                name = name[:-4]
+            if info.compress_type != zipfile.ZIP_STORED:
+                with zf.open(info) as member:
+                    arrays[name] = numpy.lib.format.read_array(member)
+                continue
+
+            # Skip the member's local file header to find the start of its
+            # .npy data then parse the .npy header.
+            raw.seek(info.header_offset)
+            header = raw.read(30)
+            name_len, extra_len = struct.unpack("<HH", header[26:30])
+            raw.seek(info.header_offset + 30 + name_len + extra_len)
+            version = numpy.lib.format.read_magic(raw)
+            if version == (1, 0):
+                shape, fortran, dtype = numpy.lib.format.read_array_header_1_0(raw)
+            else:
+                shape, fortran, dtype = numpy.lib.format.read_array_header_2_0(raw)
+            if dtype.hasobject:
+                raise ValueError("%s contains Python objects, which cannot be memory-mapped" % info.filename)
+            if len(shape) == 0 or 0 in shape:
+                # Scalars and empty arrays are cheaper to read than to map.
+                count = int(numpy.prod(shape))
+                data = numpy.frombuffer(raw.read(count*dtype.itemsize), dtype=dtype, count=count)
+                arrays[name] = data.reshape(shape)
+                continue
+            arrays[name] = numpy.memmap(fname, dtype=dtype, mode="r",
+                                        offset=raw.tell(), shape=shape,
+                                        order="F" if fortran else "C")
+    return arrays
+
+def decode_string_table(chars, indptr):
+    """Convert a UTF-8 byte array and an array of offsets into it, as written
+    to .npz files by QMASM, to a list of strings."""
+    data = numpy.asarray(chars).tobytes()
+    offsets = numpy.asarray(indptr).tolist()
+    return [data[offsets[i]:offsets[i + 1]].decode("utf-8")
+            for i in range(len(offsets) - 1)]
+
 class SymbolMapping:
     "Map between symbols and numbers."
 
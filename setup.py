@@ -29,7 +29,8 @@ setup(name = "QMASM",
       url = "https://github.com/lanl/qmasm",
       license = "BSD",
       keywords = "quantum assembler d-wave",
-      packages = find_packages(),
+      packages = find_packages(exclude=["benchmarks"]),
       scripts = [s + ".py" for s in script_list],
+      install_requires = ["numpy"],
       cmdclass = {"install": install}
 )
@@ -0,0 +1,49 @@
+###################################
+# Helpers for QMASM's tests       #
+# By Scott Pakin <pakin@lanl.gov> #
+###################################
+
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+# Directories of interest
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+top_dir = os.path.dirname(tests_dir)
+examples_dir = os.path.join(top_dir, "examples")
+
+def example(name):
+    "Return the absolute filename of an example program."
+    return os.path.join(examples_dir, name)
+
+def run_qmasm(*args, **kwargs):
+    """Run QMASM in a scratch directory, which is removed afterwards, so
+    files that the embedders write to the current directory don't land in
+    the source tree.  The program text can be passed as stdin=TEXT.  Return
+    QMASM's standard output as a byte string."""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = top_dir + os.pathsep + env.get("PYTHONPATH", "")
+    env["QMASMPATH"] = examples_dir
+    env.pop("QMASMCACHE", None)
+    cmd = [sys.executable, os.path.join(top_dir, "qmasm.py")] + list(args)
+    scratch = tempfile.mkdtemp(prefix="qmasm-test-")
+    try:
+        proc = subprocess.Popen(cmd, cwd=scratch, env=env,
+                                stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = proc.communicate(kwargs.get("stdin", "").encode("utf-8"))
+    finally:
+        shutil.rmtree(scratch, True)
+    if proc.returncode != 0:
+        raise RuntimeError("%s failed: %s" % (" ".join(cmd), err.decode("utf-8")))
+    return out
+
+def ground_energy(output):
+    "Return the energy of the first solution in QMASM's textual output."
+    match = re.search(r"\(energy = (-?[0-9.]+),", output.decode("utf-8"))
+    if match == None:
+        raise ValueError("No solution found in QMASM's output")
+    return float(match.group(1))
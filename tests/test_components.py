@@ -0,0 +1,49 @@
+###################################
+# Test the joining of separately  #
+# solved components' answers      #
+# By Scott Pakin <pakin@lanl.gov> #
+###################################
+
+import sys
+import unittest
+from common import top_dir
+
+sys.path.insert(0, top_dir)
+from qmasm.dwave import join_answers
+
+class TestJoinAnswers(unittest.TestCase):
+    "Ensure that joining components' answers finds every joint ground state."
+
+    parts = [(0, 2), (2, 2)]
+    answers = [
+        {"solutions": [[-1, +1], [+1, -1], [+1, +1]],
+         "energies": [-2.0, -2.0, 1.0],
+         "num_occurrences": [5, 3, 2]},
+        {"solutions": [[+1, +1], [-1, -1], [-1, +1]],
+         "energies": [-3.0, -3.0, 0.5],
+         "num_occurrences": [4, 4, 2]}
+    ]
+
+    def test_ground_states(self):
+        "Every combination of the components' ground states is reported first."
+        joint = join_answers(self.parts, self.answers)
+        ground = [tuple(s) for s, e in zip(joint["solutions"], joint["energies"]) if e == -5.0]
+        self.assertEqual(set(ground), set([(-1, +1, +1, +1), (-1, +1, -1, -1),
+                                           (+1, -1, +1, +1), (+1, -1, -1, -1)]))
+        self.assertEqual(joint["energies"][:4], [-5.0]*4)
+        self.assertEqual(len(ground), 4)
+        self.assertEqual(sorted(joint["energies"]), joint["energies"])
+
+    def test_ground_state_limit(self):
+        "No more than the requested number of ground states are combined."
+        joint = join_answers(self.parts, self.answers, max_ground_states=2)
+        self.assertEqual(joint["energies"].count(-5.0), 2)
+
+    def test_empty_component(self):
+        "A component with no solutions yields no joint solutions."
+        empty = {"solutions": [], "energies": [], "num_occurrences": []}
+        joint = join_answers(self.parts, [self.answers[0], empty])
+        self.assertEqual(joint["solutions"], [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+###################################
+# Test that simplification        #
+# preserves solution energies     #
+# By Scott Pakin <pakin@lanl.gov> #
+###################################
+
+import unittest
+from common import example, ground_energy, run_qmasm
+
+class TestSimplifiedEnergies(unittest.TestCase):
+    "Ensure that every optimization level reports the same ground-state energy."
+
+    def exact_energy(self, level, *args, **kwargs):
+        "Return the ground-state energy an exact solve reports at a given -O level."
+        return ground_energy(run_qmasm("-O%d" % level, "-f", "exact", "--run", *args, **kwargs))
+
+    def test_small_program(self):
+        "Roof duality fixes one variable of a two-variable program."
+        prog = "A 1\nB -1\nA B -0.25\n"
+        self.assertAlmostEqual(self.exact_energy(0, stdin=prog), -1.75)
+        self.assertAlmostEqual(self.exact_energy(1, stdin=prog), -1.75)
+
+    def test_examples(self):
+        "Alias conversion, roof duality, and presolve all shift the energy."
+        for name in ["sort4.qmasm", "circsat.qmasm", "maze3x3.qmasm"]:
+            e0 = self.exact_energy(0, example(name))
+            for level in [1, 2]:
+                self.assertAlmostEqual(self.exact_energy(level, example(name)), e0,
+                                       msg="%s at -O%d" % (name, level))
+
+    def test_fully_determined(self):
+        "A program that simplification solves outright reports its true energy."
+        prog = "A -1\nB 0.5\nA B -1\n"
+        e0 = self.exact_energy(0, stdin=prog)
+        self.assertAlmostEqual(e0, -1.5)
+        out = run_qmasm("-O1", "--run", stdin=prog)
+        self.assertAlmostEqual(ground_energy(out), e0)
+        self.assertAlmostEqual(self.exact_energy(1, stdin=prog), e0)
+
+if __name__ == "__main__":
+    unittest.main()
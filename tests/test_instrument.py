@@ -0,0 +1,45 @@
+###################################
+# Test QMASM's stage profiler     #
+# By Scott Pakin <pakin@lanl.gov> #
+###################################
+
+import sys
+import threading
+import unittest
+from common import top_dir
+
+sys.path.insert(0, top_dir)
+from qmasm.instrument import StageProfiler
+
+class TestStageProfiler(unittest.TestCase):
+    "Ensure that stages can be measured from multiple threads."
+
+    def test_concurrent_stages(self):
+        "Nested stages and counters recorded by other threads are all retained."
+        prof = StageProfiler()
+        prof.enable()
+        nthreads = 4
+        nstages = 200
+
+        def worker():
+            for i in range(nstages):
+                with prof.measure("wait"):
+                    prof.add("waits")
+
+        threads = [threading.Thread(target=worker) for _ in range(nthreads)]
+        for t in threads:
+            t.start()
+        for i in range(nstages):
+            prof.start("stage%d" % i)
+        for t in threads:
+            t.join()
+        prof.finish()
+
+        self.assertEqual(prof.counters["waits"], nthreads*nstages)
+        waits = [s for s in prof.stages if s["name"].endswith("wait")]
+        self.assertEqual(len(waits), nthreads*nstages)
+        self.assertEqual(len(prof.stages), nthreads*nstages + nstages)
+        self.assertTrue(all(["wall" in s for s in prof.stages]))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+###################################
+# Test QMASM's structured output  #
+# By Scott Pakin <pakin@lanl.gov> #
+###################################
+
+import json
+import os
+import tempfile
+import unittest
+from common import example, run_qmasm, top_dir
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+class TestStructuredValues(unittest.TestCase):
+    "Ensure that structured output is all that appears on standard output."
+
+    embed_args = ["--embed-method=dense",
+                  "--topology-file=" + os.path.join(top_dir, "extras", "chimera16.txt"),
+                  "--run"]
+
+    def run_embedded(self, *args):
+        "Embed and run a program.  Return QMASM's standard output."
+        return run_qmasm(*(self.embed_args + list(args)))
+
+    def run_batch(self, values):
+        "Run a two-variant batch of and4.qmasm.  Return QMASM's standard output."
+        pins = tempfile.NamedTemporaryFile(mode="w", suffix=".txt", delete=False)
+        try:
+            pins.write("big_and.Y := true\nbig_and.A := false\n")
+            pins.close()
+            return self.run_embedded("--values=" + values, "--batch=" + pins.name,
+                                     example("and4.qmasm"))
+        finally:
+            os.remove(pins.name)
+
+    def check_records(self, records):
+        "Ensure that a sequence of stream records ends in a metrics record."
+        self.assertTrue(len(records) > 1)
+        self.assertEqual(records[-1]["type"], "metrics")
+        self.assertTrue(all([r["type"] == "solution" for r in records[:-1]]))
+
+    def check_batch_records(self, records):
+        "Ensure that every record is tagged with its batch variant."
+        expected_pins = {1: {"big_and.Y": True}, 2: {"big_and.A": False}}
+        self.assertEqual(set([r["variant"] for r in records]), set([1, 2]))
+        for vnum, pins in expected_pins.items():
+            vrecords = [r for r in records if r["variant"] == vnum]
+            self.check_records(vrecords)
+            for r in vrecords:
+                self.assertEqual(r["pins"], pins)
+
+    def unpack(self, data):
+        "Decode a byte string of concatenated MessagePack maps."
+        unpacker = msgpack.Unpacker(raw=False)
+        unpacker.feed(data)
+        return list(unpacker)
+
+    def test_json_after_embedding(self):
+        "An embedded run's --values=json output is a single JSON document."
+        doc = json.loads(self.run_embedded("--values=json", example("sort4.qmasm")).decode("utf-8"))
+        self.assertTrue(len(doc["solutions"]) > 0)
+        for soln in doc["solutions"]:
+            self.assertIn("spins", soln)
+            self.assertIn("energy", soln)
+        self.assertIn("physical", doc["metrics"])
+
+    def test_ndjson_after_embedding(self):
+        "Every line of an embedded run's --values=ndjson output is a JSON record."
+        lines = self.run_embedded("--values=ndjson", example("sort4.qmasm")).decode("utf-8").splitlines()
+        self.check_records([json.loads(ln) for ln in lines])
+
+    @unittest.skipIf(msgpack == None, "the msgpack module is not installed")
+    def test_msgpack_after_embedding(self):
+        "An embedded run's --values=msgpack output is a sequence of MessagePack maps."
+        self.check_records(self.unpack(self.run_embedded("--values=msgpack", example("sort4.qmasm"))))
+
+    def test_json_batch(self):
+        "A batch's --values=json output is a single JSON document with one entry per variant."
+        doc = json.loads(self.run_batch("json").decode("utf-8"))
+        self.assertEqual([v["variant"] for v in doc["variants"]], [1, 2])
+        self.assertEqual(doc["variants"][0]["pins"], {"big_and.Y": True})
+        self.assertEqual(doc["variants"][1]["pins"], {"big_and.A": False})
+        for v in doc["variants"]:
+            self.assertTrue(len(v["solutions"]) > 0)
+            self.assertIn("physical", v["metrics"])
+
+    def test_ndjson_batch(self):
+        "Every line of a batch's --values=ndjson output is a JSON record tagged with its variant."
+        lines = self.run_batch("ndjson").decode("utf-8").splitlines()
+        self.check_batch_records([json.loads(ln) for ln in lines])
+
+    @unittest.skipIf(msgpack == None, "the msgpack module is not installed")
+    def test_msgpack_batch(self):
+        "Every record of a batch's --values=msgpack output is tagged with its variant."
+        self.check_batch_records(self.unpack(self.run_batch("msgpack")))
+
+if __name__ == "__main__":
+    unittest.main()